@@ -0,0 +1,184 @@
+################################################################################
+# Betweenness centrality of a directed, unweighted graph.
+#
+# Brandes' algorithm, with each single-source pass done level by level on the
+# CSR arrays rather than node by node in Python. Two modes;
+# - exact: every node is a source. Sources are sharded across a process pool
+#   and each worker reads the same memory-mapped copy of the adjacency (see
+#   graph_store.py), so the graph is written once rather than pickled to
+#   every worker.
+# - approximate: only k pivot sources, drawn at random with a seed, and the
+#   result is scaled by n/k. An error bound that holds for every node at once
+#   with the requested confidence is reported alongside.
+#
+# Values match nx.betweenness_centrality (normalized, endpoints excluded).
+################################################################################
+import math
+import os
+import shutil
+import tempfile
+import numpy as np
+from csr_graph import CSRGraph
+from graph_store import read_graph, write_graph
+from parallel import default_processes, pool_context
+
+# graph each worker reads, set by _init_worker
+_worker_graph = None
+
+
+class BetweennessResult:
+    """
+    Betweenness values plus how they were computed. For the approximate
+    mode, |estimate - exact| <= epsilon for every node at once with
+    probability at least `confidence`. epsilon is 0 for the exact mode.
+    """
+
+    def __init__(self, values, k, epsilon, confidence):
+        self.values = values
+        self.k = k
+        self.epsilon = epsilon
+        self.confidence = confidence
+
+    def __repr__(self):
+        return "BetweennessResult(k={}, epsilon={:.4g}, confidence={})".format(
+            self.k, self.epsilon, self.confidence)
+
+
+def single_source_dependencies(indptr, indices, source):
+    """
+    Dependency of `source` on every node: the sum over targets t of the
+    fraction of shortest source -> t paths that pass through each node.
+
+    :param indptr: CSR row pointers
+    :param indices: CSR column indices
+    :param source: integer id of the source node
+    :return: float64 array, one entry per node
+    """
+    n = len(indptr) - 1
+    dist = np.full(n, -1, dtype=np.int32)
+    sigma = np.zeros(n, dtype=np.float64)
+    dist[source] = 0
+    sigma[source] = 1.0
+
+    # walk out from the source one level at a time, keeping the edges of the
+    # shortest path DAG for each level
+    levels = []
+    frontier = np.array([source], dtype=np.int64)
+    d = 0
+    while len(frontier):
+        starts = indptr[frontier]
+        counts = indptr[frontier + 1] - starts
+        total = counts.sum()
+        if total == 0:
+            break
+        u = np.repeat(frontier, counts)
+        offsets = np.arange(total) + np.repeat(starts - (np.cumsum(counts) -
+                                                         counts), counts)
+        v = np.asarray(indices[offsets], dtype=np.int64)
+
+        dist[v[dist[v] == -1]] = d + 1
+        on_dag = dist[v] == d + 1
+        u, v = u[on_dag], v[on_dag]
+        np.add.at(sigma, v, sigma[u])
+        levels.append((u, v))
+        frontier = np.unique(v)
+        d += 1
+
+    # back-propagate dependencies from the furthest level in
+    delta = np.zeros(n, dtype=np.float64)
+    for u, v in reversed(levels):
+        np.add.at(delta, u, sigma[u] / sigma[v] * (1.0 + delta[v]))
+    delta[source] = 0.0
+    return delta
+
+
+def _accumulate(indptr, indices, sources):
+    total = np.zeros(len(indptr) - 1, dtype=np.float64)
+    for s in sources:
+        total += single_source_dependencies(indptr, indices, s)
+    return total
+
+
+def _init_worker(path):
+    global _worker_graph
+    _worker_graph = read_graph(path)
+
+
+def _worker_accumulate(sources):
+    return _accumulate(_worker_graph.indptr, _worker_graph.indices, sources)
+
+
+def _parallel_accumulate(graph, sources, processes):
+    """
+    Sum the dependencies of all sources using a pool of processes reading a
+    shared memory-mapped copy of the graph.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='betweenness')
+    try:
+        path = os.path.join(tmp_dir, 'adjacency.graph')
+        src, dst = graph.edge_arrays()
+        write_graph(CSRGraph.from_edges(src, dst, np.arange(
+            graph.number_of_nodes()).astype(str).astype(object)), path)
+
+        # several shards per process so a few slow sources don't hold up
+        # the whole pool
+        shards = np.array_split(sources, max(1, processes * 8))
+        total = np.zeros(graph.number_of_nodes(), dtype=np.float64)
+        with pool_context().Pool(processes, initializer=_init_worker,
+                                  initargs=(path,)) as pool:
+            for partial in pool.imap_unordered(_worker_accumulate,
+                                               [s for s in shards if len(s)]):
+                total += partial
+        return total
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def betweenness_centrality(graph, k=None, seed=None, processes=None,
+                           normalized=True, confidence=0.95):
+    """
+    Betweenness centrality of every node in a directed graph.
+
+    :param graph: CSRGraph or SubgraphView
+    :param k: number of pivot sources for the approximate mode. None (the
+    default) uses every node as a source, i.e. the exact mode.
+    :param seed: random seed for choosing pivots
+    :param processes: number of worker processes. Default is one per core;
+    1 runs in this process.
+    :param normalized: scale by 1/((n-1)(n-2)) like networkx does
+    :param confidence: confidence level for the reported error bound of the
+    approximate mode
+    :return: BetweennessResult, values aligned to the graph's node ids
+    """
+    n = graph.number_of_nodes()
+    if k is None or k >= n:
+        k = n
+        sources = np.arange(n)
+    else:
+        sources = np.sort(np.random.RandomState(seed).choice(n, k,
+                                                             replace=False))
+
+    processes = default_processes(processes)
+    if processes > 1 and len(sources) > 1:
+        values = _parallel_accumulate(graph, sources, processes)
+    else:
+        g = graph if isinstance(graph, CSRGraph) else graph.materialize()
+        values = _accumulate(g.indptr, g.indices, sources)
+
+    # scale like networkx: 1/((n-1)(n-2)) when normalized, and n/k for
+    # pivots standing in for every source
+    scale = 1.0
+    if normalized and n > 2:
+        scale = 1.0 / ((n - 1) * (n - 2))
+    if k < n:
+        scale *= n / k
+    values *= scale
+
+    epsilon = 0.0
+    if k < n and n > 2:
+        # each pivot contributes a value in [0, n/(n-1)] (normalized) to the
+        # mean. Hoeffding's inequality, with a union bound over the n nodes
+        upper = n / (n - 1.0) if normalized else n * (n - 2.0)
+        epsilon = upper * math.sqrt(math.log(2.0 * n / (1 - confidence)) /
+                                    (2.0 * k))
+    return BetweennessResult(values, k, epsilon, confidence)
@@ -0,0 +1,152 @@
+################################################################################
+# Crawl a fake following graph with the Crawler of
+# get_following_list_per_user.py, served by fake_twitter.py, and check;
+# - every user's line in the output file holds exactly who they follow
+# - the journal ends with every user done (or failed with twitter's response
+#   code) and no pages left over
+# - a user left part way through resumes from the cursor in the journal
+#   rather than from their first page
+# - a credential over its rate limit gets a 429, waits for the window to
+#   reset and carries on, without losing the page it asked for
+# - pages answered with a 503 are asked for again, and a user is only given
+#   up on once every attempt at a page has failed
+#
+# Run from src/;
+#   python check_crawler.py
+# It takes a few seconds, waiting out the fake's short rate limit windows.
+#
+# Input / Output:
+# a temporary directory, removed afterwards
+################################################################################
+import asyncio
+import os
+import shutil
+import tempfile
+from requests_oauthlib import OAuth1
+import get_following_list_per_user as crawl
+from crawl_journal import CrawlJournal, DONE, FAILED
+from fake_twitter import random_fake, serve
+
+# a user the fake doesn't know, so friends/ids answers 404
+MISSING_USER = '999999'
+
+
+def credentials(n):
+    return [OAuth1('key', 'secret', 'token{}'.format(i), 'token secret')
+            for i in range(n)]
+
+
+def read_output(path):
+    """
+    :return: dict of user -> list of the ids on their line
+    """
+    lines = {}
+    with open(path, 'r') as f:
+        for line in f:
+            user, _, ids = line.partition(" ")
+            assert user not in lines, "{} written twice".format(user)
+            lines[user] = ids.split()
+    return lines
+
+
+def check_crawl(folder):
+    fake = random_fake(n_users=30, page_size=3,
+                       limits={'friends/ids': 10}, window=2)
+    server, base = serve(fake)
+    crawl.output_file = os.path.join(folder, 'saved_users.txt')
+    crawl.log_file = os.path.join(folder, 'following_list_log.txt')
+    users = sorted(fake.following) + [MISSING_USER]
+
+    # a user with several pages, left after their first one by an earlier run
+    resumed = next(u for u in users if len(fake.following.get(u, [])) > 6)
+    # the first credential starts with its window used up
+    for _ in range(10):
+        fake.take('friends/ids', 'token0')
+
+    try:
+        with CrawlJournal(os.path.join(folder, 'journal.sqlite')) as journal:
+            journal.add_users([resumed])
+            journal.page(resumed, fake.following[resumed][:3], '3')
+
+            crawler = crawl.Crawler(credentials(2), base, journal)
+            asyncio.run(crawler.crawl(users))
+
+            # journal: everyone done but the missing user, no pages left
+            assert journal.counts() == {DONE: len(users) - 1, FAILED: 1}, \
+                journal.counts()
+            state, status = journal.db.execute(
+                "SELECT state, status FROM users WHERE user_id=?",
+                (MISSING_USER,)).fetchone()
+            assert (state, status) == (FAILED, 404), (state, status)
+            assert journal.db.execute(
+                "SELECT COUNT(*) FROM pages").fetchone()[0] == 0
+    finally:
+        server.shutdown()
+
+    # output: one line per user crawled, with all of their ids in order
+    lines = read_output(crawl.output_file)
+    assert set(lines) == set(fake.following)
+    for user, ids in fake.following.items():
+        assert lines[user] == ids, user
+
+    # the resumed user was picked up at the journal's cursor
+    cursors = [p['cursor'] for p in fake.responses('friends/ids', 200)
+               if p['user_id'] == resumed]
+    assert cursors and '-1' not in cursors and cursors[0] == '3', cursors
+
+    # the 429 was waited out; no request was lost to it
+    assert fake.responses('friends/ids', 429)
+    with open(crawl.log_file, 'r') as log:
+        logged = log.read()
+    assert "user " + MISSING_USER in logged and "code 404" in logged
+    assert "code 429" not in logged
+
+
+def check_retries(folder):
+    # 3 in 10 requests fail; with enough attempts every list comes through
+    fake = random_fake(n_users=30, page_size=3, error_rate=0.3, seed=3,
+                       limits={'friends/ids': 1000})
+    server, base = serve(fake)
+    crawl.output_file = os.path.join(folder, 'retried_users.txt')
+    crawl.log_file = os.path.join(folder, 'retried_log.txt')
+    try:
+        with CrawlJournal(os.path.join(folder, 'retried.sqlite')) as journal:
+            crawler = crawl.Crawler(credentials(2), base, journal,
+                                    retries=20, backoff=0.01)
+            asyncio.run(crawler.crawl(sorted(fake.following)))
+            assert journal.counts() == {DONE: len(fake.following)}, \
+                journal.counts()
+    finally:
+        server.shutdown()
+    assert fake.responses('friends/ids', 503)
+    assert not os.path.exists(crawl.log_file)
+    lines = read_output(crawl.output_file)
+    for user, ids in fake.following.items():
+        assert lines[user] == ids, user
+
+    # every request fails; each user is tried `retries` times, then failed
+    fake = random_fake(n_users=5, error_rate=1.0,
+                       limits={'friends/ids': 1000})
+    server, base = serve(fake)
+    try:
+        with CrawlJournal(os.path.join(folder, 'given_up.sqlite')) as journal:
+            crawler = crawl.Crawler(credentials(1), base, journal,
+                                    retries=3, backoff=0.01)
+            asyncio.run(crawler.crawl(sorted(fake.following)))
+            assert journal.db.execute(
+                "SELECT DISTINCT state, status FROM users").fetchall() == \
+                [(FAILED, 503)]
+    finally:
+        server.shutdown()
+    asked = [p['user_id'] for p in fake.responses('friends/ids', 503)]
+    assert sorted(asked) == sorted(list(fake.following) * 3), asked
+
+
+if __name__ == '__main__':
+    folder = tempfile.mkdtemp()
+    try:
+        check_crawl(folder)
+        check_retries(folder)
+    finally:
+        shutil.rmtree(folder)
+    print("crawler ok")
@@ -0,0 +1,111 @@
+################################################################################
+# Look up users with the LookupClient of users_lookup.py against
+# fake_twitter.py, streaming them into a user table the way
+# get_all_users_info.py does, and check;
+# - batches answered with a 503 are retried until they come through
+# - a run stopped part way leaves its finished batches in the table's
+#   _manifest.jsonl, and the next run only looks up the others
+# - the table ends with one row per user, flagged with their corpora
+#
+# Run from src/;
+#   python check_users_lookup.py
+#
+# Input / Output:
+# a temporary directory, removed afterwards
+################################################################################
+import asyncio
+import os
+import shutil
+import tempfile
+from requests_oauthlib import OAuth1
+from fake_twitter import random_fake, serve
+from user_table import UserTableWriter, read_user_table
+from users_lookup import LookupClient, batch_key
+
+CORPORA = ['latinx', 'todes']
+# screen names per batch, small so there are plenty of batches
+BATCH = 10
+
+
+def corpus_batches(names):
+    """
+    :return: list of (key, corpus, comma separated names); the first 2/3 of
+    the names are latinx and the last 2/3 todes, so some are in both
+    """
+    third = len(names) // 3
+    members = {'latinx': names[:2 * third], 'todes': names[third:]}
+    batches = []
+    for corpus in CORPORA:
+        for i in range(0, len(members[corpus]), BATCH):
+            names_batch = ",".join(members[corpus][i:i + BATCH])
+            batches.append((corpus + ":" + batch_key(names_batch), corpus,
+                            names_batch))
+    return members, batches
+
+
+def look_up(base, path, batches):
+    """
+    Look up batches into the table at path, skipping the ones its manifest
+    says are stored, as get_all_users_info.call_twitter does.
+
+    :return: (keys looked up, keys of batches that failed)
+    """
+    with UserTableWriter(path, batch_rows=25) as table:
+        done = table.done_batches()
+        todo = [(key, names) for key, corpus, names in batches
+                if (corpus, key) not in done]
+        corpus_of = {key: corpus for key, corpus, _ in batches}
+
+        def on_result(key, users):
+            table.add(users, corpus_of[key], key=key)
+
+        client = LookupClient([OAuth1('key', 'secret', 'token', 'secret')],
+                              base, retries=20, backoff=0.01)
+        asyncio.run(client.run(todo, on_result))
+    return [key for key, _ in todo], client.failed
+
+
+def check_lookup(folder):
+    fake = random_fake(n_users=120, error_rate=0.3, seed=7)
+    server, base = serve(fake)
+    path = os.path.join(folder, 'user_table')
+    members, batches = corpus_batches(sorted(fake.profiles))
+
+    try:
+        # a first run that stops after half of the batches
+        first, failed = look_up(base, path, batches[:len(batches) // 2])
+        assert not failed, failed
+        requested = len(fake.requests)
+
+        # the rerun only asks for the batches not in the manifest
+        second, failed = look_up(base, path, batches)
+        assert not failed, failed
+        assert set(first).isdisjoint(second)
+        assert set(first) | set(second) == {key for key, _, _ in batches}
+        asked = {p['screen_name'] for _, p, status in
+                 fake.requests[requested:] if status == 200}
+        assert asked == {names for key, _, names in batches
+                         if key in second}
+
+        # the 503s were retried rather than given up on
+        assert fake.responses('users/lookup', 503)
+    finally:
+        server.shutdown()
+
+    # one row per user, flagged with each corpus they were looked up for
+    df = read_user_table(path, corpora=CORPORA).set_index('screen_name')
+    assert sorted(df.index) == sorted(fake.profiles)
+    for corpus in CORPORA:
+        assert set(df.index[df[corpus] == 1]) == set(members[corpus]), corpus
+    for name, profile in fake.profiles.items():
+        assert df.loc[name, 'id_str'] == profile['id_str']
+        assert df.loc[name, 'followers_count'] == profile['followers_count']
+
+
+if __name__ == '__main__':
+    folder = tempfile.mkdtemp()
+    try:
+        check_lookup(folder)
+    finally:
+        shutil.rmtree(folder)
+    print("users lookup ok")
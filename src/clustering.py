@@ -0,0 +1,190 @@
+################################################################################
+# Clustering coefficients of a directed graph from triangle counts on its
+# sparse adjacency A, instead of networkx's neighbour set intersections.
+#
+# With S = A + A^T (2 where a follow is returned), the number of directed
+# triangles through node i is diag(S^3)_i / 2, and its clustering, as in
+# nx.clustering on a DiGraph, is
+#   diag(S^3)_i / (2 (dtot_i (dtot_i - 1) - 2 dbi_i))
+# where dtot is in + out degree and dbi the number of reciprocated follows.
+# Self-loops are dropped from A first; like networkx, they count neither as
+# triangles nor towards the degrees.
+# The undirected coefficient (nx.clustering of the undirected graph) uses
+# the 0/1 version of S and its degrees. diag(S^3) is worked out a block of
+# rows at a time, and blocks are shared out across a process pool.
+#
+# For the average over all nodes there is also an estimator that, like
+# networkx's approximation.average_clustering, checks whether two random
+# neighbours of a random node are linked. It keeps sampling until the
+# confidence interval is as narrow as asked for, and reports the interval.
+################################################################################
+import math
+import numpy as np
+import scipy.sparse as sp
+from scipy.stats import norm
+from parallel import default_processes, pool_context
+
+# symmetric adjacency each worker computes blocks of, set by _init_worker
+_worker_s = None
+
+
+class ClusteringEstimate:
+    """
+    Sampled average clustering coefficient, with a confidence interval
+    (Wilson score) that holds with probability `confidence`.
+    """
+
+    def __init__(self, value, low, high, trials, confidence):
+        self.value = value
+        self.low = low
+        self.high = high
+        self.trials = trials
+        self.confidence = confidence
+
+    def __repr__(self):
+        return "ClusteringEstimate({:.4g}, {:.0%} CI [{:.4g}, {:.4g}], " \
+               "trials={})".format(self.value, self.confidence, self.low,
+                                   self.high, self.trials)
+
+
+def _symmetric(graph, directed):
+    a = graph.adjacency(dtype=np.int64).tocoo()
+    keep = a.row != a.col
+    a = sp.csr_matrix((a.data[keep], (a.row[keep], a.col[keep])),
+                      shape=a.shape)
+    s = (a + a.T).tocsr()
+    if not directed:
+        s.data[:] = 1
+    s.sort_indices()
+    return a, s
+
+
+def _cube_diagonal(s, rows):
+    # diag(S^3) over a block of rows, using S = S^T
+    block = s[rows]
+    return np.asarray(block.dot(s).multiply(block).sum(axis=1)).ravel()
+
+
+def _init_worker(s):
+    global _worker_s
+    _worker_s = s
+
+
+def _worker_cube_diagonal(rows):
+    return rows, _cube_diagonal(_worker_s, rows)
+
+
+def local_clustering(graph, directed=True, processes=None, block_size=4096):
+    """
+    Clustering coefficient of every node.
+
+    :param graph: CSRGraph or SubgraphView
+    :param directed: True for the directed coefficient of nx.clustering on a
+    DiGraph, False for that of the undirected graph
+    :param processes: number of worker processes. Default is one per core;
+    1 runs in this process.
+    :param block_size: number of rows of S^3 worked out at once
+    :return: float64 array, one entry per node; 0 for nodes with no
+    possible triangles
+    """
+    a, s = _symmetric(graph, directed)
+    n = s.shape[0]
+    blocks = [np.arange(start, min(start + block_size, n))
+              for start in range(0, n, block_size)]
+
+    cube = np.zeros(n, dtype=np.float64)
+    processes = default_processes(processes)
+    if processes > 1 and len(blocks) > 1:
+        with pool_context().Pool(min(processes, len(blocks)),
+                                 initializer=_init_worker,
+                                 initargs=(s,)) as pool:
+            for rows, values in pool.imap_unordered(_worker_cube_diagonal,
+                                                    blocks):
+                cube[rows] = values
+    else:
+        for rows in blocks:
+            cube[rows] = _cube_diagonal(s, rows)
+
+    if directed:
+        dtot = np.asarray(a.sum(axis=0)).ravel() + \
+            np.asarray(a.sum(axis=1)).ravel()
+        dbi = np.asarray(a.multiply(a.T).sum(axis=1)).ravel()
+        possible = 2.0 * (dtot * (dtot - 1.0) - 2.0 * dbi)
+    else:
+        degree = np.diff(s.indptr).astype(np.float64)
+        possible = degree * (degree - 1.0)
+
+    clustering = np.zeros(n, dtype=np.float64)
+    nonzero = possible > 0
+    clustering[nonzero] = cube[nonzero] / possible[nonzero]
+    return clustering
+
+
+def average_clustering(graph, directed=True, processes=None):
+    """
+    :return: exact mean clustering coefficient over every node, counting
+    nodes with no possible triangles as 0 like nx.average_clustering
+    """
+    if graph.number_of_nodes() == 0:
+        return 0.0
+    return float(local_clustering(graph, directed, processes).mean())
+
+
+def _wilson(hits, trials, z):
+    p = hits / trials
+    centre = (p + z * z / (2 * trials)) / (1 + z * z / trials)
+    half = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials))
+    half /= 1 + z * z / trials
+    return p, max(centre - half, 0.0), min(centre + half, 1.0)
+
+
+def estimate_average_clustering(graph, width=0.01, confidence=0.95,
+                                seed=None, batch=10000, max_trials=10000000):
+    """
+    Estimate the average undirected clustering coefficient by sampling, as
+    networkx's approximation.average_clustering does: pick a node at random
+    and two of its neighbours, and count how often they are linked. Nodes
+    with fewer than two neighbours count as 0.
+
+    :param graph: CSRGraph or SubgraphView
+    :param width: stop once the confidence interval is at most this wide
+    :param confidence: confidence level of the interval
+    :param seed: random seed
+    :param batch: trials drawn between checks of the interval
+    :param max_trials: stop here even if the interval is still wider
+    :return: ClusteringEstimate
+    """
+    _, s = _symmetric(graph, directed=False)
+    n = s.shape[0]
+    if n == 0:
+        return ClusteringEstimate(0.0, 0.0, 0.0, 0, confidence)
+    indptr = s.indptr.astype(np.int64)
+    degree = np.diff(indptr)
+    # every edge as row * n + col; sorted since rows & indices are
+    keys = np.repeat(np.arange(n, dtype=np.int64), degree) * n + s.indices
+
+    rng = np.random.RandomState(seed)
+    z = norm.ppf(0.5 + confidence / 2.0)
+    hits = trials = 0
+    while True:
+        nodes = rng.randint(0, n, size=batch)
+        d = degree[nodes]
+        ok = d >= 2
+        nodes, d = nodes[ok], d[ok]
+
+        # two distinct neighbours: a 2nd pick from d-1 skips over the 1st
+        first = (rng.random_sample(len(d)) * d).astype(np.int64)
+        second = (rng.random_sample(len(d)) * (d - 1)).astype(np.int64)
+        second += second >= first
+        u = s.indices[indptr[nodes] + first].astype(np.int64)
+        v = s.indices[indptr[nodes] + second].astype(np.int64)
+
+        linked = u * n + v
+        pos = np.searchsorted(keys, linked)
+        pos[pos == len(keys)] = 0
+        hits += int((keys[pos] == linked).sum())
+        trials += batch
+
+        value, low, high = _wilson(hits, trials, z)
+        if high - low <= width or trials >= max_trials:
+            return ClusteringEstimate(value, low, high, trials, confidence)
@@ -0,0 +1,48 @@
+################################################################################
+# The activist corpora in the analysis, as declared in corpora.json;
+#
+#   {"corpora": [{"name": "latinx", "tweets": "../data/raw/LX-Sept2019.csv"},
+#                ...],
+#    "overlap": "both"}
+#
+# Each corpus is named after its raw tweet csv. A user who tweeted in more
+# than one corpus is labelled with the "overlap" name. Add a corpus by adding
+# an entry; the scripts that label users read the list from here.
+################################################################################
+import json
+from collections import OrderedDict
+
+CORPORA_FILE = "corpora.json"
+
+
+class Corpora:
+    """
+    Names & raw tweet files of the corpora.
+    """
+
+    def __init__(self, tweets, overlap='both'):
+        """
+        :param tweets: OrderedDict of corpus name -> path of its raw tweet csv
+        :param overlap: label of users in more than one corpus
+        """
+        self.tweets = tweets
+        self.overlap = overlap
+
+    @classmethod
+    def load(cls, path=CORPORA_FILE):
+        with open(path, 'r') as f:
+            config = json.load(f)
+        tweets = OrderedDict((c['name'], c['tweets'])
+                             for c in config['corpora'])
+        return cls(tweets, config.get('overlap', 'both'))
+
+    @property
+    def names(self):
+        return list(self.tweets)
+
+    @property
+    def labels(self):
+        """
+        :return: every value the corpus column can take
+        """
+        return self.names + [self.overlap]
@@ -0,0 +1,119 @@
+################################################################################
+# Split a graph of all users by corpus in a single pass.
+#
+# The corpus label of every node is turned into an integer code once. Each
+# corpus (todes, latinx, both, neither) is then a SubgraphView over the
+# shared adjacency rather than its own copy of the graph, and the number of
+# edges running between each pair of corpora falls out of the same pass.
+#
+# Per-node counts of neighbours in each corpus (and so in "the other
+# corpus") are bincounts over the edge arrays, for any number of corpora.
+################################################################################
+import numpy as np
+import pandas as pd
+from csr_graph import SubgraphView
+
+
+class CorpusPartition:
+    """
+    Corpus labels of a graph's nodes as integer codes, plus per-corpus views
+    and cross-corpus edge counts.
+    """
+
+    def __init__(self, graph, attr='corpus'):
+        """
+        :param graph: CSRGraph whose nodes carry a corpus attribute
+        :param attr: name of the node attribute holding the corpus label
+        """
+        labels = pd.Categorical(graph.node_attrs[attr])
+        self.graph = graph
+        self.labels = [str(c) for c in labels.categories]
+        self.codes = np.asarray(labels.codes, dtype=np.int8)
+
+        # edges from corpus i to corpus j are edge_counts[i, j]
+        k = len(self.labels)
+        src, dst = graph.edge_arrays()
+        src, dst = self.codes[src], self.codes[dst]
+        labelled = (src >= 0) & (dst >= 0)
+        pairs = src[labelled].astype(np.int64) * k + dst[labelled]
+        self.edge_counts = np.bincount(pairs, minlength=k * k).reshape(k, k)
+
+    def code(self, corpus):
+        """
+        :param corpus: corpus label, e.g. 'todes'
+        :return: integer code of that label, -1 if no node carries it
+        """
+        try:
+            return self.labels.index(corpus)
+        except ValueError:
+            return -1
+
+    def mask(self, corpus):
+        """
+        :param corpus: corpus label
+        :return: boolean array over the graph's nodes in that corpus
+        """
+        return self.codes == self.code(corpus)
+
+    def view(self, corpus, name=''):
+        """
+        Subgraph induced by the users in one corpus, without copying the
+        graph.
+
+        :param corpus: corpus label, e.g. 'todes'
+        :param name: name for the view
+        :return: csr_graph.SubgraphView
+        """
+        return SubgraphView(self.graph, self.mask(corpus), name=name)
+
+    def edge_count_frame(self):
+        """
+        :return: dataframe of edge counts, rows are the source corpus and
+        columns the target corpus
+        """
+        return pd.DataFrame(self.edge_counts, index=self.labels,
+                            columns=self.labels)
+
+    def neighbour_counts(self, direction='out'):
+        """
+        Count every node's successors (direction='out') or predecessors
+        (direction='in') in each corpus, with one bincount over the edges.
+        Row i is node i's own corpus-mixing profile; summing the rows of one
+        corpus gives that corpus' row of edge_counts.
+
+        :param direction: 'out' or 'in'
+        :return: int array of shape (number of nodes, number of corpora)
+        """
+        n, k = self.graph.number_of_nodes(), len(self.labels)
+        src, dst = self.graph.edge_arrays()
+        node, other = (src, dst) if direction == 'out' else (dst, src)
+        other = self.codes[other]
+        labelled = other >= 0
+        pairs = node[labelled].astype(np.int64) * k + other[labelled]
+        return np.bincount(pairs, minlength=n * k).reshape(n, k)
+
+    def cross_corpus_counts(self, exclude=('both',)):
+        """
+        Number of each node's predecessors & successors that are in a corpus
+        other than its own. Neighbours in an excluded corpus are not counted
+        and nodes in an excluded corpus are left out, so with the default
+        this matches counting neighbours in "the other corpus" while skipping
+        users in both.
+
+        :param exclude: corpus labels to leave out
+        :return: dataframe indexed by id_str with preds_in_other and
+        successors_in_other columns
+        """
+        excluded = [self.code(c) for c in exclude if self.code(c) >= 0]
+        keep = (self.codes >= 0) & ~np.isin(self.codes, excluded)
+        rows = np.flatnonzero(keep)
+        own = self.codes[rows]
+
+        counts = {}
+        for direction, column in (('in', 'preds_in_other'),
+                                  ('out', 'successors_in_other')):
+            m = self.neighbour_counts(direction)[rows]
+            m[:, excluded] = 0
+            counts[column] = m.sum(axis=1) - m[np.arange(len(rows)), own]
+        return pd.DataFrame(counts, index=np.asarray(self.graph.id_str[rows],
+                                                     dtype=object))
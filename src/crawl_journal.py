@@ -0,0 +1,178 @@
+################################################################################
+# A checkpoint journal for get_following_list_per_user.py, so an interrupted
+# crawl picks up exactly where it stopped.
+#
+# The journal is a SQLite database in WAL mode with synchronous=FULL, so every
+# commit is on disk before the crawler moves on. It holds the state of each
+# user;
+# - pending: not queried yet
+# - in_progress: some pages fetched; `cursor` is the next one to request
+# - done: the full following list is in the output file
+# - failed: gave up, with the response code (None if no response came back)
+# and the ids of every page fetched so far for the in_progress users, so an
+# account following thousands of users resumes from its last cursor rather
+# than from the start.
+#
+# The output file is appended to (and fsync'd) before a user is marked
+# done. A crash in between means the user's last line is written again on
+# restart; the ingest drops duplicate edges, so this is harmless.
+################################################################################
+import sqlite3
+import time
+
+PENDING = 'pending'
+IN_PROGRESS = 'in_progress'
+DONE = 'done'
+FAILED = 'failed'
+
+# the cursor of a user's first page
+FIRST_CURSOR = '-1'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL,
+    cursor TEXT NOT NULL,
+    status INTEGER,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS users_state ON users (state);
+CREATE TABLE IF NOT EXISTS pages (
+    user_id TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    ids TEXT NOT NULL,
+    PRIMARY KEY (user_id, page)
+);
+"""
+
+
+class CrawlJournal:
+    """
+    Per-user crawl state, committed to disk on every change.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the SQLite file; created if it does not exist
+        """
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _set(self, user, state, cursor, status=None):
+        self.db.execute("UPDATE users SET state=?, cursor=?, status=?, "
+                        "updated=? WHERE user_id=?",
+                        (state, cursor, status, time.time(), user))
+
+    def add_users(self, users, state=PENDING, status=None):
+        """
+        Add users to the journal. Users already in it are left as they are,
+        so the full user list can be added on every run.
+
+        :param users: iterable of user id strings
+        :param state: state of the new users
+        :param status: response code, for failed users
+        :return: number of users added
+        """
+        now = time.time()
+        with self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO users (user_id, state, cursor, status, "
+                "updated) VALUES (?, ?, ?, ?, ?)",
+                ((str(u), state, FIRST_CURSOR, status, now) for u in users))
+            return self.db.total_changes - before
+
+    def resume(self):
+        """
+        :return: list of (user, cursor) still to query; in_progress users
+        first, each from its next cursor, then pending users in the order
+        they were added
+        """
+        return self.db.execute(
+            "SELECT user_id, cursor FROM users WHERE state IN (?, ?) "
+            "ORDER BY state = ?, seq", (IN_PROGRESS, PENDING, PENDING)
+        ).fetchall()
+
+    def page(self, user, ids, next_cursor):
+        """
+        Record a page of a user's following list and the cursor of the next
+        one, in one transaction.
+
+        :param user: user id string
+        :param ids: ids on the page
+        :param next_cursor: cursor of the next page, as a string
+        """
+        with self.db:
+            self.db.execute(
+                "INSERT INTO pages (user_id, page, ids) VALUES (?, "
+                "(SELECT COUNT(*) FROM pages WHERE user_id=?), ?)",
+                (user, user, " ".join(str(i) for i in ids)))
+            self._set(user, IN_PROGRESS, next_cursor)
+
+    def following(self, user):
+        """
+        :return: list of the ids on every page recorded for a user
+        """
+        ids = []
+        for (page,) in self.db.execute(
+                "SELECT ids FROM pages WHERE user_id=? ORDER BY page",
+                (user,)):
+            ids.extend(page.split())
+        return ids
+
+    def done(self, user):
+        """
+        Mark a user done, once their following list has been saved.
+        """
+        with self.db:
+            self.db.execute("DELETE FROM pages WHERE user_id=?", (user,))
+            self._set(user, DONE, '0')
+
+    def failed(self, user, cursor, status):
+        """
+        Mark a user failed. Pages fetched so far are dropped.
+
+        :param cursor: cursor of the request that failed
+        :param status: response code, or None if there was no response
+        """
+        with self.db:
+            self.db.execute("DELETE FROM pages WHERE user_id=?", (user,))
+            self._set(user, FAILED, cursor, status)
+
+    def retry_failed(self, statuses=None):
+        """
+        Put failed users back to pending, e.g. after a run of 5xx errors.
+
+        :param statuses: only retry users that failed with one of these
+        response codes. None retries every failed user.
+        :return: number of users put back
+        """
+        query = "UPDATE users SET state=?, cursor=?, status=NULL WHERE state=?"
+        params = [PENDING, FIRST_CURSOR, FAILED]
+        if statuses is not None:
+            statuses = list(statuses)
+            query += " AND status IN ({})".format(
+                ",".join("?" * len(statuses)))
+            params += statuses
+        with self.db:
+            return self.db.execute(query, params).rowcount
+
+    def counts(self):
+        """
+        :return: dict of state -> number of users in it
+        """
+        return dict(self.db.execute(
+            "SELECT state, COUNT(*) FROM users GROUP BY state").fetchall())
@@ -0,0 +1,407 @@
+################################################################################
+# A compact, integer-indexed directed graph backed by numpy arrays.
+#
+# Nodes are numbered 0..n-1 and the twitter id string of node i is
+# id_str[i]. Successors are stored in CSR form (indptr / indices) and
+# predecessors in CSC form (in_indptr / in_indices), with int32 node ids so a
+# 100k+ edge graph is a few megabytes instead of the dict-of-dicts networkx
+# builds.
+#
+# CSRGraph also exposes the handful of networkx DiGraph methods the metric
+# scripts use (nodes, successors, predecessors, in_degree, out_degree, ...) so
+# it can stand in for a DiGraph. to_networkx() is there for the algorithms we
+# still borrow from networkx.
+#
+# SubgraphView is the same interface over a node mask of a CSRGraph, for
+# taking induced subgraphs without copying the parent's adjacency.
+################################################################################
+import numpy as np
+import pandas as pd
+import networkx as nx
+import scipy.sparse as sp
+
+
+class NodeIndex:
+    """
+    Sorted table of twitter ids we want to keep in a graph. Used to intern
+    ids as they are read so that only our users ever make it into memory.
+    """
+
+    def __init__(self, id_str):
+        """
+        :param id_str: iterable of twitter id strings, e.g. the index of the
+        users dataframe
+        """
+        id_str = np.asarray(list(id_str), dtype=object)
+        ids = np.fromiter((int(s) for s in id_str), dtype=np.uint64,
+                          count=len(id_str))
+        ids, first = np.unique(ids, return_index=True)
+        self.ids = ids
+        self.id_str = id_str[first]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, ids):
+        """
+        Find the position of each id in the index.
+
+        :param ids: array-like of twitter ids (as integers)
+        :return: int32 array of positions, -1 where an id is not in the index
+        """
+        ids = np.asarray(ids, dtype=np.uint64)
+        if len(self.ids) == 0:
+            return np.full(ids.shape, -1, dtype=np.int32)
+        pos = np.searchsorted(self.ids, ids)
+        pos[pos == len(self.ids)] = 0
+        return np.where(self.ids[pos] == ids, pos, -1).astype(np.int32)
+
+
+class _NodeView:
+    """
+    Just enough of networkx's NodeView for `g.nodes`, `g.nodes()`,
+    `g.nodes[n]['corpus']` and `g.nodes().data()` to work on a CSRGraph.
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __call__(self, data=False):
+        if data:
+            return self.data()
+        return self
+
+    def __iter__(self):
+        return iter(self._graph.id_str)
+
+    def __len__(self):
+        return self._graph.number_of_nodes()
+
+    def __contains__(self, node):
+        return node in self._graph
+
+    def __getitem__(self, node):
+        i = self._graph.node_id(node)
+        return {k: v[i] for k, v in self._graph.node_attrs.items()}
+
+    def data(self):
+        for i, node in enumerate(self._graph.id_str):
+            yield node, {k: v[i] for k, v in self._graph.node_attrs.items()}
+
+
+class GraphBase:
+    """
+    networkx DiGraph look-alike methods shared by CSRGraph and SubgraphView.
+    Subclasses provide id_str, node_attrs, number_of_nodes, number_of_edges,
+    edge_arrays, in/out_degree_array and successor_ids/predecessor_ids.
+    """
+    name = ''
+    _node_ids = None
+
+    def node_id(self, node):
+        """
+        :param node: id string of a node
+        :return: integer id of that node
+        """
+        if self._node_ids is None:
+            self._node_ids = {n: i for i, n in enumerate(self.id_str)}
+        try:
+            return self._node_ids[node]
+        except KeyError:
+            raise nx.NetworkXError("The node {} is not in the graph.".format(
+                node))
+
+    @property
+    def nodes(self):
+        return _NodeView(self)
+
+    def __len__(self):
+        return self.number_of_nodes()
+
+    def __iter__(self):
+        return iter(self.id_str)
+
+    def __contains__(self, node):
+        try:
+            self.node_id(node)
+        except (nx.NetworkXError, TypeError):
+            return False
+        return True
+
+    def successors(self, node):
+        return iter(self.id_str[self.successor_ids(self.node_id(node))])
+
+    def predecessors(self, node):
+        return iter(self.id_str[self.predecessor_ids(self.node_id(node))])
+
+    def has_edge(self, u, v):
+        row = self.successor_ids(self.node_id(u))
+        j = self.node_id(v)
+        k = np.searchsorted(row, j)
+        return k < len(row) and row[k] == j
+
+    def edges(self):
+        src, dst = self.edge_arrays()
+        return zip(self.id_str[src], self.id_str[dst])
+
+    def in_degree(self):
+        return zip(self.id_str, self.in_degree_array().tolist())
+
+    def out_degree(self):
+        return zip(self.id_str, self.out_degree_array().tolist())
+
+    def degree(self):
+        return zip(self.id_str, (self.in_degree_array() +
+                                 self.out_degree_array()).tolist())
+
+    def density(self):
+        """
+        :return: same as nx.density for a DiGraph
+        """
+        n = self.number_of_nodes()
+        if n <= 1:
+            return 0
+        return self.number_of_edges() / (n * (n - 1))
+
+    def info(self):
+        """
+        :return: same summary as nx.info (networkx 2.4) for a DiGraph; every
+        edge counts once in and once out, so both average degrees are
+        edges / nodes
+        """
+        n = self.number_of_nodes()
+        m = self.number_of_edges()
+        info = "Name: {}\n".format(self.name)
+        info += "Type: DiGraph\n"
+        info += "Number of nodes: {:d}\n".format(n)
+        info += "Number of edges: {:d}".format(m)
+        if n > 0:
+            info += "\nAverage in degree: {:8.4f}\n".format(m / n)
+            info += "Average out degree: {:8.4f}".format(m / n)
+        return info
+
+    def adjacency(self, dtype=np.int32):
+        """
+        :param dtype: dtype of the matrix entries
+        :return: scipy.sparse.csr_matrix with a 1 at [u, v] for every edge
+        u -> v
+        """
+        n = self.number_of_nodes()
+        src, dst = self.edge_arrays()
+        return sp.csr_matrix((np.ones(len(src), dtype=dtype), (src, dst)),
+                             shape=(n, n))
+
+    def to_networkx(self):
+        """
+        Materialize this graph as a networkx DiGraph, attributes included.
+        Only do this for algorithms that have no array implementation.
+
+        :return: nx.DiGraph
+        """
+        g = nx.DiGraph(name=self.name)
+        g.add_nodes_from(self.nodes.data())
+        g.add_edges_from(self.edges())
+        return g
+
+
+class CSRGraph(GraphBase):
+    """
+    Directed graph stored as CSR (successors) and CSC (predecessors) arrays
+    over int32 node ids, with a separate table of id strings. Node
+    attributes live in `node_attrs` as arrays aligned to the node ids.
+    """
+
+    def __init__(self, id_str, indptr, indices, in_indptr, in_indices,
+                 name=''):
+        self.id_str = id_str
+        self.indptr = indptr
+        self.indices = indices
+        self.in_indptr = in_indptr
+        self.in_indices = in_indices
+        self.name = name
+        self.node_attrs = {}
+
+    @classmethod
+    def from_edges(cls, src, dst, id_str, name=''):
+        """
+        Build a graph from parallel arrays of edge endpoints. Duplicate edges
+        are dropped, like adding the same edge twice to a DiGraph.
+
+        :param src: array of source node ids (0..n-1)
+        :param dst: array of target node ids (0..n-1)
+        :param id_str: array of id strings, one per node
+        :param name: graph name
+        :return: CSRGraph
+        """
+        n = len(id_str)
+        key = np.unique(np.asarray(src, dtype=np.int64) * n +
+                        np.asarray(dst, dtype=np.int64))
+        src = (key // n).astype(np.int32)
+        dst = (key % n).astype(np.int32)
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+
+        # a stable sort by target keeps each node's predecessors sorted
+        order = np.argsort(dst, kind='mergesort')
+        in_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dst, minlength=n), out=in_indptr[1:])
+
+        return cls(np.asarray(id_str, dtype=object), indptr, dst, in_indptr,
+                   src[order], name=name)
+
+    @classmethod
+    def from_networkx(cls, g):
+        """
+        Convert a networkx DiGraph, node attributes included. Nodes missing
+        an attribute get None for it.
+
+        :param g: nx.DiGraph
+        :return: CSRGraph
+        """
+        id_str = np.array([str(n) for n in g.nodes()], dtype=object)
+        pos = {n: i for i, n in enumerate(g.nodes())}
+        src = np.fromiter((pos[u] for u, _ in g.edges()), dtype=np.int32,
+                          count=g.number_of_edges())
+        dst = np.fromiter((pos[v] for _, v in g.edges()), dtype=np.int32,
+                          count=g.number_of_edges())
+        graph = cls.from_edges(src, dst, id_str, name=g.name)
+
+        keys = set()
+        for _, data in g.nodes(data=True):
+            keys.update(data)
+        for key in sorted(keys):
+            graph.set_node_attr(key, [data.get(key) for _, data in
+                                      g.nodes(data=True)])
+        return graph
+
+    # ------------------------------------------------------------------------ #
+    # array level access
+    # ------------------------------------------------------------------------ #
+    def number_of_nodes(self):
+        return len(self.id_str)
+
+    def number_of_edges(self):
+        return len(self.indices)
+
+    def out_degree_array(self):
+        return np.diff(self.indptr)
+
+    def in_degree_array(self):
+        return np.diff(self.in_indptr)
+
+    def edge_arrays(self):
+        """
+        :return: (src, dst) int32 arrays, one entry per edge, sorted by source
+        then target
+        """
+        src = np.repeat(np.arange(self.number_of_nodes(), dtype=np.int32),
+                        self.out_degree_array())
+        return src, np.asarray(self.indices)
+
+    def successor_ids(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def predecessor_ids(self, i):
+        return self.in_indices[self.in_indptr[i]:self.in_indptr[i+1]]
+
+    def set_node_attr(self, name, values):
+        """
+        :param name: attribute name
+        :param values: array of values aligned to the node ids
+        """
+        if not isinstance(values, pd.Categorical):
+            values = np.asarray(values)
+        if len(values) != self.number_of_nodes():
+            raise ValueError("attribute {} has {} values for {} nodes".format(
+                name, len(values), self.number_of_nodes()))
+        self.node_attrs[name] = values
+
+
+class SubgraphView(GraphBase):
+    """
+    Zero-copy view of the subgraph of a CSRGraph induced by a node mask.
+    Nothing is copied from the parent except a mask over its edges, which
+    is worked out the first time edges are needed. Node ids of the view are
+    0..k-1 in the parent's order.
+    """
+
+    def __init__(self, parent, mask, name=''):
+        """
+        :param parent: CSRGraph
+        :param mask: boolean array over the parent's nodes
+        :param name: graph name
+        """
+        self.parent = parent
+        self.mask = np.asarray(mask, dtype=bool)
+        self.name = name
+        self.parent_ids = np.flatnonzero(self.mask).astype(np.int32)
+        self.local = np.full(parent.number_of_nodes(), -1, dtype=np.int32)
+        self.local[self.parent_ids] = np.arange(len(self.parent_ids),
+                                                dtype=np.int32)
+        self._id_str = None
+        self._node_attrs = None
+        self._edge_mask = None
+
+    @property
+    def id_str(self):
+        if self._id_str is None:
+            self._id_str = np.asarray(self.parent.id_str[self.parent_ids],
+                                      dtype=object)
+        return self._id_str
+
+    @property
+    def node_attrs(self):
+        if self._node_attrs is None:
+            self._node_attrs = {k: v[self.parent_ids] for k, v in
+                                self.parent.node_attrs.items()}
+        return self._node_attrs
+
+    def number_of_nodes(self):
+        return len(self.parent_ids)
+
+    def number_of_edges(self):
+        return int(self.edge_mask().sum())
+
+    def edge_mask(self):
+        """
+        :return: boolean array over the parent's edges, True for edges with
+        both ends in this view
+        """
+        if self._edge_mask is None:
+            src, dst = self.parent.edge_arrays()
+            self._edge_mask = self.mask[src] & self.mask[dst]
+        return self._edge_mask
+
+    def edge_arrays(self):
+        src, dst = self.parent.edge_arrays()
+        keep = self.edge_mask()
+        return self.local[src[keep]], self.local[dst[keep]]
+
+    def out_degree_array(self):
+        src, _ = self.edge_arrays()
+        return np.bincount(src, minlength=self.number_of_nodes())
+
+    def in_degree_array(self):
+        _, dst = self.edge_arrays()
+        return np.bincount(dst, minlength=self.number_of_nodes())
+
+    def successor_ids(self, i):
+        row = self.local[self.parent.successor_ids(self.parent_ids[i])]
+        return row[row >= 0]
+
+    def predecessor_ids(self, i):
+        row = self.local[self.parent.predecessor_ids(self.parent_ids[i])]
+        return row[row >= 0]
+
+    def materialize(self):
+        """
+        Copy this view into a standalone CSRGraph, e.g. to write it out.
+
+        :return: CSRGraph
+        """
+        src, dst = self.edge_arrays()
+        graph = CSRGraph.from_edges(src, dst, self.id_str, name=self.name)
+        for k, v in self.node_attrs.items():
+            graph.set_node_attr(k, v)
+        return graph
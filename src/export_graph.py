@@ -0,0 +1,75 @@
+################################################################################
+# Export the following graph, or a Gephi-sized piece of it, as GEXF or GML
+# (see graph_export.py). The format follows the output file's extension.
+#
+# e.g. the 5-core of the todes users, labelled by screen name;
+#   python export_graph.py todes_5core.gexf --corpus todes --k-core 5
+#
+# Filters apply in order: --corpus, then --min-degree, then --k-core, with
+# degrees counted within what is left.
+#
+# Input:
+# tweethis/raw/all_users_digraph.graph (or --local-graph)
+# Output:
+# the GEXF / GML file named on the command line
+################################################################################
+import argparse
+import logging
+from object_store import open_store
+from graph_store import read_graph
+from graph_export import corpus_mask, degree_mask, k_core_mask, write_gexf, \
+    write_gml
+
+logging.basicConfig(filename='export_graph.log', level=logging.INFO,
+                    format='%(asctime)s %(message)s')
+
+parser = argparse.ArgumentParser(
+    description="Export the following graph for Gephi as GEXF or GML.")
+parser.add_argument('output', help="file to write, ending in .gexf or .gml")
+parser.add_argument('--graph', default='raw/all_users_digraph.graph',
+                    help="name of the graph in the store (the tweethis "
+                         "bucket by default)")
+parser.add_argument('--local-graph', help="read this .graph file instead "
+                                          "of downloading one")
+parser.add_argument('--corpus', nargs='+', help="only users in these corpora")
+parser.add_argument('--min-degree', type=int, default=0,
+                    help="only users with at least this in + out degree")
+parser.add_argument('--k-core', type=int, default=0,
+                    help="only the k-core of what is left")
+args = parser.parse_args()
+
+if not args.output.endswith(('.gexf', '.gml')):
+    parser.error("output must end in .gexf or .gml")
+
+# ---------------------------------------------------------------------------- #
+# read in graph
+# ---------------------------------------------------------------------------- #
+if args.local_graph:
+    graph_file = args.local_graph
+else:
+    # downloads are cached locally (see object_store.py)
+    graph_file = open_store().path(args.graph)
+graph = read_graph(graph_file)
+
+# ---------------------------------------------------------------------------- #
+# pick the nodes to export
+# ---------------------------------------------------------------------------- #
+mask = None
+if args.corpus:
+    mask = corpus_mask(graph, args.corpus)
+if args.min_degree > 0:
+    mask = degree_mask(graph, mask, args.min_degree)
+if args.k_core > 0:
+    mask = k_core_mask(graph, args.k_core, mask)
+
+# ---------------------------------------------------------------------------- #
+# write it out
+# ---------------------------------------------------------------------------- #
+if args.output.endswith('.gexf'):
+    n_nodes, n_edges = write_gexf(graph, args.output, mask)
+else:
+    n_nodes, n_edges = write_gml(graph, args.output, mask)
+
+logging.info("wrote {} nodes, {} edges to {}".format(n_nodes, n_edges,
+                                                     args.output))
+print("wrote {} nodes, {} edges to {}".format(n_nodes, n_edges, args.output))
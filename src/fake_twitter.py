@@ -0,0 +1,212 @@
+################################################################################
+# A local stand-in for the parts of the twitter API we use, for trying the
+# crawler & user lookup scripts without spending real rate limit. Serves
+# - GET  /1.1/friends/ids.json?user_id=...&cursor=...
+# - GET/POST /1.1/users/lookup.json with screen_name=a,b,c
+# with twitter's cursors and x-rate-limit-* headers, tracked per access
+# token, and a 429 once a window is used up. Every request is recorded, so
+# checks such as check_crawler.py can see what a client asked for.
+#
+# Run it with
+#   python fake_twitter.py 8000
+# and point the twitter config at it with "api_base":
+# "http://localhost:8000/1.1".
+################################################################################
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeTwitter:
+    """
+    The data & rate limits behind the fake API.
+    """
+
+    def __init__(self, following, profiles=None, page_size=5000, limits=None,
+                 window=15 * 60, error_rate=0.0, seed=None):
+        """
+        :param following: dict of user id string -> list of followed ids
+        :param profiles: dict of screen_name -> user object for users/lookup
+        :param page_size: ids per friends/ids page
+        :param limits: dict of endpoint -> requests per window
+        :param window: rate limit window in seconds
+        :param error_rate: fraction of requests answered with a 503
+        :param seed: random seed for the errors
+        """
+        self.following = following
+        self.profiles = profiles or {}
+        self.page_size = page_size
+        self.limits = {'friends/ids': 15, 'users/lookup': 900}
+        self.limits.update(limits or {})
+        self.window = window
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.windows = {}
+        # (endpoint, {param: value}, response code) of every request
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def take(self, endpoint, token):
+        """
+        Count a request against a token's window.
+
+        :return: (allowed, headers)
+        """
+        with self.lock:
+            now = time.time()
+            key = (endpoint, token)
+            remaining, reset = self.windows.get(key, (self.limits[endpoint],
+                                                      now + self.window))
+            if now >= reset:
+                remaining, reset = self.limits[endpoint], now + self.window
+            allowed = remaining > 0
+            if allowed:
+                remaining -= 1
+            self.windows[key] = (remaining, reset)
+            failed = allowed and self.random.random() < self.error_rate
+        headers = {'x-rate-limit-limit': str(self.limits[endpoint]),
+                   'x-rate-limit-remaining': str(remaining),
+                   'x-rate-limit-reset': str(int(reset))}
+        return allowed, failed, headers
+
+    def record(self, endpoint, params, status):
+        with self.lock:
+            self.requests.append((endpoint, {k: ",".join(v) for k, v in
+                                             params.items()}, status))
+
+    def responses(self, endpoint, status):
+        """
+        :return: params of the requests to endpoint answered with status
+        """
+        with self.lock:
+            return [p for e, p, s in self.requests
+                    if e == endpoint and s == status]
+
+    def friends_ids(self, params):
+        user = params.get('user_id', [''])[0]
+        if user not in self.following:
+            return 404, {'errors': [{'code': 34, 'message': 'Sorry, that '
+                                     'page does not exist.'}]}
+        cursor = int(params.get('cursor', ['-1'])[0])
+        start = 0 if cursor == -1 else cursor
+        ids = self.following[user]
+        end = start + self.page_size
+        next_cursor = end if end < len(ids) else 0
+        return 200, {'ids': [int(i) for i in ids[start:end]],
+                     'next_cursor': next_cursor,
+                     'next_cursor_str': str(next_cursor),
+                     'previous_cursor': -start if start else 0,
+                     'previous_cursor_str': str(-start if start else 0)}
+
+    def users_lookup(self, params):
+        names = ",".join(params.get('screen_name', [''])).split(",")
+        users = [self.profiles[n] for n in names if n in self.profiles]
+        if not users:
+            return 404, {'errors': [{'code': 17, 'message': 'No user matches '
+                                     'for specified terms.'}]}
+        return 200, users
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _token(self):
+        auth = self.headers.get('Authorization', '')
+        for part in auth.split(','):
+            if 'oauth_token=' in part:
+                return part.split('=', 1)[1].strip().strip('"')
+        return 'anonymous'
+
+    def _respond(self, params):
+        fake = self.server.fake
+        path = urlparse(self.path).path
+        if path.endswith('/friends/ids.json'):
+            endpoint, handler = 'friends/ids', fake.friends_ids
+        elif path.endswith('/users/lookup.json'):
+            endpoint, handler = 'users/lookup', fake.users_lookup
+        else:
+            return self._send(404, {}, {'errors': [{'code': 34}]})
+
+        allowed, failed, headers = fake.take(endpoint, self._token())
+        if not allowed:
+            status, body = 429, {'errors': [{
+                'code': 88, 'message': 'Rate limit exceeded'}]}
+        elif failed:
+            status, body = 503, {'errors': [{
+                'code': 130, 'message': 'Over capacity'}]}
+        else:
+            status, body = handler(params)
+        fake.record(endpoint, params, status)
+        self._send(status, headers, body)
+
+    def _send(self, status, headers, body):
+        raw = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_GET(self):
+        self._respond(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        params = parse_qs(self.rfile.read(length).decode('utf-8'))
+        params.update(parse_qs(urlparse(self.path).query))
+        self._respond(params)
+
+
+def serve(fake, port=0):
+    """
+    Start serving a FakeTwitter in a background thread.
+
+    :param fake: FakeTwitter
+    :param port: port to listen on; 0 picks a free one
+    :return: (server, api base url). Call server.shutdown() when done.
+    """
+    server = ThreadingHTTPServer(('localhost', port), _Handler)
+    server.fake = fake
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, "http://localhost:{}/1.1".format(server.server_port)
+
+
+def random_fake(n_users=200, seed=115, **kwargs):
+    """
+    A FakeTwitter with a random following graph among n_users users, whose
+    ids are 1000..1000+n_users and screen names user0, user1, ...
+    """
+    rng = random.Random(seed)
+    ids = [str(1000 + i) for i in range(n_users)]
+    following = {u: rng.sample(ids, rng.randint(0, n_users // 4))
+                 for u in ids}
+    profiles = {'user{}'.format(i): {
+        'id': int(u), 'id_str': u, 'name': 'User {}'.format(i),
+        'screen_name': 'user{}'.format(i), 'location': '',
+        'description': '', 'url': None, 'entities': {}, 'protected': False,
+        'followers_count': rng.randint(0, 5000),
+        'friends_count': len(following[u]), 'listed_count': 0,
+        'created_at': 'Wed Oct 10 20:19:24 +0000 2018', 'verified': False,
+        'statuses_count': rng.randint(0, 10000), 'lang': None}
+        for i, u in enumerate(ids)}
+    return FakeTwitter(following, profiles, seed=seed, **kwargs)
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    server, base = serve(random_fake(page_size=50), port)
+    print("fake twitter api at " + base)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
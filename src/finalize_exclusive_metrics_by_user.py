@@ -1,40 +1,39 @@
 ################################################################################
-# This script splits the dataframe of network metrics @ the user level into
-# separate todes and latinx files.
+# This script splits the table of network metrics @ the user level into
+# separate todes and latinx tables.
+#
+# The table is partitioned by corpus (see parquet_table.py), so each side is
+# a read of just its own corpus' parts (and the users in neither corpus),
+# and just its own columns.
 #
 # Input:
-# repo/data/processed/user_following/processed_network_metrics_by_user_df.pickle
+# tweethis/processed/network_metrics_by_user/
 #
 # Outputs:
-# repo/data/final/todes_exclusive_users_metrics_df.pickle
-# repo/data/final/latinx_exclusive_users_metrics_df.pickle
+# repo/data/final/todes_exclusive_users_metrics/
+# repo/data/final/latinx_exclusive_users_metrics/
 ################################################################################
 
-import pandas as pd
+from object_store import open_store
+from parquet_table import read_stored_table, stored_columns, write_table
 
-df = pd.read_pickle("../data/processed/user_following"
-                    "/processed_network_metrics_by_user_df.pickle")
+store = open_store()
+table = 'processed/network_metrics_by_user'
+columns = stored_columns(store, table)
 
 # ---------------------------------------------------------------------------- #
 # Define columns to be rejected
 # ---------------------------------------------------------------------------- #
-todes_cols = df.columns.difference(['l_bet_central','l_out_deg_central',
-                                    'l_in_deg_central', 'l_in_2hop',
-                                    'l_out_2hop', 'l_deg_central', 'l_out_deg',
-                                    'l_in_deg', 'l_clustering',
-                                    'l_reciprocity'])
-
-latinx_cols = df.columns.difference(['t_clustering', 't_in_deg', 't_out_deg',
-                                     't_deg_central','t_out_2hop',
-                                     't_in_2hop', 't_in_deg_central',
-                                     't_out_deg_central', 't_bet_central',
-                                     't_reciprocity'])
+todes_cols = [c for c in columns if not c.startswith('l_')]
+latinx_cols = [c for c in columns if not c.startswith('t_')]
 
 # ---------------------------------------------------------------------------- #
-# Split dataframes based on the column differences
+# Read each corpus' users & columns
 # ---------------------------------------------------------------------------- #
-todes = df[df.corpus!='latinx'][todes_cols]
-latinx = df[df.corpus!='todes'][latinx_cols]
+todes = read_stored_table(store, table, columns=todes_cols + ['corpus'],
+                          corpora=['todes', 'neither'])
+latinx = read_stored_table(store, table, columns=latinx_cols + ['corpus'],
+                           corpora=['latinx', 'neither'])
 
 # ---------------------------------------------------------------------------- #
 # Rename columns; remove leading "t_" and "l_"
@@ -56,5 +55,5 @@ for col in latinx.columns:
 # ---------------------------------------------------------------------------- #
 # Save outputs
 # ---------------------------------------------------------------------------- #
-todes.to_pickle("../data/final/todes_exclusive_users_metrics_df.pickle")
-latinx.to_pickle("../data/final/latinx_exclusive_users_metrics_df.pickle")
\ No newline at end of file
+write_table(todes, "../data/final/todes_exclusive_users_metrics")
+write_table(latinx, "../data/final/latinx_exclusive_users_metrics")
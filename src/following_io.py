@@ -0,0 +1,515 @@
+################################################################################
+# Read the following lists written by get_following_list_per_user.py into
+# edge arrays. Each line of a following file begins with the user in
+# question followed by the ids they follow, separated by spaces.
+#
+# Ids are interned against a NodeIndex of our users while reading, so edges
+# to accounts outside the user table are dropped immediately instead of
+# being added to a supergraph and pared down later.
+#
+# The crawler can also write following lists as binary blocks (.bin files),
+# which are smaller and need no parsing. A file starts with BINARY_MAGIC,
+# then one block per user;
+#   uint64 user id | uint8 codec | uint32 number of ids | uint32 payload size
+# (little-endian, no padding) followed by the payload: the ids as
+# little-endian uint64, compressed with the codec. Both formats can be mixed
+# in one folder.
+#
+# An IngestState records how many bytes of each file have been read, so
+# the edges the crawler appends later can be added to an existing graph
+# with update_following_graph instead of rebuilding it.
+#
+# Large dumps are read in parallel: each file is cut into byte ranges of
+# about SHARD_BYTES that start and end on a line (or block) boundary, a
+# process pool turns every range into edge arrays, and the arrays are
+# concatenated. CSRGraph.from_edges drops any duplicate edges when the graph
+# is built.
+################################################################################
+import glob
+import json
+import logging
+import os
+import struct
+import zlib
+import numpy as np
+from csr_graph import CSRGraph, NodeIndex
+from parallel import default_processes, pool_context
+
+BINARY_MAGIC = b'AOAFOLW1'
+BINARY_SUFFIX = '.bin'
+_BLOCK_HEADER = struct.Struct('<QBII')
+
+# codec byte -> (name, compress, decompress)
+CODECS = {0: ('raw', bytes, bytes),
+          1: ('zlib', zlib.compress, zlib.decompress)}
+_CODEC_IDS = {name: codec for codec, (name, _, _) in CODECS.items()}
+
+# target size of the byte ranges read by each worker of a parallel ingest
+SHARD_BYTES = 1 << 24
+
+# number of followed ids to look up in the index at once
+_LOOKUP_BATCH = 1 << 20
+
+# index each worker of a parallel ingest looks ids up in, set by _init_worker
+_worker_index = None
+
+
+def following_files(folder_path):
+    """
+    :param folder_path: directory holding the following lists
+    :return: sorted list of the .txt and .bin following files in that
+    directory
+    """
+    return sorted(glob.glob(os.path.join(folder_path, '*.txt')) +
+                  glob.glob(os.path.join(folder_path, '*' + BINARY_SUFFIX)))
+
+
+def is_binary(filename):
+    """
+    :return: True if filename is a binary following file, going by its name
+    """
+    return filename.endswith(BINARY_SUFFIX)
+
+
+def parse_following_line(line):
+    """
+    Split one line of a following file.
+
+    :param line: "<user id>  <id> <id> ..."
+    :return: (source id as int, numpy uint64 array of followed ids)
+    """
+    tokens = line.split()
+    source = int(tokens[0])
+    targets = np.fromiter((int(t) for t in tokens[1:]), dtype=np.uint64,
+                          count=len(tokens) - 1)
+    return source, targets
+
+
+def write_following_block(f, source, ids, codec='zlib'):
+    """
+    Append one user's following list to a binary following file. The magic
+    is written first if the file is empty.
+
+    :param f: file opened in 'ab' mode
+    :param source: id of the user
+    :param ids: ids they follow, as ints or decimal strings
+    :param codec: 'raw' or 'zlib'
+    """
+    if f.tell() == 0:
+        f.write(BINARY_MAGIC)
+    ids = np.asarray(ids, dtype='<u8')
+    codec_id = _CODEC_IDS[codec]
+    payload = CODECS[codec_id][1](ids.tobytes())
+    f.write(_BLOCK_HEADER.pack(int(source), codec_id, len(ids), len(payload)))
+    f.write(payload)
+
+
+def read_following_blocks(filename, start=0, end=None):
+    """
+    Stream the blocks of a binary following file.
+
+    :param filename: binary following file
+    :param start: byte offset to start from, 0 or the end of an earlier block
+    :param end: byte offset to stop at, the end of a block. None reads to
+    the end of the file.
+    :return: generator of (source id as int, numpy uint64 array of followed
+    ids, offset just past the block). A trailing block that is not complete
+    is still being written by the crawler and is left for next time.
+    """
+    with open(filename, 'rb') as f:
+        if start == 0:
+            magic = f.read(len(BINARY_MAGIC))
+            if len(magic) < len(BINARY_MAGIC):
+                return
+            if magic != BINARY_MAGIC:
+                raise ValueError("{} is not a binary following "
+                                 "file".format(filename))
+            start = len(BINARY_MAGIC)
+        f.seek(start)
+        offset = start
+        while end is None or offset < end:
+            header = f.read(_BLOCK_HEADER.size)
+            if len(header) < _BLOCK_HEADER.size:
+                return
+            source, codec_id, count, size = _BLOCK_HEADER.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size:
+                return
+            offset += _BLOCK_HEADER.size + size
+            targets = np.frombuffer(CODECS[codec_id][2](payload), dtype='<u8',
+                                    count=count)
+            yield source, targets.astype(np.uint64, copy=False), offset
+
+
+def convert_following_file(text_file, binary_file, codec='zlib'):
+    """
+    Rewrite a text following file as a binary one.
+
+    :param text_file: following file written as text
+    :param binary_file: binary following file to write
+    :param codec: 'raw' or 'zlib'
+    """
+    with open(binary_file, 'wb') as out:
+        for source, targets, _ in _text_records(text_file, 0):
+            write_following_block(out, source, targets, codec=codec)
+
+
+class IngestState:
+    """
+    How many bytes of each following file have already been read into a
+    graph. The crawler only ever appends to following files, so the next
+    ingest can start where the last one stopped.
+    """
+
+    def __init__(self, offsets=None):
+        """
+        :param offsets: dict of file name -> number of bytes consumed
+        """
+        self.offsets = dict(offsets or {})
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls(json.load(f)['offsets'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'offsets': self.offsets}, f, indent=1, sort_keys=True)
+
+    def start(self, filename):
+        return self.offsets.get(os.path.basename(filename), 0)
+
+    def consumed(self, filename, offset):
+        self.offsets[os.path.basename(filename)] = offset
+
+
+def _complete_lines(filename, start, end=None):
+    """
+    Yield the complete lines of a file from byte offset start (up to byte
+    offset end, if given), along with the offset just past each one. A
+    trailing line without a newline is still being written by the crawler
+    and is left for next time.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        offset = start
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break
+            offset += len(raw)
+            yield raw.decode('utf-8'), offset
+            if end is not None and offset >= end:
+                break
+
+
+def _text_records(filename, start, end=None):
+    for line, stop in _complete_lines(filename, start, end):
+        if not line.strip():
+            continue
+        try:
+            source, targets = parse_following_line(line)
+        except (ValueError, IndexError):
+            logging.debug("error reading line {!r} in file "
+                          "{}".format(line[:40], filename))
+            continue
+        yield source, targets, stop
+
+
+def following_records(filename, start=0, end=None):
+    """
+    Stream the following lists of a text or binary following file.
+
+    :param filename: following file
+    :param start: byte offset to start from
+    :param end: byte offset to stop at, on a record boundary. None reads to
+    the end of the file.
+    :return: generator of (source id as int, numpy uint64 array of followed
+    ids, offset just past the record)
+    """
+    if is_binary(filename):
+        return read_following_blocks(filename, start, end)
+    return _text_records(filename, start, end)
+
+
+def _text_shards(f, start, shard_bytes):
+    # the end of the last complete line
+    f.seek(0, os.SEEK_END)
+    end = pos = f.tell()
+    while pos > start:
+        step = min(1 << 16, pos - start)
+        f.seek(pos - step)
+        newline = f.read(step).rfind(b'\n')
+        if newline >= 0:
+            end = pos - step + newline + 1
+            break
+        pos -= step
+    else:
+        return []
+
+    # move each cut forward to the start of the next line
+    cuts = [start]
+    for target in range(start + shard_bytes, end, shard_bytes):
+        if target <= cuts[-1]:
+            continue
+        f.seek(target - 1)
+        f.readline()
+        if f.tell() < end:
+            cuts.append(f.tell())
+    cuts.append(end)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def _binary_shards(f, start, shard_bytes):
+    if start == 0:
+        magic = f.read(len(BINARY_MAGIC))
+        if len(magic) < len(BINARY_MAGIC):
+            return []
+        if magic != BINARY_MAGIC:
+            raise ValueError("not a binary following file")
+        start = len(BINARY_MAGIC)
+    size = os.fstat(f.fileno()).st_size
+
+    # hop from block header to block header, cutting once a range is big
+    # enough
+    ranges = []
+    first = offset = start
+    while offset + _BLOCK_HEADER.size <= size:
+        f.seek(offset)
+        _, _, _, payload = _BLOCK_HEADER.unpack(f.read(_BLOCK_HEADER.size))
+        if offset + _BLOCK_HEADER.size + payload > size:
+            break
+        offset += _BLOCK_HEADER.size + payload
+        if offset - first >= shard_bytes:
+            ranges.append((first, offset))
+            first = offset
+    if offset > first:
+        ranges.append((first, offset))
+    return ranges
+
+
+def shard_ranges(filename, start=0, shard_bytes=SHARD_BYTES):
+    """
+    Cut the complete records of a following file after byte offset start
+    into byte ranges of about shard_bytes, each starting and ending on a
+    record boundary.
+
+    :param filename: following file
+    :param start: byte offset to start from, 0 or a record boundary
+    :param shard_bytes: target size of a range
+    :return: list of (start, end) byte offsets
+    """
+    with open(filename, 'rb') as f:
+        if is_binary(filename):
+            return _binary_shards(f, start, shard_bytes)
+        return _text_shards(f, start, shard_bytes)
+
+
+def _read_range(filename, start, end, index):
+    """
+    Read the edges among the users in index from a range of a following
+    file. Ids are looked up in batches rather than one line at a time.
+
+    :return: (src, dst, seen, stop) where src and dst are int32 positions in
+    index, seen is the sorted positions of the users that showed up, and
+    stop is the offset just past the last record read
+    """
+    src_chunks, dst_chunks, seen_chunks = [], [], []
+    sources, counts, targets = [], [], []
+    pending = 0
+
+    def flush():
+        v = index.lookup(np.concatenate(targets))
+        u = np.repeat(index.lookup(np.array(sources, dtype=np.uint64)),
+                      counts)
+        keep = (u >= 0) & (v >= 0)
+        # a followed account counts as seen even if its follower doesn't
+        seen_chunks.append(np.unique(np.concatenate([u[u >= 0], v[v >= 0]])))
+        src_chunks.append(u[keep])
+        dst_chunks.append(v[keep])
+        del sources[:], counts[:], targets[:]
+
+    stop = start
+    for source, followed, stop in following_records(filename, start, end):
+        sources.append(source)
+        counts.append(len(followed))
+        # a user following no one still shows up
+        targets.append(followed)
+        pending += len(followed)
+        if not len(followed):
+            seen_chunks.append(index.lookup([source]))
+        if pending >= _LOOKUP_BATCH:
+            flush()
+            pending = 0
+    if sources:
+        flush()
+
+    def cat(chunks):
+        return np.concatenate(chunks) if chunks else np.zeros(0, np.int32)
+    seen = cat(seen_chunks)
+    return cat(src_chunks), cat(dst_chunks), np.unique(seen[seen >= 0]), stop
+
+
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _read_job(index, job):
+    filename, start, end = job
+    try:
+        return (filename, True) + _read_range(filename, start, end, index)
+    except (IOError, OSError, ValueError, zlib.error):
+        logging.exception("error reading file {} from byte {}".format(
+            filename, start))
+        return filename, False, None, None, None, None
+
+
+def _worker_read(job):
+    return _read_job(_worker_index, job)
+
+
+def read_following_edges(paths, index, state=None, processes=1,
+                         shard_bytes=SHARD_BYTES):
+    """
+    Read following files and keep only the edges with both ends in index.
+
+    :param paths: list of following files
+    :param index: csr_graph.NodeIndex of the users to keep
+    :param state: optional IngestState. Each file is read from where the
+    state says the last ingest stopped, and the state is moved on to the end
+    of what was read. A file with a range that could not be read is left
+    where it was.
+    :param processes: number of worker processes. None is one per core; 1
+    reads every file whole in this process.
+    :param shard_bytes: target size of the byte ranges handed to workers
+    :return: (src, dst, seen). src and dst are int32 positions in index, one
+    per edge. seen is a boolean mask over index of the users that showed up
+    in the files at all, either as a source or as a followed account.
+    """
+    processes = default_processes(processes)
+    jobs = []
+    stops = {}
+
+    for filename in paths:
+        start = state.start(filename) if state is not None else 0
+        try:
+            if os.path.getsize(filename) < start:
+                logging.warning("{} is smaller than when it was last read, "
+                                "reading it again from the start".format(
+                                    filename))
+                start = 0
+            if processes > 1:
+                ranges = shard_ranges(filename, start, shard_bytes)
+            else:
+                ranges = [(start, None)]
+        except (IOError, OSError, ValueError):
+            logging.exception("error reading file {}".format(filename))
+            continue
+        stops[filename] = start
+        jobs.extend((filename, s, e) for s, e in ranges)
+
+    if processes > 1 and len(jobs) > 1:
+        pool = pool_context().Pool(min(processes, len(jobs)),
+                                   initializer=_init_worker,
+                                   initargs=(index,))
+        results = pool.imap_unordered(_worker_read, jobs)
+    else:
+        pool = None
+        results = (_read_job(index, job) for job in jobs)
+
+    src_chunks = []
+    dst_chunks = []
+    seen = np.zeros(len(index), dtype=bool)
+    failed = set()
+    try:
+        for filename, ok, src, dst, seen_ids, stop in results:
+            if not ok:
+                failed.add(filename)
+                continue
+            src_chunks.append(src)
+            dst_chunks.append(dst)
+            seen[seen_ids] = True
+            stops[filename] = max(stops[filename], stop)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if state is not None:
+        for filename, stop in stops.items():
+            if filename not in failed:
+                state.consumed(filename, stop)
+
+    src = np.concatenate(src_chunks) if src_chunks else np.zeros(0, np.int32)
+    dst = np.concatenate(dst_chunks) if dst_chunks else np.zeros(0, np.int32)
+    return src, dst, seen
+
+
+def build_following_graph(paths, id_str, name='', state=None, processes=1):
+    """
+    Build a CSRGraph of following relationships among our users, straight
+    from the following files.
+
+    :param paths: list of following files
+    :param id_str: id strings of our users, e.g. the users dataframe index
+    :param name: graph name
+    :param state: optional IngestState to record how much of each file was
+    read
+    :param processes: number of worker processes to read with, None for one
+    per core
+    :return: CSRGraph over the users that appear in the files
+    """
+    index = NodeIndex(id_str)
+    src, dst, seen = read_following_edges(paths, index, state=state,
+                                          processes=processes)
+
+    # renumber so the graph only holds users we actually saw
+    keep = np.flatnonzero(seen)
+    remap = np.full(len(index), -1, dtype=np.int32)
+    remap[keep] = np.arange(len(keep), dtype=np.int32)
+
+    return CSRGraph.from_edges(remap[src], remap[dst], index.id_str[keep],
+                               name=name)
+
+
+def update_following_graph(graph, paths, id_str, state, processes=1):
+    """
+    Add the edges appended to the following files since the last ingest to
+    a graph.
+
+    :param graph: CSRGraph built by build_following_graph (or a previous
+    update) from the same files
+    :param paths: list of following files
+    :param id_str: id strings of our users, e.g. the users dataframe index
+    :param state: IngestState of graph. Moved on to the end of the new data.
+    :param processes: number of worker processes to read with, None for one
+    per core
+    :return: (CSRGraph, dirty) where dirty is a sorted array of the node ids
+    in the new graph that gained an edge or were not in graph before. Node
+    attributes are not carried over.
+    """
+    index = NodeIndex(id_str)
+    src, dst, seen = read_following_edges(paths, index, state=state,
+                                          processes=processes)
+
+    # number the old and newly seen users together, in id order like a
+    # full build would
+    old_ids = np.fromiter((int(s) for s in graph.id_str), dtype=np.uint64,
+                          count=graph.number_of_nodes())
+    merged = NodeIndex(list(graph.id_str) + list(index.id_str[seen]))
+    old_pos = merged.lookup(old_ids)
+
+    old_src, old_dst = graph.edge_arrays()
+    new_src = merged.lookup(index.ids[src])
+    new_dst = merged.lookup(index.ids[dst])
+
+    updated = CSRGraph.from_edges(
+        np.concatenate([old_pos[old_src], new_src]),
+        np.concatenate([old_pos[old_dst], new_dst]),
+        merged.id_str, name=graph.name)
+
+    is_new = np.ones(len(merged), dtype=bool)
+    is_new[old_pos] = False
+    dirty = np.union1d(np.concatenate([new_src, new_dst]),
+                       np.flatnonzero(is_new)).astype(np.int32)
+    return updated, dirty
@@ -7,154 +7,110 @@
 #                                 'followers_count', 'friends_count',
 #                                 'listed_count','created_at','verified',
 #                                 'statuses_count','lang']`
+# Batches of 100 names are looked up concurrently across every credential in
+# the twitter config (see users_lookup.py). Each response is streamed into a
+# Parquet user table partitioned by corpus (see user_table.py), which
+# process_users_corpora.py reads back as one row per user.
+#
+# The table remembers which batches it holds, so rerunning the script after
+# an interruption (or after batches were given up on) only looks up what is
+# missing. Run with --fresh to throw the table away and start over.
+#
 # Input:
+# the raw tweet csv of each corpus in corpora.json, e.g.
 # repo/data/raw/LX-Sept2019.csv
 # repo/data/raw/TE-Sept2019.csv
 # Output:
-# repo/data/processed/combo_user_df_sept19.pkl
+# repo/data/processed/user_table/
 ################################################################################
-import requests
-from requests_oauthlib import OAuth1
+import asyncio
+import logging
+import os
+import shutil
+import sys
 import cnfg
-import pandas as pd
-import pickle
-import numpy as np
+from corpora import Corpora
+from raw_tweets import corpus_usernames, usernames_in
+from twitter_api import load_credentials, api_base
+from user_table import UserTableWriter
+from users_lookup import BATCH_SIZE, LookupClient, batch_key
+
+logging.basicConfig(filename='get_all_users_info.log', level=logging.INFO,
+                    format='%(asctime)s %(message)s')
+
+table_path = "../data/processed/user_table"
 
 
 def process_screennames(arr):
     """
-    Turn an array of user names into a list of lists of usernames in which
-    each list of usernames contains no more than 100 usernames.
+    Turn an array of user names into a list of comma separated strings of
+    usernames, each holding no more than 100 usernames, to append to the
+    twitter API request.
 
     :param arr: 1D array of usernames
-    :return: 2D python list of usernames
+    :return: python list of strings of usernames separated by , but no spaces
     """
-    if arr.size % 100 > 0:
-        # get the next integer up when dividing by 100
-        next_int = int((arr.size / 100) + 1)
-
-    # get the number of null strings we need
-    num_new_elements = abs(arr.size % 100 - 100)
-
-    # appending enough null strings to reach a round number divisible by 100
-    temp = np.append(arr, np.full(num_new_elements, ""))
-
-    # reshape the array into n,100 sized
-    array_batches = np.reshape(temp, (next_int, 100))
-
-    # convert to a python list, in the process parse the strings so that
-    # they are separated by , but no spaces
-    # this is to append to the twitter API request
-    list_batches = []
-    for batch in array_batches:
-        s = ""
-        for screenname in batch:
-            s = s + screenname + ","
-        list_batches.append(s)
-
-    # strip trailing ,
-    list_batches = [x.strip(",") for x in list_batches]
+    names = [str(name) for name in arr]
+    return [",".join(names[i:i + BATCH_SIZE])
+            for i in range(0, len(names), BATCH_SIZE)]
 
-    return list_batches
 
-
-def call_twitter(list_batches, latinx=True):
+def call_twitter(corpus_batches, table):
     """
-    Call the twitter users/lookup API using 100 screen_names at a time. Save
-    results to a python dataframe.
-
-    :param list_batches: 2D python list of usernames, each list is 100 usernames
-    long
-    :param latinx: Boolean. True if the batch of usernames being processed is
-    the latinx corpus, false if todes coprus
-    :return:
+    Call the twitter users/lookup API using 100 screen_names at a time,
+    skipping batches already in the user table. Save results to the user
+    table.
+
+    :param corpus_batches: dict of corpus name, e.g. latinx or todes ->
+    python list of strings of usernames, each holding up to 100 usernames
+    :param table: UserTableWriter
+    :return: number of batches that failed
     """
-    global df
-
-    for i, names in enumerate(list_batches):
-        endpoint = "https://api.twitter.com/1.1/users/lookup.json?screen_name" \
-                   "=" + names
-
-        # API call & turn into json
-        response = requests.get(endpoint, auth=oauth)
-        users = response.json()
-
-        # iterate thru the 100 users returned, and append to the big ol df
-        for u in range(len(users)):
-            try:
-                d = {el: users[u][el] for el in columns}
-                d['latinx'] = 1 if latinx else 0
-                d['todes'] = 0 if latinx else 1
-                df = df.append(d, ignore_index=True)
-            except Exception as ex:
-                print(ex)
-                print("exception at batch " + str(i))
-                print("exception at u " + str(u))
-                raise  # re-raise exception - interrupt
-
-
-# ---------------------------------------------------------------------------- #
-# Authorize twitter API
-# ---------------------------------------------------------------------------- #
-config = cnfg.load("/Users/katie/.twitter_config")
+    done = table.done_batches()
+    batches = []
+    corpus_of = {}
+    for corpus, list_batches in corpus_batches.items():
+        for names in list_batches:
+            key = corpus + ":" + batch_key(names)
+            if (corpus, key) not in done:
+                batches.append((key, names))
+                corpus_of[key] = corpus
+    logging.info("{} batches to look up, {} already done".format(
+        len(batches), len(done)))
 
-oauth = OAuth1(config["consumer_key"],
-               config["consumer_secret"],
-               config["access_token"],
-               config["access_token_secret"])
+    def on_result(key, users):
+        table.add(users, corpus_of[key], key=key)
 
+    client = LookupClient(load_credentials(config), api_base(config))
+    asyncio.run(client.run(batches, on_result))
+    return len(client.failed)
 
-# ---------------------------------------------------------------------------- #
-# Create a big ol' dataframe to start
-# ---------------------------------------------------------------------------- #
-columns = ['id_str', 'name', 'screen_name', 'location', 'description', 'url',
-           'entities', 'protected', 'followers_count', 'friends_count',
-           'listed_count', 'created_at','verified', 'statuses_count','lang']
 
-global df
-df = pd.DataFrame(columns=columns.copy().extend(['latinx','todes']))
-
-# ---------------------------------------------------------------------------- #
-# Pull in raw tweet data
 # ---------------------------------------------------------------------------- #
-latinx_tweets = pd.read_csv("../data/raw/LX-Sept2019.csv")
-todes_tweets = pd.read_csv("../data/raw/TE-Sept2019.csv")
-
-# ---------------------------------------------------------------------------- #
-# Get list of unique user names
+# Authorize twitter API
 # ---------------------------------------------------------------------------- #
-latinx_screennames = latinx_tweets.username.unique()
-todes_screennames = todes_tweets.username.unique()
+config = cnfg.load("/Users/katie/.twitter_config")
 
-# ---------------------------------------------------------------------------- #
-# Turn those usernames into appropriately sized batches for the api
-# ---------------------------------------------------------------------------- #
-latinx_batches = process_screennames(latinx_screennames)
-todes_batches = process_screennames(todes_screennames)
+corpora = Corpora.load()
 
 # ---------------------------------------------------------------------------- #
-# Ping API for each corpus
+# Get list of unique user names from the raw tweet data of each corpus in
+# corpora.json & turn those usernames into appropriately sized batches for
+# the api
 # ---------------------------------------------------------------------------- #
-call_twitter(latinx_batches, latinx=True)
-call_twitter(todes_batches, latinx=False)
+usernames = corpus_usernames(corpora)
+corpus_batches = {name: process_screennames(usernames_in(usernames, name))
+                  for name in corpora.names}
 
 # ---------------------------------------------------------------------------- #
-# Ensure that users in both corpora are noted as such
+# Ping API for each corpus, streaming the users into the user table
 # ---------------------------------------------------------------------------- #
-# these users are in both corpora
-double_users = list(set(todes_tweets['username']).
-                    intersection(set(latinx_tweets['username'])))
-df.set_index('screen_name', inplace=True)
-
-for user in double_users:
-    combo.at[user,'todes'] = 1
-    combo.at[user,'latinx'] = 1
+if '--fresh' in sys.argv:
+    shutil.rmtree(table_path, ignore_errors=True)
+os.makedirs(table_path, exist_ok=True)
 
-df.reset_index(inplace=True)
-df.drop_duplicates('id_str', inplace=True)
-
-# ---------------------------------------------------------------------------- #
-# Save out the df as a serialized obj for later
-# ---------------------------------------------------------------------------- #
-with open('../data/processed/combo_user_df_sept19.pkl', 'wb') as picklefile:
-    pickle.dump(df, picklefile)
+with UserTableWriter(table_path) as table:
+    failed = call_twitter(corpus_batches, table)
+if failed:
+    print(str(failed) + " batches failed, see get_all_users_info.log; run "
+          "again to retry them")
@@ -2,88 +2,232 @@
 # This script runs through a list of twitter user names and queries the
 # twitter friends/ids endpoint in order to get a list of ids that they
 # follow. This is saved in a .txt file. Each line beings with the user in
-# question followed by ids separated as spaces.
+# question followed by ids separated as spaces. If output_file ends in .bin
+# the lists are written as compact binary blocks instead (see
+# following_io.py), which user_following_graph.py reads just the same.
+#
+# Requests are made concurrently with asyncio, one set of workers per
+# credential in the twitter config (see twitter_api.py). Each credential has
+# a token bucket kept in sync with twitter's x-rate-limit-* headers, so a
+# credential waits only when its window is used up. The next page of a user
+# is queued as soon as its cursor comes back, ahead of new users, and is
+# picked up by whichever credential has budget first. A page answered with a
+# 5xx, or with no response at all, is queued again after an exponential
+# backoff; a user is only marked failed on a 4xx (e.g. 401 for a protected
+# account, 404 for a deleted one) or once `retries` attempts at the same page
+# have failed.
+#
+# Progress is checkpointed to crawl_journal.sqlite (see crawl_journal.py)
+# after every page. Rerunning the script after an interruption resumes each
+# user from where it stopped; users already done or failed are skipped.
 #
 # Input:
 # repo/data/processed/user_following/user_list.pkl
 # Output:
 # repo/data/processed/user_following/*
 ################################################################################
-import requests
-from requests_oauthlib import OAuth1
-import cnfg
+import asyncio
+import functools
+import itertools
+import os
 import pickle
+import random
 import traceback
-import time
+import requests
 from datetime import date, datetime
+from crawl_journal import CrawlJournal, FIRST_CURSOR
+from following_io import is_binary, write_following_block
+from twitter_api import load_credentials, api_base, TokenBucket, \
+    FRIENDS_IDS_LIMIT
+
+# number of requests each credential may have in flight at once
+WORKERS_PER_CREDENTIAL = 2
+
+output_file = "../data/processed/user_following/saved_users4.txt"
+log_file = "../data/processed/user_following/following_list_log4.txt"
+journal_file = "../data/processed/user_following/crawl_journal.sqlite"
+# compression of the blocks of a .bin output_file; 'zlib' or 'raw'
+binary_codec = 'zlib'
+
+
+def log_failure(user, cursor, status, exc=False):
+    """
+    Note a user we could not get the following list of.
+
+    :param exc: True to also log the traceback of the exception being handled
+    """
+    now = date.strftime(datetime.now(), format='%Y-%m-%d %H:%M')
+    with open(log_file, "a") as log:
+        log.write(now + " @ user " + str(user) + " and cursor " + str(cursor) +
+                  " and response code " + str(status) + "\n")
+        if exc:
+            traceback.print_exc(limit=None, file=log, chain=True)
 
-# get twitter credentials confidentially
-config = cnfg.load(".twitter_config")
-oauth = OAuth1(config["consumer_key"],
-               config["consumer_secret"],
-               config["access_token"],
-               config["access_token_secret"])
-
-with open("../data/processed/user_following/user_list.pkl", 'rb') as picklefile:
-     user_list = pickle.load(picklefile)
-
-while len(user_list) > 0:
-    user = user_list.pop(0)
-    try:
-        response = requests.get(
-            "https://api.twitter.com/1.1/friends/ids.json?user_id="+user,
-            auth=oauth)
-        cursor = '0'
-        status = response.status_code
-
-        if status != 200:  # making sure we are within rate limits
-            time.sleep(63)
-
-        response_json = response.json()
-        ids = response_json['ids']
-
-        # stringify list of ids
-        list_of_strings = [str(u) for u in ids]
-
-        long_s = ""
-
-        for s in list_of_strings:
-            long_s = long_s + " " + s
-
-        while response_json['next_cursor'] > 0:
-            cursor = response_json['next_cursor_str']
-
-            # API call & turn into json
-            req = "https://api.twitter.com/1.1/friends/ids.json?user_id" \
-                  "=" + user + '&cursor=' + cursor
-
-            response = requests.get(req, auth=oauth)
-
-            if status != 200:  # just in case
-                time.sleep(63)
-
-            response_json = response.json()
-            ids = response_json['ids']
-
-            # stringify the current list of following ids
-            list_of_strings = [str(u) for u in ids]
-
-            # and append to long string
-            for s in list_of_strings:
-                long_s = long_s + " " + s
-
-        # append to the .txt file the long string, beginning with the user id
-        with open("../data/processed/user_following/saved_users4.txt",
-                  "a") as following_list:
-            following_list.write(user + " " + long_s + "\n")
 
-    except Exception as ex:
-        now = date.strftime(datetime.now(), format='%Y-%m-%d %H:%M')
-        status_str = str(status)
-        with open("../data/processed/user_following/following_list_log4.txt",
-                  "a") as log:
-            log.write(now + " @ user " + str(user) + "and cursor " + cursor +
-                      " and response code " + status_str + "\n")
-            traceback.print_exc(limit=None, file=log, chain=True)
-    finally:
-        time.sleep(63)
+def save_following(user, ids):
+    """
+    Append a user & the ids they follow to the output file, and make
+    sure it is on disk before the user is marked done in the journal.
+    """
+    if is_binary(output_file):
+        with open(output_file, "ab") as following_list:
+            write_following_block(following_list, user, ids,
+                                  codec=binary_codec)
+            following_list.flush()
+            os.fsync(following_list.fileno())
+        return
+    with open(output_file, "a") as following_list:
+        following_list.write(user + "  " + " ".join(str(u) for u in ids) +
+                             "\n")
+        following_list.flush()
+        os.fsync(following_list.fileno())
+
+
+class Crawler:
+    """
+    Crawls friends/ids for a list of users across several credentials.
+    """
+
+    def __init__(self, credentials, base_url, journal, retries=5,
+                 backoff=2.0):
+        """
+        :param credentials: list of OAuth1, one per credential set
+        :param base_url: base url of the API
+        :param journal: CrawlJournal to checkpoint progress to
+        :param retries: attempts per page before giving up on the user
+        :param backoff: base of the exponential backoff, in seconds
+        """
+        self.base_url = base_url
+        self.journal = journal
+        self.retries = retries
+        self.backoff = backoff
+        self.credentials = []
+        for oauth in credentials:
+            session = requests.Session()
+            session.auth = oauth
+            self.credentials.append((session, TokenBucket(FRIENDS_IDS_LIMIT)))
+        self.queue = None
+        self.order = itertools.count()
+
+    def put(self, user, cursor, attempt=0):
+        # continuations go ahead of new users so partial lists don't pile up
+        priority = 0 if cursor != FIRST_CURSOR else 1
+        self.queue.put_nowait((priority, next(self.order), user, cursor,
+                               attempt))
+
+    async def retry(self, user, cursor, status, attempt, exc=False):
+        """
+        Queue a page again after a transient failure, or mark the user
+        failed if it was the last attempt.
+
+        :param status: response code, or None if there was no response
+        :param attempt: number of attempts at the page before this one
+        :param exc: True to also log the traceback of the exception being
+        handled
+        """
+        if attempt + 1 >= self.retries:
+            self.journal.failed(user, cursor, status)
+            log_failure(user, cursor, status, exc=exc)
+            return
+        await asyncio.sleep(self.backoff * 2 ** attempt *
+                            random.uniform(0.5, 1.5))
+        self.put(user, cursor, attempt + 1)
+
+    async def fetch(self, session, bucket, user, cursor):
+        await bucket.acquire()
+        loop = asyncio.get_event_loop()
+        response = await loop.run_in_executor(None, functools.partial(
+            session.get, self.base_url + "/friends/ids.json",
+            params={'user_id': user, 'cursor': cursor}, timeout=60))
+        bucket.update(response.headers)
+        return response
+
+    async def worker(self, session, bucket):
+        while True:
+            _, _, user, cursor, attempt = await self.queue.get()
+            status = None
+            try:
+                try:
+                    response = await self.fetch(session, bucket, user, cursor)
+                    status = response.status_code
+                    if status == 200:
+                        response_json = response.json()
+                except (requests.RequestException, ValueError):
+                    # no response (timeout, reset connection) or a
+                    # truncated one
+                    await self.retry(user, cursor, status, attempt, exc=True)
+                    continue
+
+                if status == 429:  # over the rate limit; try again later
+                    bucket.exhaust(response.headers)
+                    self.put(user, cursor, attempt)
+                    continue
+                if status >= 500:  # e.g. 503 over capacity
+                    await self.retry(user, cursor, status, attempt)
+                    continue
+                if status != 200:
+                    self.journal.failed(user, cursor, status)
+                    log_failure(user, cursor, status)
+                    continue
+
+                next_cursor = response_json['next_cursor_str']
+                self.journal.page(user, response_json['ids'], next_cursor)
+
+                if response_json['next_cursor'] > 0:
+                    self.put(user, next_cursor)
+                else:
+                    save_following(user, self.journal.following(user))
+                    self.journal.done(user)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception:
+                self.journal.failed(user, cursor, status)
+                log_failure(user, cursor, status, exc=True)
+            finally:
+                self.queue.task_done()
+
+    async def crawl(self, users):
+        """
+        Get the following list of every user not yet done or failed in the
+        journal, resuming users that were part way through.
+
+        :param users: list of user id strings
+        """
+        self.journal.add_users(users)
+        self.queue = asyncio.PriorityQueue()
+        for user, cursor in self.journal.resume():
+            if cursor == '0':
+                # every page was fetched but the run stopped before the user
+                # was marked done
+                save_following(user, self.journal.following(user))
+                self.journal.done(user)
+            else:
+                self.put(user, cursor)
+
+        workers = [asyncio.ensure_future(self.worker(session, bucket))
+                   for session, bucket in self.credentials
+                   for _ in range(WORKERS_PER_CREDENTIAL)]
+        try:
+            await self.queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+if __name__ == '__main__':
+    # only needed here, so the Crawler can be used without it (see
+    # check_crawler.py)
+    import cnfg
+
+    # get twitter credentials confidentially
+    config = cnfg.load(".twitter_config")
+
+    with open("../data/processed/user_following/user_list.pkl",
+              'rb') as picklefile:
+        user_list = pickle.load(picklefile)
+
+    with CrawlJournal(journal_file) as journal:
+        crawler = Crawler(load_credentials(config), api_base(config), journal)
+        asyncio.run(crawler.crawl(user_list))
+        print(journal.counts())
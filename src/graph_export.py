@@ -0,0 +1,268 @@
+################################################################################
+# Export a stored graph for Gephi, as GEXF or GML, without building it in
+# networkx first.
+#
+# Nodes and edges are written straight from the CSR arrays and the typed
+# attribute columns, a chunk of rows at a time, so memory stays flat and
+# values only become strings as they are written. A node missing a value
+# (e.g. a null corpus) has that attribute left out rather than written as
+# 'nan', which Gephi would take for a category. A node mask picks the
+# subset to export; corpus_mask, degree_mask and k_core_mask build one, e.g.
+# to cut the following graph down to something Gephi can lay out.
+################################################################################
+import math
+import numpy as np
+import pandas as pd
+from csr_graph import SubgraphView
+
+# rows of the adjacency written per chunk
+CHUNK_ROWS = 1 << 14
+
+
+def corpus_mask(graph, corpora, attr='corpus'):
+    """
+    :param graph: CSRGraph
+    :param corpora: corpus labels to keep
+    :param attr: node attribute holding the corpus
+    :return: boolean array over the graph's nodes, True in those corpora
+    """
+    return np.isin(np.asarray(graph.node_attrs[attr], dtype=object),
+                   list(corpora))
+
+
+def degree_mask(graph, mask=None, min_degree=1):
+    """
+    :param graph: CSRGraph
+    :param mask: boolean array over the graph's nodes to start from, None
+    for all of them
+    :param min_degree: least in + out degree, counted within the masked
+    subgraph
+    :return: boolean array over the graph's nodes
+    """
+    if mask is None:
+        mask = np.ones(graph.number_of_nodes(), dtype=bool)
+    view = SubgraphView(graph, mask)
+    degree = view.in_degree_array() + view.out_degree_array()
+    keep = np.zeros(graph.number_of_nodes(), dtype=bool)
+    keep[view.parent_ids[degree >= min_degree]] = True
+    return keep
+
+
+def k_core_mask(graph, k, mask=None):
+    """
+    The k-core of the masked subgraph: the largest subgraph in which every
+    node has in + out degree of at least k, like nx.k_core on a DiGraph.
+
+    :param graph: CSRGraph
+    :param k: core number
+    :param mask: boolean array over the graph's nodes to start from, None
+    for all of them
+    :return: boolean array over the graph's nodes
+    """
+    if mask is None:
+        mask = np.ones(graph.number_of_nodes(), dtype=bool)
+    view = SubgraphView(graph, mask)
+    n = view.number_of_nodes()
+    src, dst = view.edge_arrays()
+
+    # peel off every node below k at once, until none are left to peel
+    alive = np.ones(n, dtype=bool)
+    while True:
+        live = alive[src] & alive[dst]
+        degree = np.bincount(src[live], minlength=n) + \
+            np.bincount(dst[live], minlength=n)
+        peel = alive & (degree < k)
+        if not peel.any():
+            break
+        alive &= ~peel
+
+    keep = np.zeros(graph.number_of_nodes(), dtype=bool)
+    keep[view.parent_ids[alive]] = True
+    return keep
+
+
+def _kind(values):
+    """
+    :return: 'integer', 'float', 'boolean' or 'string'
+    """
+    if isinstance(values, pd.Categorical):
+        return 'string'
+    dtype = getattr(values, 'dtype', np.dtype(object))
+    if dtype.kind == 'b':
+        return 'boolean'
+    if dtype.kind in 'iu':
+        return 'integer'
+    if dtype.kind == 'f':
+        return 'float'
+    return 'string'
+
+
+def _chunks(graph, mask):
+    """
+    Yield (node ids, src, dst) a block of rows at a time. Node ids are the
+    kept rows of the block; src & dst are the edges out of them to kept
+    nodes, as positions among the kept nodes.
+    """
+    n = graph.number_of_nodes()
+    local = np.cumsum(mask) - 1
+    for start in range(0, n, CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, n)
+        indptr = np.asarray(graph.indptr[start:stop + 1])
+        dst = np.asarray(graph.indices[indptr[0]:indptr[-1]])
+        src = np.repeat(np.arange(start, stop), np.diff(indptr))
+        keep = mask[src] & mask[dst]
+        nodes = start + np.flatnonzero(mask[start:stop])
+        yield nodes, local[src[keep]], local[dst[keep]]
+
+
+def _column(values, nodes):
+    """
+    :return: (values of the nodes, boolean array, True where one is missing)
+    """
+    if isinstance(values, pd.Categorical):
+        values = np.asarray(values[nodes], dtype=object)
+    else:
+        values = values[nodes]
+    return values, np.asarray(pd.isna(values))
+
+
+def _escape_xml(s):
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '>', '&gt;').replace('"', '&quot;')
+
+
+_GEXF_TYPES = {'integer': 'long', 'float': 'double', 'boolean': 'boolean',
+               'string': 'string'}
+
+
+def _gexf_value(kind, value):
+    if kind == 'boolean':
+        return 'true' if value else 'false'
+    if kind == 'float':
+        return repr(float(value))
+    if kind == 'integer':
+        return str(int(value))
+    return _escape_xml('' if value is None else str(value))
+
+
+def write_gexf(graph, path, mask=None, label='ScreenName'):
+    """
+    Write a graph to a GEXF 1.2 file.
+
+    :param graph: CSRGraph, e.g. from graph_store.read_graph
+    :param path: file to write
+    :param mask: boolean array over the graph's nodes to export, None for
+    all of them
+    :param label: node attribute to label nodes with, if the graph has it
+    :return: (number of nodes, number of edges) written
+    """
+    if mask is None:
+        mask = np.ones(graph.number_of_nodes(), dtype=bool)
+    attrs = [(name, values, _kind(values))
+             for name, values in graph.node_attrs.items()]
+    n_nodes = n_edges = 0
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">\n'
+                '<graph defaultedgetype="directed" mode="static">\n'
+                '<attributes class="node" mode="static">\n')
+        for i, (name, _, kind) in enumerate(attrs):
+            f.write('<attribute id="{}" title="{}" type="{}"/>\n'.format(
+                i, _escape_xml(name), _GEXF_TYPES[kind]))
+        f.write('</attributes>\n<nodes>\n')
+
+        for nodes, _, _ in _chunks(graph, mask):
+            ids = graph.id_str[nodes]
+            labels = ids
+            if label in graph.node_attrs:
+                # nodes missing a label are labelled by their id
+                labels, missing = _column(graph.node_attrs[label], nodes)
+                labels = np.where(missing, ids, labels)
+            columns = [_column(values, nodes) for _, values, _ in attrs]
+            lines = []
+            for j in range(len(nodes)):
+                values = ''.join(
+                    '<attvalue for="{}" value="{}"/>'.format(
+                        i, _gexf_value(kind, column[j]))
+                    for i, ((_, _, kind), (column, missing)) in enumerate(
+                        zip(attrs, columns)) if not missing[j])
+                lines.append('<node id="{}" label="{}"><attvalues>{}'
+                             '</attvalues></node>\n'.format(
+                                 ids[j], _escape_xml(str(labels[j])),
+                                 values))
+            f.writelines(lines)
+            n_nodes += len(nodes)
+
+        f.write('</nodes>\n<edges>\n')
+        id_str = graph.id_str[np.flatnonzero(mask)]
+        for _, src, dst in _chunks(graph, mask):
+            f.writelines('<edge id="{}" source="{}" target="{}"/>\n'.format(
+                n_edges + j, id_str[s], id_str[t])
+                for j, (s, t) in enumerate(zip(src, dst)))
+            n_edges += len(src)
+        f.write('</edges>\n</graph>\n</gexf>\n')
+    return n_nodes, n_edges
+
+
+def _gml_string(value):
+    # like networkx's write_gml: quotes & non-ascii as character references
+    s = '' if value is None else str(value)
+    return '"' + ''.join(c if ' ' <= c <= '~' and c not in '"&' else
+                         '&#{};'.format(ord(c)) for c in s) + '"'
+
+
+def _gml_value(kind, value):
+    if kind == 'boolean':
+        return '1' if value else '0'
+    if kind == 'integer':
+        return str(int(value))
+    if kind == 'float':
+        value = float(value)
+        if math.isinf(value):
+            return 'INF' if value > 0 else '-INF'
+        return repr(value)
+    return _gml_string(value)
+
+
+def write_gml(graph, path, mask=None):
+    """
+    Write a graph to a GML file, laid out like nx.write_gml with the node
+    ids (twitter ids) as labels.
+
+    :param graph: CSRGraph, e.g. from graph_store.read_graph
+    :param path: file to write
+    :param mask: boolean array over the graph's nodes to export, None for
+    all of them
+    :return: (number of nodes, number of edges) written
+    """
+    if mask is None:
+        mask = np.ones(graph.number_of_nodes(), dtype=bool)
+    attrs = [(name, values, _kind(values))
+             for name, values in graph.node_attrs.items()]
+    n_nodes = n_edges = 0
+
+    with open(path, 'w', encoding='ascii') as f:
+        f.write('graph [\n  directed 1\n')
+        for nodes, _, _ in _chunks(graph, mask):
+            ids = graph.id_str[nodes]
+            columns = [_column(values, nodes) for _, values, _ in attrs]
+            lines = []
+            for j in range(len(nodes)):
+                lines.append('  node [\n    id {}\n    label {}\n'.format(
+                    n_nodes + j, _gml_string(ids[j])))
+                for (name, _, kind), (column, missing) in zip(attrs,
+                                                              columns):
+                    if not missing[j]:
+                        lines.append('    {} {}\n'.format(
+                            name, _gml_value(kind, column[j])))
+                lines.append('  ]\n')
+            f.writelines(lines)
+            n_nodes += len(nodes)
+
+        for _, src, dst in _chunks(graph, mask):
+            f.writelines('  edge [\n    source {}\n    target {}\n  ]\n'.format(
+                s, t) for s, t in zip(src, dst))
+            n_edges += len(src)
+        f.write(']\n')
+    return n_nodes, n_edges
@@ -0,0 +1,473 @@
+################################################################################
+# A long-running local process that keeps graphs loaded and answers metric
+# requests about them, so metric scripts and notebooks don't each pay for
+# loading the same graph.
+#
+# Graphs are opened by name, as objects in the store (see object_store.py)
+# or local .graph files, memory-mapped (see graph_store.py) and kept open.
+# A request names a graph, optionally a corpus (the subgraph of that
+# corpus' users, see corpus_partition.py), a metric and its parameters.
+# Results are kept per graph version (the object's content hash, or a local
+# file's size & modification time), so asking again is instant, and a graph
+# that changed is loaded again with its old results dropped.
+#
+# Start the server;
+#   python graph_server.py --preload raw/all_users_digraph.graph
+# then, e.g. from a notebook in src/;
+#   from graph_server import GraphClient
+#   with GraphClient() as client:
+#       clustering = client.metric('clustering',
+#                                  'raw/all_users_digraph.graph',
+#                                  corpus='todes')
+#
+# Requests are served one at a time on the main thread (the metrics use
+# their own process pools); connections wait in their own threads.
+#
+# The metric scripts (network_metrics.py, network_metrics_by_user.py,
+# refresh_network_metrics_by_user.py) send their requests here when given
+# --server, or when $TWEETHIS_GRAPH_SERVER is set to the server's host:port,
+# through a MetricSource. Without a server, MetricSource works the same
+# metrics out in the script's own process. The server must read the same
+# store as the scripts, and be restarted after the metric code changes.
+#
+# Requests are pickled, so only clients holding the server's key may
+# connect. The key is $TWEETHIS_GRAPH_KEY if set; otherwise the server makes
+# a random one at startup and writes it to a file only the user can read
+# ($TWEETHIS_GRAPH_KEY_FILE, default ~/.cache/tweethis/graph_server.key),
+# where GraphClient picks it up.
+#
+# Input:
+# the graphs asked for
+################################################################################
+import argparse
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+from collections import OrderedDict
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import numpy as np
+import pandas as pd
+from betweenness import betweenness_centrality
+from clustering import average_clustering, estimate_average_clustering, \
+    local_clustering
+from corpus_partition import CorpusPartition
+from graph_store import read_graph
+from nhop import nhop_sizes, nhop_walks
+from object_store import open_store
+from triads import estimate_triadic_census, triad_participation, \
+    triadic_census
+from user_metrics import degrees, node_reciprocity, overall_reciprocity
+
+DEFAULT_ADDRESS = ('localhost', 6300)
+KEY_FILE = os.path.join('~', '.cache', 'tweethis', 'graph_server.key')
+# results kept, least recently used dropped first
+MAX_RESULTS = 256
+
+
+def _key_file():
+    return os.path.expanduser(os.environ.get('TWEETHIS_GRAPH_KEY_FILE',
+                                             KEY_FILE))
+
+
+def new_authkey():
+    """
+    :return: $TWEETHIS_GRAPH_KEY, or else a random key, written to the key
+    file with only the user allowed to read it
+    """
+    if os.environ.get('TWEETHIS_GRAPH_KEY'):
+        return os.environ['TWEETHIS_GRAPH_KEY'].encode()
+    key = secrets.token_hex(32)
+    path = _key_file()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # created 0600, and made so if it already existed
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(key)
+    return key.encode()
+
+
+def client_authkey():
+    """
+    :return: $TWEETHIS_GRAPH_KEY, or else the key the running server wrote
+    """
+    if os.environ.get('TWEETHIS_GRAPH_KEY'):
+        return os.environ['TWEETHIS_GRAPH_KEY'].encode()
+    try:
+        with open(_key_file(), 'r') as f:
+            return f.read().strip().encode()
+    except FileNotFoundError:
+        raise RuntimeError("no graph server key in {}; start graph_server.py "
+                           "or set TWEETHIS_GRAPH_KEY".format(_key_file()))
+
+
+# ---------------------------------------------------------------------------- #
+# metrics: each takes a CSRGraph / SubgraphView & keyword parameters
+# ---------------------------------------------------------------------------- #
+def _degree(graph):
+    in_deg, out_deg = degrees(graph)
+    return pd.DataFrame({'in_deg': in_deg, 'out_deg': out_deg},
+                        index=graph.id_str)
+
+
+def _degree_centrality(graph):
+    # like nx.degree_centrality & co
+    n = graph.number_of_nodes()
+    scale = 1.0 / (n - 1) if n > 1 else 1.0
+    in_deg, out_deg = degrees(graph)
+    return pd.DataFrame({'deg_central': (in_deg + out_deg) * scale,
+                         'in_deg_central': in_deg * scale,
+                         'out_deg_central': out_deg * scale},
+                        index=graph.id_str)
+
+
+def _triad_participation(graph, **params):
+    return triad_participation(graph, **params)[1]
+
+
+def _betweenness(graph, **params):
+    bet = betweenness_centrality(graph, **params)
+    logging.info("{} betweenness: {}".format(graph.name, bet))
+    return pd.Series(bet.values, index=graph.id_str)
+
+
+def _series(function):
+    # indexed by the id_str of the rows asked for, if the metric takes rows
+    def metric(graph, **params):
+        rows = params.get('rows')
+        index = graph.id_str if rows is None else graph.id_str[rows]
+        return pd.Series(function(graph, **params), index=index)
+    return metric
+
+
+METRICS = {
+    'degree': _degree,
+    'degree_centrality': _degree_centrality,
+    'reciprocity': _series(node_reciprocity),
+    'overall_reciprocity': overall_reciprocity,
+    'clustering': _series(local_clustering),
+    'average_clustering': average_clustering,
+    'estimate_average_clustering': estimate_average_clustering,
+    'triadic_census': triadic_census,
+    'triad_participation': _triad_participation,
+    'estimate_triadic_census': estimate_triadic_census,
+    'betweenness': _betweenness,
+    'nhop_walks': _series(nhop_walks),
+    'nhop_sizes': _series(nhop_sizes),
+}
+
+
+def _jsonable(value):
+    # parameters such as rows are numpy arrays
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("can't key a result on {!r}".format(value))
+
+
+class GraphServer:
+    """
+    Loaded graphs and the results worked out on them.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None, store=None,
+                 max_results=MAX_RESULTS):
+        """
+        :param address: (host, port) to listen on
+        :param authkey: bytes clients must present, default from
+        new_authkey()
+        :param store: ObjectStore graphs are read from, default open_store()
+        :param max_results: number of results kept
+        """
+        self.address = address
+        self.authkey = authkey or new_authkey()
+        self.store = store or open_store()
+        self.max_results = max_results
+        # name -> (version, graph, {corpus: view})
+        self.graphs = {}
+        self.results = OrderedDict()
+        self.jobs = queue.Queue()
+        self.running = True
+
+    def version(self, name):
+        """
+        :return: version of a graph: its content hash in the store, or the
+        size & mtime of a local file
+        """
+        if os.path.exists(name):
+            stat = os.stat(name)
+            return 'file:{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+        version = self.store.fingerprint(name)
+        if version is None:
+            raise KeyError("no graph " + name)
+        return version
+
+    def graph(self, name, corpus=None):
+        """
+        :return: (version, graph or corpus view), loading the graph if it is
+        new or has changed
+        """
+        version = self.version(name)
+        if name not in self.graphs or self.graphs[name][0] != version:
+            logging.info("load {} ({})".format(name, version))
+            path = name if os.path.exists(name) else self.store.path(name)
+            self.graphs[name] = (version, read_graph(path), {})
+            # results of older versions are of no more use
+            for key in [k for k in self.results if k[0] == name and
+                        k[1] != version]:
+                del self.results[key]
+        version, graph, views = self.graphs[name]
+        if corpus is None:
+            return version, graph
+        if corpus not in views:
+            views[corpus] = CorpusPartition(graph).view(corpus, name=corpus)
+        return version, views[corpus]
+
+    def metric(self, metric, name, corpus=None, params=None):
+        """
+        :return: the metric on the graph, from the results kept if it was
+        worked out before on this version
+        """
+        if metric not in METRICS:
+            raise KeyError("no metric {}, choose from {}".format(
+                metric, ', '.join(sorted(METRICS))))
+        params = params or {}
+        version, graph = self.graph(name, corpus)
+        key = (name, version, corpus, metric,
+               json.dumps(params, sort_keys=True, default=_jsonable))
+        if key in self.results:
+            self.results.move_to_end(key)
+            return self.results[key]
+
+        logging.info("compute {} on {} {} {}".format(metric, name,
+                                                      corpus or '', params))
+        result = METRICS[metric](graph, **params)
+        self.results[key] = result
+        while len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+        return result
+
+    def handle(self, request):
+        op = request.get('op')
+        if op == 'metric':
+            return self.metric(request['metric'], request['graph'],
+                               request.get('corpus'), request.get('params'))
+        if op == 'load':
+            return self.graph(request['graph'], request.get('corpus'))[0]
+        if op == 'status':
+            return {'graphs': {name: version for name, (version, _, _) in
+                               self.graphs.items()},
+                    'results': len(self.results),
+                    'metrics': sorted(METRICS)}
+        if op == 'stop':
+            self.running = False
+            return True
+        raise ValueError("unknown request {}".format(op))
+
+    def _connection(self, conn):
+        # pass each request to the main thread & send back what it returns
+        reply = queue.Queue()
+        try:
+            while True:
+                request = conn.recv()
+                sent = threading.Event()
+                self.jobs.put((request, reply, sent))
+                conn.send(reply.get())
+                sent.set()
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _accept(self, listener):
+        while self.running:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                logging.warning("connection with a wrong key refused")
+                continue
+            except (OSError, EOFError):
+                continue
+            threading.Thread(target=self._connection, args=(conn,),
+                             daemon=True).start()
+
+    def serve_forever(self):
+        """
+        Serve requests until a client sends a stop request.
+        """
+        listener = Listener(self.address, authkey=self.authkey)
+        logging.info("serving graphs on {}:{}".format(*listener.address))
+        threading.Thread(target=self._accept, args=(listener,),
+                         daemon=True).start()
+        try:
+            while self.running:
+                try:
+                    request, reply, sent = self.jobs.get(timeout=1)
+                except queue.Empty:
+                    continue
+                try:
+                    reply.put(('ok', self.handle(request)))
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except Exception as e:
+                    logging.exception("error with {}".format(request))
+                    reply.put(('error', '{}: {}'.format(type(e).__name__, e)))
+                if not self.running:
+                    # a stop request; answer it before the process exits
+                    sent.wait(timeout=5)
+        finally:
+            listener.close()
+
+
+class GraphClient:
+    """
+    Connection to a GraphServer. Not to be shared between threads.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        self.conn = Client(address, authkey=authkey or client_authkey())
+
+    def _call(self, **request):
+        self.conn.send(request)
+        status, value = self.conn.recv()
+        if status == 'error':
+            raise RuntimeError(value)
+        return value
+
+    def metric(self, metric, graph, corpus=None, **params):
+        """
+        :param metric: one of graph_server.METRICS, e.g. 'clustering'
+        :param graph: store name or local path of a .graph file
+        :param corpus: only the subgraph of this corpus' users, e.g. 'todes'
+        :param params: keyword parameters of the metric, e.g. k=1000 for
+        'betweenness'
+        :return: the metric; per node ones are pandas objects indexed by
+        id_str
+        """
+        return self._call(op='metric', metric=metric, graph=graph,
+                          corpus=corpus, params=params)
+
+    def load(self, graph, corpus=None):
+        """
+        Have the server load a graph ahead of time.
+
+        :return: version of the graph
+        """
+        return self._call(op='load', graph=graph, corpus=corpus)
+
+    def status(self):
+        """
+        :return: dict of the loaded graphs & their versions, the number of
+        results kept and the metrics on offer
+        """
+        return self._call(op='status')
+
+    def stop(self):
+        """
+        Shut the server down.
+        """
+        return self._call(op='stop')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def server_address(spec=None):
+    """
+    :param spec: host:port of a graph server, e.g. a script's --server;
+    default $TWEETHIS_GRAPH_SERVER
+    :return: (host, port), or None if no server is to be used
+    """
+    spec = spec or os.environ.get('TWEETHIS_GRAPH_SERVER')
+    if not spec:
+        return None
+    host, _, port = spec.rpartition(':')
+    return host or DEFAULT_ADDRESS[0], int(port)
+
+
+def add_server_argument(parser):
+    """
+    Add the --server option of the metric scripts to an ArgumentParser.
+    """
+    parser.add_argument(
+        '--server', nargs='?', const='{}:{}'.format(*DEFAULT_ADDRESS),
+        help="send metric requests to the graph server at host:port "
+             "(default {}:{}, or $TWEETHIS_GRAPH_SERVER) rather than "
+             "working them out here".format(*DEFAULT_ADDRESS))
+
+
+class MetricSource:
+    """
+    Works out metrics through a GraphServer if there is one to use, or in
+    this process with the server's own metric functions otherwise, so either
+    way gives the same results.
+    """
+
+    def __init__(self, address=None, store=None):
+        """
+        :param address: (host, port) of the server, see server_address; None
+        to work metrics out in this process
+        :param store: ObjectStore the script reads its graphs from, to check
+        the server has the same version of them
+        """
+        self.client = GraphClient(address) if address else None
+        self.store = store
+        self.checked = set()
+
+    def _check(self, name):
+        if name in self.checked or self.store is None:
+            return
+        version, ours = self.client.load(name), self.store.fingerprint(name)
+        if version != ours:
+            raise RuntimeError("the graph server has version {} of {}, not "
+                               "{}; is it reading another store?".format(
+                                   version, name, ours))
+        self.checked.add(name)
+
+    def metric(self, metric, graph, name, corpus=None, **params):
+        """
+        :param metric: one of METRICS, e.g. 'clustering'
+        :param graph: CSRGraph or corpus view to work it out on here
+        :param name: store name of the graph, for the server
+        :param corpus: corpus of the view, for the server
+        :param params: keyword parameters of the metric
+        :return: the metric, as GraphClient.metric returns it
+        """
+        if self.client is None:
+            return METRICS[metric](graph, **params)
+        self._check(name)
+        logging.info("{} on {} {} from the graph server".format(
+            metric, name, corpus or ''))
+        return self.client.metric(metric, name, corpus=corpus, **params)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='graph_server.log', level=logging.INFO,
+                        format='%(asctime)s %(message)s')
+    parser = argparse.ArgumentParser(
+        description="Keep graphs loaded & serve metric requests on them.")
+    parser.add_argument('--host', default=DEFAULT_ADDRESS[0])
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument('--preload', nargs='+', default=[],
+                        help="graphs to load before taking requests")
+    args = parser.parse_args()
+
+    server = GraphServer((args.host, args.port))
+    for name in args.preload:
+        server.graph(name)
+    server.serve_forever()
@@ -0,0 +1,235 @@
+################################################################################
+# On-disk format for CSRGraph, replacing nx.write_gpickle / nx.read_gpickle.
+#
+# A .graph file is a small JSON header followed by raw little-endian arrays,
+# each aligned to 64 bytes:
+#
+#   b'AOAGRAPH' | uint32 format version | uint32 header length | header json
+#   | indptr | indices | in_indptr | in_indices | id strings | node attributes
+#
+# Reading a .graph file memory-maps every array, so opening one takes
+# milliseconds and only the pages a stage actually touches are read from
+# disk. Processes that open the same file share those pages through the OS
+# page cache instead of each holding an unpickled copy.
+#
+# Node attributes are stored as columns:
+# - numeric & bool arrays as is
+# - pandas Categoricals (corpus), and columns the writer names, as integer
+#   codes plus the categories and their dtype in the header
+# - any other object column (ScreenName) as utf-8 bytes plus int64 offsets
+# Values are never turned into strings on the way; a column that can't be
+# stored as it is is refused.
+################################################################################
+import json
+import struct
+import numpy as np
+import pandas as pd
+from csr_graph import CSRGraph
+
+MAGIC = b'AOAGRAPH'
+FORMAT_VERSION = 1
+ALIGN = 64
+
+
+class StrColumn:
+    """
+    Read-only column of strings stored as utf-8 bytes plus offsets. Strings
+    are only decoded when indexed.
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _get(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i+1]]).decode(
+            'utf-8')
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            return self._get(key)
+        idx = np.arange(len(self))[key]
+        return np.array([self._get(i) for i in idx], dtype=object)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(list(self), dtype=object if dtype is None else dtype)
+
+
+def _encode_strings(values):
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def _categories(name, categories):
+    """
+    :return: header entries for the categories of a Categorical attribute
+    """
+    if categories.dtype.kind in 'biuf':
+        return {'categories': categories.tolist(),
+                'categories_dtype': categories.dtype.str}
+    if not all(isinstance(c, str) for c in categories):
+        raise TypeError("attribute {} has categories that are neither "
+                        "numbers nor strings".format(name))
+    return {'categories': list(categories)}
+
+
+def _columns(graph, categorical=()):
+    """
+    Turn a graph into a header description plus a list of arrays to write.
+
+    :param categorical: names of attributes to store as categories even if
+    they aren't pandas Categoricals
+    """
+    arrays = []
+    header = {'name': graph.name,
+              'n_nodes': graph.number_of_nodes(),
+              'n_edges': graph.number_of_edges(),
+              'arrays': {},
+              'node_attrs': {}}
+
+    def add(key, arr):
+        arr = np.ascontiguousarray(arr)
+        arr = arr.astype(arr.dtype.newbyteorder('<'), copy=False)
+        header['arrays'][key] = {'dtype': arr.dtype.str,
+                                 'shape': list(arr.shape)}
+        arrays.append((key, arr))
+        return key
+
+    add('indptr', np.asarray(graph.indptr, dtype=np.int64))
+    add('indices', np.asarray(graph.indices, dtype=np.int32))
+    add('in_indptr', np.asarray(graph.in_indptr, dtype=np.int64))
+    add('in_indices', np.asarray(graph.in_indices, dtype=np.int32))
+
+    offsets, data = _encode_strings(graph.id_str)
+    add('id_str.offsets', offsets)
+    add('id_str.data', data)
+
+    for name, values in graph.node_attrs.items():
+        key = 'attr.' + name
+        if name in categorical and not isinstance(values, pd.Categorical):
+            values = pd.Categorical(np.asarray(values, dtype=object))
+        if not isinstance(values, pd.Categorical):
+            values = np.asarray(values)
+        if isinstance(values, pd.Categorical):
+            header['node_attrs'][name] = dict(
+                _categories(name, values.categories), kind='category',
+                codes=add(key + '.codes', values.codes))
+        elif values.dtype.kind in 'biuf':
+            header['node_attrs'][name] = {'kind': 'array',
+                                          'data': add(key, values)}
+        else:
+            if not all(isinstance(v, str) for v in values):
+                raise TypeError("attribute {} has values that aren't "
+                                "strings; make it a pd.Categorical to keep "
+                                "them".format(name))
+            offsets, data = _encode_strings(values)
+            header['node_attrs'][name] = {
+                'kind': 'str',
+                'offsets': add(key + '.offsets', offsets),
+                'data': add(key + '.data', data)}
+    return header, arrays
+
+
+def _pad(n):
+    return (ALIGN - n % ALIGN) % ALIGN
+
+
+def write_graph(graph, path, categorical=()):
+    """
+    Write a CSRGraph, with its node attributes, to a .graph file.
+
+    :param graph: CSRGraph
+    :param path: local file name
+    :param categorical: names of attributes to store as categories, besides
+    those that are pandas Categoricals already
+    """
+    header, arrays = _columns(graph, categorical)
+
+    # lay out the arrays after the header. The header holds the offsets, so
+    # keep growing its reserved size until the layout is stable
+    reserved = 0
+    while True:
+        offset = len(MAGIC) + 8 + reserved
+        offset += _pad(offset)
+        for key, arr in arrays:
+            header['arrays'][key]['offset'] = offset
+            offset += arr.nbytes + _pad(arr.nbytes)
+        header['version'] = FORMAT_VERSION
+        raw = json.dumps(header).encode('utf-8')
+        if len(raw) <= reserved:
+            break
+        reserved = len(raw) + 256
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<II', FORMAT_VERSION, reserved))
+        f.write(raw.ljust(reserved, b' '))
+        for key, arr in arrays:
+            f.seek(header['arrays'][key]['offset'])
+            f.write(arr.tobytes())
+        # make sure a trailing empty array still lies inside the file
+        f.truncate(offset)
+
+
+def read_header(path):
+    """
+    :param path: .graph file
+    :return: dict of the file's header
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError("{} is not a graph file".format(path))
+        version, length = struct.unpack('<II', f.read(8))
+        if version != FORMAT_VERSION:
+            raise ValueError("{} has graph format version {}, expected "
+                             "{}".format(path, version, FORMAT_VERSION))
+        return json.loads(f.read(length).decode('utf-8'))
+
+
+def read_graph(path):
+    """
+    Open a .graph file. Edge arrays, id strings and node attributes are all
+    memory-mapped rather than read.
+
+    :param path: .graph file
+    :return: CSRGraph
+    """
+    header = read_header(path)
+
+    def array(key):
+        spec = header['arrays'][key]
+        shape = tuple(spec['shape'])
+        if np.prod(shape) == 0:
+            return np.zeros(shape, dtype=spec['dtype'])
+        return np.memmap(path, dtype=spec['dtype'], mode='r',
+                         offset=spec['offset'], shape=shape)
+
+    graph = CSRGraph(StrColumn(array('id_str.offsets'), array('id_str.data')),
+                     array('indptr'), array('indices'),
+                     array('in_indptr'), array('in_indices'),
+                     name=header['name'])
+
+    for name, spec in header['node_attrs'].items():
+        if spec['kind'] == 'category':
+            categories = pd.Index(spec['categories'],
+                                  dtype=spec.get('categories_dtype', object))
+            values = pd.Categorical.from_codes(array(spec['codes']),
+                                               categories)
+        elif spec['kind'] == 'str':
+            values = StrColumn(array(spec['offsets']), array(spec['data']))
+        else:
+            values = array(spec['data'])
+        graph.node_attrs[name] = values
+    return graph
@@ -0,0 +1,151 @@
+################################################################################
+# On-disk cache of per-user metric columns, so a rerun of
+# network_metrics_by_user.py only recomputes the metrics that could have
+# changed.
+#
+# An entry is a DataFrame of one or more columns indexed by id_str, stored
+# as Parquet under a hash of;
+# - the version of the graph it was computed on (its content hash in the
+#   store, see object_store.py)
+# - the metric's name & parameters, e.g. the corpus and number of pivots
+# - the version of the code computing it: a hash of the module defining it
+#   and the local modules that imports (see pipeline.local_modules)
+# so fixing e.g. betweenness.py only invalidates the betweenness columns.
+# Least recently used entries are removed once the cache is over its size
+# budget. Entries can also be recomputed on demand, by metric name or by the
+# name of a column they hold, e.g. just l_bet_central.
+################################################################################
+import hashlib
+import json
+import logging
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pipeline import local_modules
+
+DEFAULT_CACHE = os.path.join('~', '.cache', 'tweethis', 'metrics')
+DEFAULT_CACHE_BYTES = 2 << 30
+
+
+def code_version(*modules, files=()):
+    """
+    :param modules: names of modules in src/, e.g. 'betweenness'
+    :param files: paths of files hashed on their own, without what they
+    import, e.g. the script putting the metric's columns together
+    :return: hash of their source and that of the local modules they import
+    """
+    md5 = hashlib.md5()
+    paths = {os.path.abspath(path) for path in files}
+    for module in modules:
+        paths.update(local_modules(module + '.py'))
+    for path in sorted(paths):
+        md5.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            md5.update(f.read())
+    return md5.hexdigest()
+
+
+class MetricCache:
+    """
+    Metric columns cached on disk, keyed on graph version, metric,
+    parameters and code version.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_CACHE_BYTES,
+                 recompute=()):
+        """
+        :param cache_dir: directory for the cached Parquet files. Default is
+        $TWEETHIS_METRIC_CACHE, or ~/.cache/tweethis/metrics.
+        :param max_bytes: least recently used entries are removed once the
+        cache holds more than this
+        :param recompute: metric or column names to compute even if cached
+        """
+        if cache_dir is None:
+            cache_dir = os.environ.get('TWEETHIS_METRIC_CACHE', DEFAULT_CACHE)
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self.recompute = set(recompute)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(graph_version, metric, params, code):
+        """
+        :return: hex key of an entry
+        """
+        return hashlib.sha1(json.dumps(
+            [graph_version, metric, params, code], sort_keys=True,
+            default=str).encode('utf-8')).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.cache_dir, key + '.parquet')
+
+    def get(self, key):
+        """
+        :return: cached DataFrame, or None
+        """
+        path = self._file(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            frame = pq.read_table(path).to_pandas()
+        except (IOError, OSError, pa.ArrowException):
+            logging.exception("error reading " + path)
+            return None
+        # mtime is the last use, for eviction
+        os.utime(path, None)
+        return frame
+
+    def put(self, key, frame):
+        path = self._file(key)
+        tmp = path + '.tmp'
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=True), tmp)
+        os.replace(tmp, path)
+        self._evict(keep=path)
+
+    def _evict(self, keep):
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.parquet'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _forced(self, metric, frame):
+        return metric in self.recompute or \
+            not self.recompute.isdisjoint(frame.columns)
+
+    def columns(self, graph_version, metric, params, code, compute,
+                force=False):
+        """
+        A metric's columns, from the cache if they were computed before on
+        the same graph, with the same parameters and code, and neither the
+        metric nor any of its columns is in self.recompute.
+
+        :param graph_version: version of the graph, e.g. its content hash
+        :param metric: metric name
+        :param params: json-able dict of the parameters
+        :param code: code version, see code_version
+        :param compute: function of no arguments returning the columns as a
+        DataFrame indexed by id_str
+        :param force: compute (and cache) them even if they are cached
+        :return: DataFrame
+        """
+        key = self.key(graph_version, metric, params, code)
+        if not force:
+            frame = self.get(key)
+            if frame is not None and not self._forced(metric, frame):
+                logging.info("{} {} read from cache".format(metric, params))
+                return frame
+        frame = compute()
+        self.put(key, frame)
+        return frame
@@ -4,27 +4,38 @@
 # - Network information
 # - Average cluster coefficient of the network
 # - Density
+# - Overall reciprocity
 # - Triad census
 #
+# With --server (or $TWEETHIS_GRAPH_SERVER set), the clustering, reciprocity
+# & triad census are asked of a running graph_server.py instead of being
+# worked out here.
+#
 # Inputs
 # ------
-# tweethis/processed/todes_g_exclusive.gpickle
-# tweethis/processed/latinx_g_exclusive.gpickle
+# tweethis/processed/todes_g_exclusive.graph
+# tweethis/processed/latinx_g_exclusive.graph
 #
 # Outputs
 # -------
 # tweethis/processed/network_metrics.txt
 ################################################################################
-import networkx as nx
+import argparse
 import logging
 import os
-from google.cloud import storage
+from object_store import open_store
+from graph_store import read_graph
 from datetime import datetime
-from networkx.algorithms import approximation as appx
+import graph_server
 
 logging.basicConfig(filename='network_metrics.log', level=logging.INFO,
                     format='%(asctime)s %(message)s')
 
+parser = argparse.ArgumentParser(
+    description="Network metrics of each exclusive corpus graph.")
+graph_server.add_server_argument(parser)
+args = parser.parse_args()
+
 this_file = "network_metrics"
 
 # ---------------------------------------------------------------------------- #
@@ -32,31 +43,21 @@ this_file = "network_metrics"
 # ---------------------------------------------------------------------------- #
 logging.info("read in todes graph and latinx graph")
 
-# define Cloud Storage bucket
-client = storage.Client()
-bucket = client.get_bucket('tweethis')
-
-# latinx
-blob = bucket.get_blob('processed/latinx_g_exclusive.gpickle')
-output_file_name = "latinx_g_exclusive.gpickle"
-
-# download our gpickle blob - do not expand
-with open(output_file_name, "wb") as file_obj:
-    blob.download_to_file(file_obj, raw_download=True)
-# complete user graph is called all_users
-latinx_g = nx.read_gpickle(output_file_name)
-os.remove(output_file_name)
+# artifact store, tweethis bucket by default, with downloads cached locally
+# (see object_store.py)
+store = open_store()
 
+# the cached .graph files are memory-mapped; every metric below works on
+# their arrays, so no networkx copy of either graph is made
+latinx_name = 'processed/latinx_g_exclusive.graph'
+todes_name = 'processed/todes_g_exclusive.graph'
+latinx_csr = read_graph(store.path(latinx_name))
+todes_csr = read_graph(store.path(todes_name))
 
-# todes
-blob = bucket.get_blob('processed/todes_g_exclusive.gpickle')
-output_file_name = "todes_g_exclusive.gpickle"
-# download our gpickle blob - do not expand
-with open(output_file_name, "wb") as file_obj:
-    blob.download_to_file(file_obj, raw_download=True)
-# complete user graph is called all_users
-todes_g = nx.read_gpickle(output_file_name)
-os.remove(output_file_name)
+# clustering, reciprocity & triads from the graph server if there is one,
+# otherwise worked out here (see graph_server.py)
+metrics_source = graph_server.MetricSource(
+    graph_server.server_address(args.server), store)
 
 # ---------------------------------------------------------------------------- #
 # DEFINE METRICS FILE and give basic graph information for each corpus
@@ -69,26 +70,34 @@ annot = sep + "Metrics added {} from {}.py".format(now, this_file) + \
 
 with open("network_metrics.txt", 'a') as metrics_file:
     metrics_file.write(annot)
-    metrics_file.write(nx.info(latinx_g)+"\n\n")
-    metrics_file.write(nx.info(todes_g) + "\n\n")
+    metrics_file.write(latinx_csr.info()+"\n\n")
+    metrics_file.write(todes_csr.info() + "\n\n")
 
 
 # ---------------------------------------------------------------------------- #
 # AVG CLUSTER COEFFICIENT
+# of the undirected graphs, sampled until the 95% confidence interval is
+# at most cluster_ci_width wide (see clustering.py)
 # ---------------------------------------------------------------------------- #
 logging.info("calculating cluster coeff for each network")
-todes_gu = nx.to_undirected(todes_g)
-latinx_gu = nx.to_undirected(latinx_g)
+cluster_ci_width = 0.01
 
-t_cluster_coeff = appx.average_clustering(todes_gu, trials=10000, seed=115)
-l_cluster_coeff = appx.average_clustering(latinx_gu, trials=10000, seed=115)
+t_cluster_coeff = metrics_source.metric(
+    'estimate_average_clustering', todes_csr, todes_name,
+    width=cluster_ci_width, seed=115)
+l_cluster_coeff = metrics_source.metric(
+    'estimate_average_clustering', latinx_csr, latinx_name,
+    width=cluster_ci_width, seed=115)
 
 # write each cluster coefficient
 with open("network_metrics.txt", 'a') as metrics_file:
-    metrics_file.write("Latinx network average cluster coeff: {} \n\n".format(
-        l_cluster_coeff))
-    metrics_file.write("Todes network average cluster coeff: {} \n\n".format(
-        t_cluster_coeff))
+    for label, estimate in (("Latinx", l_cluster_coeff),
+                            ("Todes", t_cluster_coeff)):
+        metrics_file.write(
+            "{} network average cluster coeff: {} ({:.0%} CI [{}, {}], {} "
+            "trials) \n\n".format(label, estimate.value,
+                                   estimate.confidence, estimate.low,
+                                   estimate.high, estimate.trials))
 
 
 # ---------------------------------------------------------------------------- #
@@ -96,16 +105,40 @@ with open("network_metrics.txt", 'a') as metrics_file:
 # ---------------------------------------------------------------------------- #
 logging.info("calculating network density")
 with open("network_metrics.txt", 'a') as metrics_file:
-    metrics_file.write("Latinx Density: {}\n\n".format(nx.density(latinx_g)))
-    metrics_file.write("Todes Density: {}\n\n".format(nx.density(todes_g)))
+    metrics_file.write("Latinx Density: {}\n\n".format(latinx_csr.density()))
+    metrics_file.write("Todes Density: {}\n\n".format(todes_csr.density()))
+
+
+# ---------------------------------------------------------------------------- #
+# OVERALL RECIPROCITY
+# share of follows that are followed back (see user_metrics.py); per-user
+# reciprocity is in network_metrics_by_user.py
+# ---------------------------------------------------------------------------- #
+logging.info("calculating overall network reciprocity for each graph")
+try:
+    with open("network_metrics.txt", 'a') as metrics_file:
+        metrics_file.write("Latinx network overall reciprocity: {} \n\n".format(
+            metrics_source.metric('overall_reciprocity', latinx_csr,
+                                  latinx_name)))
+        metrics_file.write("Todes network overall reciprocity: {} \n\n".format(
+            metrics_source.metric('overall_reciprocity', todes_csr,
+                                  todes_name)))
+except (KeyboardInterrupt, SystemExit):
+    raise
+except:
+    logging.exception("error calculating overall reciprocities")
 
 
 # ---------------------------------------------------------------------------- #
 # TRIADIC CENSUS
 # ---------------------------------------------------------------------------- #
+# Batagelj & Mrvar over the integer adjacency of each graph, across a
+# process pool; same counts & order as nx.triadic_census (see triads.py)
 logging.info("calculating triadic census for latinx & todes")
-lx_triad_census = nx.triadic_census(latinx_g)
-te_triad_census = nx.triadic_census(todes_g)
+lx_triad_census = metrics_source.metric('triadic_census', latinx_csr,
+                                        latinx_name)
+te_triad_census = metrics_source.metric('triadic_census', todes_csr,
+                                        todes_name)
 
 with open("network_metrics.txt", 'a') as metrics_file:
     metrics_file.write("Latinx Triadic Census:\n")
@@ -127,10 +160,9 @@ logging.info("saving metrics text file to cloud storage")
 
 # define local file name
 this_file_out = this_file+'.txt'
-# define the blob
-blob = bucket.blob('processed/'+this_file_out)
 # upload
-blob.upload_from_filename(this_file_out)
+store.upload(this_file_out, 'processed/'+this_file_out)
 os.remove(this_file_out)
+metrics_source.close()
 
 logging.info("metrics text file stored. graphs not stored. program terminated.")
\ No newline at end of file
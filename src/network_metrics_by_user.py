@@ -2,405 +2,316 @@
 # Split our complete graph into either latinx or todes corpus (exclusive). For
 # users exclusive to a corpus, assign each;
 # - clustering coeff
-# - in degree centrality
-# - out degree centrality
+# - number of triads of each connected type the user is in
+# - in & out degree
 # - in degree centrality
 # - out degree centrality
 # - degree centrality
+# - reciprocity
 # - betweenness centrality
+# - size of in & out bound 2-hop neighborhoods (non-unique & unique)
 # - number of predecessors in other corpus
 # - number of successors in other corpus
 #
+# Each metric's columns are cached on disk (see metric_cache.py), keyed on the
+# version of the graph, the metric's parameters and the code computing it, so
+# a rerun only computes what changed. To recompute some anyway, name their
+# columns or metrics, e.g.;
+#   python network_metrics_by_user.py --recompute l_bet_central
+#
+# With --server (or $TWEETHIS_GRAPH_SERVER set), clustering, triad
+# participation, 2-hop neighborhoods & betweenness are asked of a running
+# graph_server.py, which keeps the graph loaded between runs, instead of
+# being worked out here.
+#
 # Inputs
 # ------
 # tweethis/raw/combo_user_df_sept19.json
-# tweethis/raw/all_users_digraph.gpickle
+# tweethis/raw/all_users_digraph.graph
 #
 # Outputs
 # -------
-# tweethis/processed/todes_g_exclusive.gpickle
-# tweethis/processed/latinx_g_exclusive.gpickle
-# tweethis/processed/network_metrics_by_user_df.pickle
+# tweethis/processed/todes_g_exclusive.graph
+# tweethis/processed/latinx_g_exclusive.graph
+# tweethis/processed/network_metrics_by_user/, a Parquet table partitioned by
+# corpus (see parquet_table.py)
 ################################################################################
+import argparse
 import pandas as pd
-import networkx as nx
+import numpy as np
 import logging
 import os
-from google.cloud import storage
+from object_store import open_store
+from metric_cache import MetricCache, code_version
+from corpus_partition import CorpusPartition
+from user_metrics import corpus_metrics
+from triads import CONNECTED_TRIADS
+import graph_server
+from graph_store import read_graph, write_graph
+from parquet_table import upload_table
 
 logging.basicConfig(filename='network_metrics_by_user.log', level=logging.INFO,
                     format='%(asctime)s %(message)s')
 
+parser = argparse.ArgumentParser(
+    description="Network metrics of the users exclusive to each corpus.")
+parser.add_argument('--recompute', nargs='+', default=[],
+                    help="columns or metrics to compute even if cached, "
+                         "e.g. l_bet_central")
+graph_server.add_server_argument(parser)
+args = parser.parse_args()
+
+# every name --recompute takes: the metrics cached below & their columns
+metric_names = ['cross_corpus_counts', 'corpus_metrics', 'clustering',
+                'triad_participation', 'nhop', 'betweenness']
+column_names = ['preds_in_other', 'successors_in_other'] + [
+    prefix + '_' + column for prefix in ('t', 'l') for column in
+    ['in_deg', 'out_deg', 'deg_central', 'in_deg_central', 'out_deg_central',
+     'reciprocity', 'clustering', 'out_2hop', 'in_2hop', 'out_2hop_unique',
+     'in_2hop_unique', 'bet_central'] +
+    ['census_' + triad for triad in CONNECTED_TRIADS]]
+unknown = sorted(set(args.recompute) - set(metric_names) - set(column_names))
+if unknown:
+    parser.error("no metric or column named {}; choose from {}".format(
+        ', '.join(unknown), ', '.join(metric_names + column_names)))
+
 # ---------------------------------------------------------------------------- #
 # define graphs, create a dataframe of user nodes (exclusively from todes or
 # latinx)
 # ---------------------------------------------------------------------------- #
 logging.info("read in graph of all users, define users df")
 
-# define Cloud Storage bucket
-client = storage.Client()
-bucket = client.get_bucket('tweethis')
-
-# read complete user graph
-blob = bucket.get_blob('raw/all_users_digraph.gpickle')
-output_file_name = "all_users_digraph.gpickle"
-
-# download our gpickle blob - do not expand
-with open(output_file_name, "wb") as file_obj:
-    blob.download_to_file(file_obj, raw_download=True)
-# complete user graph is called all_users
-all_users = nx.read_gpickle(output_file_name)
-
-# define graph of all users EXCLUSIVELY in todes corpus
-todesbunch = [n for n in all_users.nodes() if
-              all_users.nodes().data()[n]['corpus']=='todes']
-todes_g = nx.DiGraph(all_users.subgraph(todesbunch))
-todes_g.name = 'Todes (exclusive) Graph'
-
-# define graph of all users EXCLUSIVELY in latinx corpus
-latinxbunch = [n for n in all_users.nodes() if
-               all_users.nodes().data()[n]['corpus']=='latinx']
-latinx_g = nx.DiGraph(all_users.subgraph(latinxbunch))
-latinx_g.name = 'Latinx (exclusive) Graph'
-
-# delete local gpickle
-os.remove(output_file_name)
+# artifact store, tweethis bucket by default, with downloads cached locally
+# (see object_store.py)
+store = open_store()
+
+# complete user graph is called all_users (memory-mapped from the cache, see
+# graph_store.py)
+graph_name = 'raw/all_users_digraph.graph'
+all_users = read_graph(store.path(graph_name))
+
+# clustering, triads, n-hop & betweenness from the graph server if there is
+# one, otherwise worked out here (see graph_server.py)
+metrics_source = graph_server.MetricSource(
+    graph_server.server_address(args.server), store)
+
+# metric columns computed before on this same graph are read back from the
+# metric cache rather than computed again
+graph_version = store.fingerprint(graph_name)
+cache = MetricCache(recompute=args.recompute)
+
+
+def cached(metric, params, modules, compute):
+    """
+    :param metric: metric name
+    :param params: dict of its parameters
+    :param modules: names of the modules computing it, for its code version
+    :param compute: function returning its columns, indexed by id_str
+    :return: DataFrame of the metric's columns
+    """
+    # this script & graph_server.py build the columns from what the modules
+    # return, so they are part of every metric's code version (on their own,
+    # not with everything they import)
+    return cache.columns(graph_version, metric, params,
+                         code_version('corpus_partition', *modules,
+                                      files=[__file__,
+                                             graph_server.__file__]), compute)
+
+
+def corpus_metric(metric, corpus_name, view, **params):
+    """
+    :return: metric on a corpus' view, from the graph server if there is one
+    """
+    return metrics_source.metric(metric, view, graph_name, corpus=corpus_name,
+                                 **params)
+
+
+# split all users by corpus in one pass. todes_view & latinx_view are the
+# graphs of users EXCLUSIVELY in the todes & latinx corpora, as views over
+# all_users rather than copies of it
+partition = CorpusPartition(all_users)
+todes_view = partition.view('todes', name='Todes (exclusive) Graph')
+latinx_view = partition.view('latinx', name='Latinx (exclusive) Graph')
+# column prefix, corpus & view of each
+corpora = (('t', 'todes', todes_view), ('l', 'latinx', latinx_view))
+
+logging.info("edges between corpora (rows follow columns):\n{}".format(
+    partition.edge_count_frame()))
 
 # define pandas dataframe of our nodes that are exclusively in one corpus or
 # the other
-nodes_dictionary = {key : data['corpus'] for (key, data) in dict(
-    all_users.nodes()).items() if data['corpus'] != 'both'}
-
-users_df = pd.DataFrame.from_dict(nodes_dictionary, orient="index",
-                                  columns=['corpus'])
+corpus = pd.Series(all_users.node_attrs['corpus'],
+                   index=list(all_users), name='corpus')
+users_df = corpus[~partition.mask('both')].to_frame()
+users_df.index.name = 'id_str'
 
 # ---------------------------------------------------------------------------- #
 # COUNT PREDECESSORS AND SUCCESSORS IN OTHER CORPUS
 # ---------------------------------------------------------------------------- #
 logging.info("being counting predecessors and successors in other corpus")
 
-other_pred_count = {}
-other_successor_count = {}
-
-for node in all_users.nodes():
-    # Note the corpus this node is in. If "both," continue to next node
-    try:
-        this_corpus = all_users.nodes[node]['corpus']
-        if this_corpus == 'both':
-            continue
-    except:
-        logging.exception("No corpus for node {} in all_user graph.".format(
-            node))
-        continue
-    # Try to count all of this node's predecessors that are in the other
-    # corpus, skipping those in 'both'. Keep track of this in a python dict
-    try:
-        c = 0
-        for pred in all_users.predecessors(node):
-            if all_users.nodes[pred]['corpus'] == 'both':
-                continue
-            if all_users.nodes[pred]['corpus'] != this_corpus:
-                c += 1
-        other_pred_count[node] = c
-    except (KeyboardInterrupt, SystemExit):
-        raise
-    except:
-        logging.exception("error calculating predecessors from other corpus "
-                          "for node {}".format(node))
-
-    # Now, for this node, try to count the number of successors that are in
-    # the other coprus, discounting nodes in 'both.' Keep track of this in a
-    # python dict
-    try:
-        c = 0
-        for successor in all_users.successors(node):
-            if all_users.nodes[successor]['corpus'] == 'both':
-                continue
-            if all_users.nodes[successor]['corpus'] != this_corpus:
-                c += 1
-        other_successor_count[node] = c
-    except (KeyboardInterrupt, SystemExit):
-        raise
-    except:
-        logging.exception("error calculating successors in other corpus  for "
-                          "node {}".format(node))
-
-try:
-    # merge the count of predecessors from other coprus into users_df
-    predecessor_other = pd.Series(other_pred_count, name='preds_in_other')
-    users_df = users_df.join(predecessor_other, how='left')
-
-    # merge the count of successors in other corpus column into users_df
-    other_successor = pd.Series(other_successor_count, name='successors_in_other')
-    users_df = users_df.join(other_successor, how='left')
-except:
-    logging.exception("Problem merging sucessors & preds.")
-
-# delete super graph containing all corpora
-del all_users
-
-# ---------------------------------------------------------------------------- #
-# CLUSTERING COEFFICIENT
-# ---------------------------------------------------------------------------- #
+# count each node's predecessors & successors in the other corpus, skipping
+# nodes in 'both', from the edge arrays of all_users in one go
 try:
-    logging.info("generate & merge todes clustering coeff")
-    tcluster = nx.clustering(todes_g)
-    tclustering = pd.Series(tcluster, name='t_clustering')
-    users_df = users_df.join(tclustering, how='left')
-    del tcluster, tclustering
-
-    logging.info("generate & merge latinx cluster")
-    lcluster = nx.clustering(latinx_g)
-    lclustering = pd.Series(lcluster, name='l_clustering')
-    users_df = users_df.join(lclustering, how='left')
-    del lcluster, lclustering
+    users_df = users_df.join(cached(
+        'cross_corpus_counts', {'exclude': ['both']}, [],
+        lambda: partition.cross_corpus_counts(exclude=['both'])), how='left')
 except (KeyboardInterrupt, SystemExit):
     raise
 except:
-    logging.exception("error with clustering coefficient")
-
+    logging.exception("Problem counting sucessors & preds in other corpus.")
 
 # ---------------------------------------------------------------------------- #
-# IN DEGREE COUNT
+# DEGREES, DEGREE CENTRALITIES & RECIPROCITY
+# in & out degree, degree / in degree / out degree centrality & reciprocity
+# of each user within their own corpus, for both corpora in one pass over
+# the edges of all_users (see user_metrics.py)
 # ---------------------------------------------------------------------------- #
+logging.info("generate & merge degrees, degree centralities & reciprocity")
 try:
-    logging.info("generate & merge todes in degree count")
-    tindeg = dict(todes_g.in_degree())
-    tindeg_series = pd.Series(tindeg, name='t_in_deg')
-    users_df = users_df.join(tindeg_series, how='left')
-
-    logging.info("generate & merge latinx in degree count")
-    lindeg = dict(latinx_g.in_degree())
-    lindeg_series = pd.Series(lindeg, name='l_in_deg')
-    users_df = users_df.join(lindeg_series, how='left')
+    metrics = cached(
+        'corpus_metrics', {'prefixes': [['t', 'todes'], ['l', 'latinx']]},
+        ['user_metrics'],
+        lambda: corpus_metrics(
+            partition, (('t', 'todes'), ('l', 'latinx')),
+            np.flatnonzero(~partition.mask('both'))).set_index(users_df.index))
+    # same rows in the same order as users_df, so no need to align on index
+    for column in metrics.columns:
+        users_df[column] = metrics[column].values
+    del metrics
 except (KeyboardInterrupt, SystemExit):
     raise
 except:
-    logging.exception("error with in degree counts")
+    logging.exception("error with degrees & reciprocity")
 
 # ---------------------------------------------------------------------------- #
-# OUT DEGREE COUNT
+# CLUSTERING COEFFICIENT
 # ---------------------------------------------------------------------------- #
 try:
-    logging.info("generate & merge todes out degree count")
-    toutdeg = dict(todes_g.out_degree())
-    toutdeg_series = pd.Series(toutdeg, name='t_out_deg')
-    users_df = users_df.join(toutdeg_series, how='left')
-
-    logging.info("generate & merge latinx out degree count")
-    loutdeg = dict(latinx_g.out_degree())
-    loutdeg_series = pd.Series(loutdeg, name='l_out_deg')
-    users_df = users_df.join(loutdeg_series, how='left')
+    # directed clustering from triangle counts on the sparse adjacency,
+    # matching nx.clustering (see clustering.py)
+    for prefix, corpus_name, view in corpora:
+        logging.info("generate & merge {} clustering coeff".format(view.name))
+        clustering = cached(
+            'clustering', {'corpus': corpus_name}, ['clustering'],
+            lambda: corpus_metric('clustering', corpus_name, view).rename(
+                prefix+'_clustering').to_frame())
+        users_df = users_df.join(clustering, how='left')
+        del clustering
 except (KeyboardInterrupt, SystemExit):
     raise
 except:
-    logging.exception("error with out degree counts")
-
-
-# ---------------------------------------------------------------------------- #
-# DEGREE CENTRALITY
-# ---------------------------------------------------------------------------- #
-def neighborhood(g, node, n):
-    path_lengths = nx.single_source_dijkstra_path_length(g, node)
-    return [node for node, length in path_lengths.items() if length == n]
+    logging.exception("error with clustering coefficient")
 
 
 # ---------------------------------------------------------------------------- #
-# DEGREE CENTRALITY
+# TRIAD PARTICIPATION
 # ---------------------------------------------------------------------------- #
 try:
-    logging.info("generate & merge todes degree centrality")
-    t_deg_cent = nx.degree_centrality(todes_g)
-    t_deg_cent_series = pd.Series(t_deg_cent, name='t_deg_central')
-    users_df = users_df.join(t_deg_cent_series, how='left')
-
-    logging.info("generate & merge latinx degree centrality")
-    l_deg_cent = nx.degree_centrality(latinx_g)
-    l_deg_cent_series = pd.Series(l_deg_cent, name='l_deg_central')
-    users_df = users_df.join(l_deg_cent_series, how='left')
+    # for each connected triad type of the triadic census (see triads.py),
+    # how many of those triads each user is in, e.g. t_census_030T
+    for prefix, corpus_name, view in corpora:
+        logging.info("generate & merge {} triad participation".format(
+            view.name))
+        participation = cached(
+            'triad_participation', {'corpus': corpus_name}, ['triads'],
+            lambda: corpus_metric('triad_participation', corpus_name,
+                                  view).add_prefix(prefix+'_census_'))
+        users_df = users_df.join(participation, how='left')
+        del participation
 except (KeyboardInterrupt, SystemExit):
     raise
 except:
-    logging.exception("error with degree centrality")
+    logging.exception("error with triad participation")
 
 
 # ---------------------------------------------------------------------------- #
 # TWO HOP NEIGHBORHOODS
+# For every node at once (see nhop.py);
+# - *_2hop: non-unique number of nodes in the 2-hop neighborhood
+# - *_2hop_unique: number of distinct nodes within 2 hops
 # ---------------------------------------------------------------------------- #
-def calc_outbound_nhop(graph, source_node, cutoff=2):
-    '''
-    Calculate the number of non-unique nodes in the n-hop neighborhood.
-    :param graph: networkx directed graph
-    :param source_node: The node from which to calculate the size of
-    the neighborhood.
-    :param cutoff: The number of n-hops to include. Default value is 2.
-    :return: int
-    '''
-    # base case 1: we have gone for two hops
-    if cutoff == 0:
-        return 0
-    # base case 2: we have reached a leave node with no successors
-    if sum(1 for _ in graph.successors(source_node)) == 0:
-        return 0
-    # return count of number of successors plus a recursive call for all
-    # successors of this node
-    for succ in graph.successors(source_node):
-        return sum(1 for _ in graph.successors(source_node)) +\
-               calc_outbound_nhop(graph, succ, cutoff-1)
-
-def calc_inbound_nhop(graph, destination_node, cutoff):
-    '''
-    Calculate the number of non-unique nodes in the n-hop neighborhood.
-    :param graph: networkx directed graph
-    :param destination_node: The node to calculate the size of the neighborhood.
-    :param cutoff: The number of n-hops to  include. Default value of 2.
-    :return: int
-    '''
-    if cutoff == 0:
-        return 0
-    if sum(1 for _ in graph.predecessors(destination_node)) == 0:
-        return 0
-    for pred in graph.predecessors(destination_node):
-        return sum(1 for _ in graph.predecessors(destination_node)) + \
-               calc_inbound_nhop(graph, pred, cutoff-1)
-
-logging.info("begin todes in and out bound 2hop neighborhood calculations")
-
-todes_out_2hop = {}
-todes_in_2hop = {}
-
-for node in todes_g.nodes():
+nhop_cutoff = 2
+
+for prefix, corpus_name, view in corpora:
+    logging.info("begin {} in and out bound 2hop neighborhood calculations"
+                 .format(view.name))
     try:
-        todes_out_2hop[node] = calc_outbound_nhop(todes_g, node, cutoff=2)
-        todes_in_2hop[node] = calc_inbound_nhop(todes_g, node, cutoff=2)
-    except nx.NodeNotFound:
-        logging.exception("node not found in todes")
+        users_df = users_df.join(cached(
+            'nhop', {'corpus': corpus_name, 'cutoff': nhop_cutoff}, ['nhop'],
+            lambda: pd.DataFrame({
+                prefix + '_' + direction + '_2hop' + suffix: corpus_metric(
+                    metric, corpus_name, view, cutoff=nhop_cutoff,
+                    direction=direction)
+                for metric, suffix in (('nhop_walks', ''),
+                                       ('nhop_sizes', '_unique'))
+                for direction in ('out', 'in')})), how='left')
     except (KeyboardInterrupt, SystemExit):
         raise
     except:
-        logging.exception("issues calculating n-hop neighborhoods")
-
-t_out_2hop_series = pd.Series(todes_out_2hop, name='t_out_2hop')
-t_in_2hop_series = pd.Series(todes_in_2hop, name='t_in_2hop')
+        logging.exception("issues calculating n-hop neighborhoods in {}"
+                          .format(view.name))
 
-users_df = users_df.join(t_out_2hop_series, how='left')
-users_df = users_df.join(t_in_2hop_series, how='left')
 
+# ---------------------------------------------------------------------------- #
+# BETWEENNESS CENTRALITY
+# Exact by default, sharding source nodes across one process per core (see
+# betweenness.py). Set betweenness_k to a number of pivots for the
+# approximate mode; its error bound is logged.
+# ---------------------------------------------------------------------------- #
+betweenness_k = None
+betweenness_seed = 115
 
-logging.info("begin latinx in and out bound two-hop neighborhood calcs")
-latinx_out_2hop = {}
-latinx_in_2hop = {}
-
-for node in latinx_g.nodes():
+for prefix, corpus_name, view in corpora:
     try:
-        latinx_out_2hop[node] = calc_outbound_nhop(latinx_g, node, cutoff=2)
-        latinx_in_2hop[node] = calc_inbound_nhop(latinx_g, node, cutoff=2)
+        logging.info("generate & merge {} betweenness centrality".format(
+            view.name))
+
+        # the error bound of the approximate mode is logged where it runs
+        users_df = users_df.join(cached(
+            'betweenness', {'corpus': corpus_name, 'k': betweenness_k,
+                            'seed': betweenness_seed}, ['betweenness'],
+            lambda: corpus_metric(
+                'betweenness', corpus_name, view, k=betweenness_k,
+                seed=betweenness_seed).rename(
+                    prefix+'_bet_central').to_frame()), how='left')
     except (KeyboardInterrupt, SystemExit):
         raise
-    except nx.NodeNotFound:
-        logging.exception("node not found in latinx")
     except:
-        logging.exception("issues calculating neighborhoods in latinx")
-
-l_out_2hop_series = pd.Series(latinx_out_2hop, name='l_out_2hop')
-l_in_2hop_series = pd.Series(latinx_in_2hop, name='l_in_2hop')
-
-users_df = users_df.join(l_out_2hop_series, how='left')
-users_df = users_df.join(l_in_2hop_series, how='left')
-
-
-# ---------------------------------------------------------------------------- #
-# IN DEGREE CENTRALITY
-# ---------------------------------------------------------------------------- #
-try:
-    logging.info("generate & merge todes in degree centrality")
-    t_indeg_cent = nx.in_degree_centrality(todes_g)
-    t_indeg_cent_series = pd.Series(t_indeg_cent, name='t_in_deg_central')
-    users_df = users_df.join(t_indeg_cent_series, how='left')
-
-    logging.info("generate & merge latinx in degree centrality")
-    l_indeg_cent = nx.in_degree_centrality(latinx_g)
-    l_indeg_cent_series = pd.Series(l_indeg_cent, name='l_in_deg_central')
-    users_df = users_df.join(l_indeg_cent_series, how='left')
-except (KeyboardInterrupt, SystemExit):
-    raise
-except:
-    logging.exception("error with in degree centrality")
-
-
-# ---------------------------------------------------------------------------- #
-# OUT DEGREE CENTRALITY
-# ---------------------------------------------------------------------------- #
-try:
-    logging.info("generate & merge todes out degree centrality")
-    t_outdeg_cent = nx.out_degree_centrality(todes_g)
-    t_outdeg_cent_series = pd.Series(t_outdeg_cent, name='t_out_deg_central')
-    users_df = users_df.join(t_outdeg_cent_series, how='left')
-
-    logging.info("generate & merge latinx out degree centrality")
-    l_outdeg_cent = nx.out_degree_centrality(latinx_g)
-    l_outdeg_cent_series = pd.Series(l_outdeg_cent, name='l_out_deg_central')
-    users_df = users_df.join(l_outdeg_cent_series, how='left')
-except (KeyboardInterrupt, SystemExit):
-    raise
-except:
-    logging.exception("error with out degree centrality")
-
-
-# ---------------------------------------------------------------------------- #
-# BETWEENNESS CENTRALITY
-# ---------------------------------------------------------------------------- #
-try:
-    logging.info("generate & merge todes betweenness centrality")
-    t_bet_cent = nx.betweenness_centrality(todes_g)
-    t_bet_cent_series = pd.Series(t_bet_cent, name='t_bet_central')
-    users_df = users_df.join(t_bet_cent_series, how='left')
-
-    logging.info("generate & merge latinx betweenness centrality")
-    l_bet_cent = nx.degree_centrality(latinx_g)
-    l_bet_cent_series = pd.Series(l_bet_cent, name='l_bet_central')
-    users_df = users_df.join(l_bet_cent_series, how='left')
-except (KeyboardInterrupt, SystemExit):
-    raise
-except:
-    logging.exception("error with betweenness centrality")
+        logging.exception("error with betweenness centrality")
 
 # ---------------------------------------------------------------------------- #
 # WRITE OUTPUTS
 # For each;
 # - define local file name
 # - write object to that local file
-# - define blob
-# - upload that local file to blob
+# - upload that local file to the store (which also caches it for the
+#   stages after this one)
 # - delete local file
 # ---------------------------------------------------------------------------- #
 logging.info("writing outputs")
 
 # LATINX GRAPH
 # define local file
-lg_file_out = 'latinx_g_exclusive_2.gpickle'
+lg_file_out = 'latinx_g_exclusive.graph'
 # write graph to local file
-nx.write_gpickle(latinx_g, lg_file_out, protocol=4)
-# define blob, upload local file to blob
-blob = bucket.blob('processed/'+lg_file_out)
-blob.upload_from_filename(lg_file_out)
+write_graph(latinx_view.materialize(), lg_file_out)
+# upload local file
+store.upload(lg_file_out, 'processed/'+lg_file_out)
 # delete local file
 os.remove(lg_file_out)
 
 # TODES GRAPH
-tg_file_out = 'todes_g_exclusive_2.gpickle'
-nx.write_gpickle(todes_g, tg_file_out, protocol=4)
-blob = bucket.blob('processed/'+tg_file_out)
-blob.upload_from_filename(tg_file_out)
+tg_file_out = 'todes_g_exclusive.graph'
+write_graph(todes_view.materialize(), tg_file_out)
+store.upload(tg_file_out, 'processed/'+tg_file_out)
 os.remove(tg_file_out)
 
 # DATAFRAME OF USERS
-users_file_out = 'network_metrics_by_user_df.pickle'
-users_df.to_pickle(users_file_out)
-blob = bucket.blob('processed/'+users_file_out)
-blob.upload_from_filename(users_file_out)
-os.remove(users_file_out)
+# one compressed Parquet part per corpus, uploaded part by part
+upload_table(users_df, store, 'processed/network_metrics_by_user')
 
+metrics_source.close()
 
 logging.info("graphs stored, df of network metrics by user stored. program "
              "terminated.")
\ No newline at end of file
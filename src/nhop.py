@@ -0,0 +1,118 @@
+################################################################################
+# Sizes of the n-hop neighbourhoods of every node in a graph, computed with
+# sparse matrix products instead of a traversal per node.
+#
+# Two sizes are given for each node:
+# - walks: the non-unique count. Out-bound, that is the number of successors
+#   plus the number of successors of each successor, and so on up to the
+#   cutoff, i.e. (A + A^2 + ... + A^cutoff) . 1
+# - unique: the number of distinct nodes reachable in at most cutoff hops,
+#   not counting the node itself. Worked out with boolean sparse products
+#   over blocks of rows so memory stays bounded.
+#
+# In-bound sizes are the same computations on the transposed adjacency.
+################################################################################
+import numpy as np
+
+
+def _adjacency(graph, direction):
+    a = graph.adjacency(dtype=np.int64)
+    if direction == 'in':
+        a = a.T.tocsr()
+    elif direction != 'out':
+        raise ValueError("direction must be 'out' or 'in', not "
+                         "{!r}".format(direction))
+    return a
+
+
+def _check_cutoff(cutoff):
+    if cutoff < 0:
+        raise ValueError("cutoff must be 0 or more, not {}".format(cutoff))
+
+
+def nhop_walks(graph, cutoff=2, direction='out', rows=None):
+    """
+    Non-unique size of every node's n-hop neighbourhood.
+
+    :param graph: CSRGraph or SubgraphView
+    :param cutoff: number of hops to include. Default value is 2; 0 gives
+    empty neighbourhoods.
+    :param direction: 'out' to follow successors, 'in' to follow predecessors
+    :param rows: optional array of node ids to compute; default is all nodes
+    :return: int64 array, one entry per node in rows
+    """
+    _check_cutoff(cutoff)
+    a = _adjacency(graph, direction)
+    if cutoff == 0:
+        return np.zeros(a.shape[0] if rows is None else len(rows),
+                        dtype=np.int64)
+    # walks[k] = number of walks of length 1..(cutoff - k) from each node,
+    # built from the far end: w = A.1 + A.w
+    walks = np.zeros(a.shape[0], dtype=np.int64)
+    for _ in range(cutoff - 1):
+        walks = a.dot(1 + walks)
+    if rows is not None:
+        a = a[rows]
+    return a.dot(1 + walks)
+
+
+def nhop_sizes(graph, cutoff=2, direction='out', rows=None, block_size=4096):
+    """
+    Number of distinct nodes within n hops of every node, excluding the node
+    itself.
+
+    :param graph: CSRGraph or SubgraphView
+    :param cutoff: number of hops to include. Default value is 2; 0 gives
+    empty neighbourhoods.
+    :param direction: 'out' to follow successors, 'in' to follow predecessors
+    :param rows: optional array of node ids to compute; default is all nodes
+    :param block_size: number of nodes whose reachable sets are held in
+    memory at once
+    :return: int64 array, one entry per node in rows
+    """
+    _check_cutoff(cutoff)
+    a = _adjacency(graph, direction)
+    if rows is None:
+        rows = np.arange(a.shape[0])
+    rows = np.asarray(rows)
+    sizes = np.zeros(len(rows), dtype=np.int64)
+    if cutoff == 0:
+        return sizes
+
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        frontier = a[block]
+        reach = frontier.copy()
+        for _ in range(cutoff - 1):
+            frontier = frontier.dot(a)
+            frontier.data[:] = 1
+            reach = reach + frontier
+        reach = reach.tocoo()
+
+        # a node that can reach itself (a cycle) does not count itself
+        is_self = reach.col == block[reach.row]
+        sizes[start:start + len(block)] = \
+            np.bincount(reach.row, minlength=len(block)) - \
+            np.bincount(reach.row[is_self], minlength=len(block))
+    return sizes
+
+
+def nhop_reach(graph, nodes, hops, direction='out'):
+    """
+    Nodes within n hops of a set of nodes, the nodes themselves included.
+
+    :param graph: CSRGraph or SubgraphView
+    :param nodes: array of node ids to start from
+    :param hops: number of hops to follow
+    :param direction: 'out' to follow successors, 'in' to follow predecessors
+    :return: sorted array of node ids
+    """
+    # reached[j] > 0 if j is a successor (A^T . f) or predecessor (A . f) of
+    # a node in the frontier f
+    a = _adjacency(graph, 'in' if direction == 'out' else 'out')
+    reached = np.zeros(a.shape[0], dtype=np.int64)
+    reached[np.asarray(nodes, dtype=np.int64)] = 1
+    for _ in range(hops):
+        reached = reached + a.dot(reached)
+        reached = (reached > 0).astype(np.int64)
+    return np.flatnonzero(reached)
@@ -0,0 +1,423 @@
+################################################################################
+# Where the pipeline's artifacts (graphs, user dataframes, metrics files) are
+# kept between stages, behind one interface with three backends;
+# - GCSStore: a Cloud Storage bucket (tweethis), transferring large objects
+#   in parallel byte ranges / composed parts
+# - LocalStore: a directory, e.g. to run the pipeline without GCP
+# - MemoryStore: a dict in this process, for trying things out
+#
+# CachedStore wraps GCSStore (or MemoryStore) with a local cache of
+# downloaded objects, keyed on a hash of their content rather than their
+# name, and trimmed to a size budget by evicting the least recently used.
+# An object that has not changed since a previous stage (or run) downloaded
+# or uploaded it is read straight from the cache, so e.g. the exclusive
+# graphs written by network_metrics_by_user.py are not downloaded again by
+# network_metrics.py.
+#
+# open_store() builds the store the scripts use, from environment variables;
+# TWEETHIS_STORE   gs://<bucket>, file://<directory> or memory://
+#                  (default gs://tweethis)
+# TWEETHIS_CACHE   cache directory (default ~/.cache/tweethis), or '' for none
+# TWEETHIS_CACHE_BYTES   size budget of the cache (default 8 GiB)
+################################################################################
+import atexit
+import base64
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# parallel transfers move objects in parts of this many bytes
+CHUNK_BYTES = 32 << 20
+TRANSFER_THREADS = 8
+# GCS composes at most this many objects at once
+_MAX_COMPOSE = 32
+
+DEFAULT_STORE = 'gs://tweethis'
+DEFAULT_CACHE = os.path.join('~', '.cache', 'tweethis')
+DEFAULT_CACHE_BYTES = 8 << 30
+
+# temp directory for downloads when there is no cache, see ObjectStore.path
+_scratch = None
+
+
+def file_md5(path):
+    """
+    :return: hex md5 of a file's content, read a chunk at a time
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class ObjectStore:
+    """
+    Interface of the backends. Names are '/' separated, e.g.
+    'processed/todes_g_exclusive.graph'.
+    """
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def fingerprint(self, name):
+        """
+        :return: string that changes whenever the object's content does,
+        e.g. 'md5:<hex>'; None if there is no such object
+        """
+        raise NotImplementedError
+
+    def open(self, name):
+        """
+        :return: binary file object reading the object from the start, e.g.
+        for pd.read_pickle
+        """
+        raise NotImplementedError
+
+    def download(self, name, path):
+        """
+        Write the object to a local file.
+        """
+        raise NotImplementedError
+
+    def upload(self, path, name):
+        """
+        Store a local file as the object.
+
+        :return: fingerprint of the stored object
+        """
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def path(self, name):
+        """
+        Local file holding the object, for readers that need a real file
+        (e.g. graph_store.read_graph memory-maps it). Without a cache, this
+        is a download to a temp directory removed when the process exits.
+        """
+        global _scratch
+        if _scratch is None:
+            _scratch = tempfile.mkdtemp(prefix='object_store_')
+            atexit.register(shutil.rmtree, _scratch, True)
+        path = os.path.join(_scratch, '{}_{}'.format(
+            len(os.listdir(_scratch)), os.path.basename(name)))
+        self.download(name, path)
+        return path
+
+
+class MemoryStore(ObjectStore):
+    """
+    Objects kept as bytes in a dict.
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def exists(self, name):
+        return name in self.objects
+
+    def fingerprint(self, name):
+        if name not in self.objects:
+            return None
+        return 'md5:' + hashlib.md5(self.objects[name]).hexdigest()
+
+    def open(self, name):
+        return io.BytesIO(self.objects[name])
+
+    def download(self, name, path):
+        with open(path, 'wb') as f:
+            f.write(self.objects[name])
+
+    def upload(self, path, name):
+        with open(path, 'rb') as f:
+            self.objects[name] = f.read()
+        return self.fingerprint(name)
+
+    def delete(self, name):
+        self.objects.pop(name, None)
+
+
+class LocalStore(ObjectStore):
+    """
+    Objects as files under a root directory.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(os.path.expanduser(root))
+
+    def _file(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def exists(self, name):
+        return os.path.isfile(self._file(name))
+
+    def fingerprint(self, name):
+        if not self.exists(name):
+            return None
+        return 'md5:' + file_md5(self._file(name))
+
+    def open(self, name):
+        return open(self._file(name), 'rb')
+
+    def download(self, name, path):
+        shutil.copyfile(self._file(name), path)
+
+    def upload(self, path, name):
+        target = self._file(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = target + '.tmp'
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
+        return self.fingerprint(name)
+
+    def delete(self, name):
+        if self.exists(name):
+            os.remove(self._file(name))
+
+    def path(self, name):
+        # already a local file; don't copy it
+        return self._file(name)
+
+
+class GCSStore(ObjectStore):
+    """
+    Objects in a Cloud Storage bucket. Objects over chunk_bytes are
+    downloaded as byte ranges and uploaded as parts composed into one
+    object, on transfer_threads threads. Downloads are raw (no decompressive
+    transcoding), as the scripts always did.
+    """
+
+    def __init__(self, bucket_name, client=None, chunk_bytes=CHUNK_BYTES,
+                 transfer_threads=TRANSFER_THREADS):
+        if client is None:
+            from google.cloud import storage
+            client = storage.Client()
+        self.bucket = client.bucket(bucket_name)
+        self.chunk_bytes = chunk_bytes
+        self.transfer_threads = transfer_threads
+
+    def _blob(self, name):
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            raise KeyError(name)
+        return blob
+
+    def exists(self, name):
+        return self.bucket.get_blob(name) is not None
+
+    def fingerprint(self, name):
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            return None
+        # composed objects have no md5 of their own; upload() records one
+        md5 = (blob.metadata or {}).get('md5')
+        if md5:
+            return 'md5:' + md5
+        if blob.md5_hash:
+            return 'md5:' + base64.b64decode(blob.md5_hash).hex()
+        return 'crc32c:{}:{}'.format(blob.crc32c, blob.size)
+
+    def open(self, name):
+        return self._blob(name).open('rb', raw_download=True)
+
+    def download(self, name, path):
+        blob = self._blob(name)
+        size = blob.size or 0
+        if size <= self.chunk_bytes:
+            with open(path, 'wb') as f:
+                blob.download_to_file(f, raw_download=True)
+            return
+
+        # every thread writes its own byte range of a preallocated file
+        with open(path, 'wb') as f:
+            f.truncate(size)
+
+        def fetch(start):
+            end = min(start + self.chunk_bytes, size) - 1
+            with open(path, 'r+b') as f:
+                f.seek(start)
+                blob.download_to_file(f, start=start, end=end,
+                                      raw_download=True)
+
+        with ThreadPoolExecutor(self.transfer_threads) as pool:
+            list(pool.map(fetch, range(0, size, self.chunk_bytes)))
+
+    def upload(self, path, name):
+        size = os.path.getsize(path)
+        md5 = file_md5(path)
+        blob = self.bucket.blob(name)
+        blob.metadata = {'md5': md5}
+        if size <= self.chunk_bytes:
+            blob.upload_from_filename(path)
+            return 'md5:' + md5
+
+        chunk = max(self.chunk_bytes, -(-size // _MAX_COMPOSE))
+        starts = list(range(0, size, chunk))
+        parts = [self.bucket.blob('{}.part-{:03d}'.format(name, i))
+                 for i in range(len(starts))]
+
+        def send(i):
+            with open(path, 'rb') as f:
+                f.seek(starts[i])
+                parts[i].upload_from_file(f, size=min(chunk, size - starts[i]))
+
+        try:
+            with ThreadPoolExecutor(self.transfer_threads) as pool:
+                list(pool.map(send, range(len(parts))))
+            blob.compose(parts)
+            blob.metadata = {'md5': md5}
+            blob.patch()
+        finally:
+            for part in parts:
+                try:
+                    part.delete()
+                except Exception:
+                    logging.exception("could not delete " + part.name)
+        return 'md5:' + md5
+
+    def delete(self, name):
+        blob = self.bucket.get_blob(name)
+        if blob is not None:
+            blob.delete()
+
+
+class CachedStore(ObjectStore):
+    """
+    A store with a local, content-keyed cache of its objects. Every object
+    read is first made sure to be in the cache; uploads are added to it
+    too. Cached files are named after a hash of the object's fingerprint, so
+    an object that changes is fetched again, and the same content under two
+    names is only kept once.
+    """
+
+    def __init__(self, store, cache_dir=DEFAULT_CACHE,
+                 max_bytes=DEFAULT_CACHE_BYTES):
+        """
+        :param store: ObjectStore to cache
+        :param cache_dir: directory for the cached files
+        :param max_bytes: least recently used files are removed once the
+        cache holds more than this
+        """
+        self.store = store
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _cached(self, fingerprint):
+        key = hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def _evict(self, keep):
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # evicted by another process
+                total -= size
+                logging.info("evicted {} from cache".format(path))
+
+    def exists(self, name):
+        return self.store.exists(name)
+
+    def fingerprint(self, name):
+        return self.store.fingerprint(name)
+
+    def path(self, name):
+        """
+        :return: the cached file holding the object; don't remove or
+        modify it
+        """
+        fingerprint = self.store.fingerprint(name)
+        if fingerprint is None:
+            raise KeyError(name)
+        cached = self._cached(fingerprint)
+        if os.path.exists(cached):
+            logging.info("{} read from cache".format(name))
+            # mtime is the last use, for eviction
+            os.utime(cached, None)
+            return cached
+
+        logging.info("download " + name)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            self.store.download(name, tmp)
+            # only complete files ever appear under the cached name
+            os.replace(tmp, cached)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._evict(keep=cached)
+        return cached
+
+    def open(self, name):
+        return open(self.path(name), 'rb')
+
+    def download(self, name, path):
+        shutil.copyfile(self.path(name), path)
+
+    def upload(self, path, name):
+        fingerprint = self.store.upload(path, name)
+        cached = self._cached(fingerprint)
+        if not os.path.exists(cached):
+            tmp = cached + '.tmp'
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, cached)
+        os.utime(cached, None)
+        self._evict(keep=cached)
+        return fingerprint
+
+    def delete(self, name):
+        self.store.delete(name)
+
+
+def open_store(url=None, cache_dir=None, max_bytes=None):
+    """
+    :param url: gs://<bucket>, file://<directory> or memory://. Default is
+    $TWEETHIS_STORE, or gs://tweethis.
+    :param cache_dir: cache directory, '' for no cache. Default is
+    $TWEETHIS_CACHE, or ~/.cache/tweethis.
+    :param max_bytes: cache size budget. Default is $TWEETHIS_CACHE_BYTES,
+    or 8 GiB.
+    :return: ObjectStore
+    """
+    if url is None:
+        url = os.environ.get('TWEETHIS_STORE', DEFAULT_STORE)
+    if cache_dir is None:
+        cache_dir = os.environ.get('TWEETHIS_CACHE', DEFAULT_CACHE)
+    if max_bytes is None:
+        max_bytes = int(os.environ.get('TWEETHIS_CACHE_BYTES',
+                                       DEFAULT_CACHE_BYTES))
+
+    if url.startswith('gs://'):
+        store = GCSStore(url[len('gs://'):].strip('/'))
+    elif url.startswith('file://'):
+        store = LocalStore(url[len('file://'):])
+    elif url.startswith('memory://'):
+        store = MemoryStore()
+    else:
+        raise ValueError("unknown store " + url)
+
+    # a local directory is already on disk, caching it would only copy it
+    if not cache_dir or isinstance(store, LocalStore):
+        return store
+    return CachedStore(store, cache_dir, max_bytes)
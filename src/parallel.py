@@ -0,0 +1,26 @@
+################################################################################
+# Process pool helpers shared by the modules that fan work out over cores.
+################################################################################
+import multiprocessing
+import os
+
+
+def pool_context():
+    """
+    :return: multiprocessing context to make pools from. The metric scripts
+    do their work at module level, so workers must be forked rather than
+    spawned (which would re-run the calling script).
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def default_processes(processes=None):
+    """
+    :param processes: requested number of processes, or None
+    :return: processes, or one per core if it is None
+    """
+    if processes is None:
+        return os.cpu_count() or 1
+    return processes
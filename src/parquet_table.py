@@ -0,0 +1,182 @@
+################################################################################
+# DataFrames of users stored as compressed Parquet, partitioned by corpus,
+# instead of pickles; so a reader loads only the columns & corpora it needs,
+# and the files don't depend on the pandas version that wrote them.
+#
+# A table is a directory with one file per corpus, in the same layout as the
+# user table (see user_table.py);
+#
+#   <path>/corpus=latinx/part-00000.parquet
+#   <path>/corpus=todes/part-00000.parquet
+#   ...
+#
+# The corpus isn't stored in the files but in their folder names, so
+# asking for some corpora skips the other folders without opening them.
+# Users without a corpus go in pyarrow's folder for nulls.
+#
+# Stores (see object_store.py) hold objects rather than directories, so a
+# table in a store is one object per part, plus a _parts.json object listing
+# the parts, their content hash and the table's columns. The listing changes
+# whenever any part does, which makes it the object to fingerprint the table
+# by (see pipeline.py). Parts come through the store's cache like any other
+# object.
+################################################################################
+import json
+import os
+import shutil
+import pandas as pd
+
+PARTITION = 'corpus'
+COMPRESSION = 'zstd'
+# listing of the parts of a table in a store
+PARTS = '_parts.json'
+# folder name pyarrow reads back as a null partition
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+PART_FILE = 'part-00000.parquet'
+
+
+def write_table(df, path):
+    """
+    Write a DataFrame as a table partitioned by its corpus column, replacing
+    whatever was at path. The index is kept.
+
+    :param df: DataFrame with a corpus column
+    :param path: directory of the table
+    :return: dict of corpus (None for no corpus) -> path of its part,
+    relative to path
+    """
+    tmp = path.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    # users without a corpus get the null folder's name as their key, as
+    # groupby would leave them out
+    corpus = df[PARTITION].astype(object)
+    keys = corpus.where(corpus.notna(), NULL_PARTITION).astype(str).values
+    parts = {}
+    for value, group in df.groupby(keys, sort=False):
+        folder = '{}={}'.format(PARTITION, value)
+        part = os.path.join(folder, PART_FILE)
+        os.makedirs(os.path.join(tmp, folder))
+        group.drop(columns=PARTITION).to_parquet(
+            os.path.join(tmp, part), compression=COMPRESSION)
+        parts[None if value == NULL_PARTITION else value] = part
+
+    # the old table is only replaced once the new one is complete
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return parts
+
+
+def _read_parts(parts, columns, categories):
+    """
+    :param parts: list of (corpus, local path) of the parts to read
+    :param columns: columns to read, None for all; the corpus column is
+    added if listed, or if columns is None
+    :param categories: categories of the corpus column
+    :return: DataFrame of the parts, one after the other
+    """
+    with_corpus = columns is None or PARTITION in columns
+    if columns is not None:
+        columns = [c for c in columns if c != PARTITION]
+
+    frames = []
+    for corpus, path in parts:
+        frame = pd.read_parquet(path, columns=columns)
+        if with_corpus:
+            frame[PARTITION] = corpus
+        frames.append(frame)
+    if frames:
+        df = pd.concat(frames)
+    else:
+        df = pd.DataFrame(columns=columns or [])
+        if with_corpus:
+            df[PARTITION] = []
+    if with_corpus:
+        df[PARTITION] = pd.Categorical(df[PARTITION], categories=categories)
+    return df
+
+
+def read_table(path, columns=None, corpora=None):
+    """
+    :param path: directory of the table
+    :param columns: columns to read (the index always is); default all. The
+    corpus column is only read if listed, or if columns is None.
+    :param corpora: corpora to read; default all
+    :return: DataFrame, its corpus column categorical
+    """
+    found = []
+    for folder in sorted(os.listdir(path)):
+        if folder.startswith(PARTITION + '='):
+            value = folder[len(PARTITION) + 1:]
+            found.append((None if value == NULL_PARTITION else value,
+                          os.path.join(path, folder, PART_FILE)))
+    # only the folders of the corpora asked for are opened
+    parts = [(corpus, part) for corpus, part in found
+             if corpora is None or corpus in corpora]
+    return _read_parts(parts, columns, [corpus for corpus, _ in found
+                                        if corpus is not None])
+
+
+def upload_table(df, store, name):
+    """
+    Put a DataFrame in the store as a table partitioned by corpus.
+
+    :param df: DataFrame with a corpus column
+    :param store: ObjectStore
+    :param name: name of the table, e.g. 'processed/network_metrics_by_user'
+    """
+    local = os.path.basename(name.rstrip('/'))
+    parts = write_table(df, local)
+    try:
+        listing = {'columns': [c for c in df.columns if c != PARTITION],
+                   'parts': []}
+        for corpus, part in parts.items():
+            key = name + '/' + part.replace(os.sep, '/')
+            listing['parts'].append({
+                'corpus': corpus, 'name': key,
+                'fingerprint': store.upload(os.path.join(local, part), key)})
+        listing_file = os.path.join(local, PARTS)
+        with open(listing_file, 'w') as f:
+            json.dump(listing, f, indent=1)
+        # the listing last, so it never names parts not yet uploaded
+        store.upload(listing_file, name + '/' + PARTS)
+    finally:
+        shutil.rmtree(local, ignore_errors=True)
+
+
+def table_listing(store, name):
+    """
+    :return: dict of the table's 'columns' & 'parts' (corpus, name &
+    fingerprint of each)
+    """
+    with store.open(name + '/' + PARTS) as f:
+        return json.load(f)
+
+
+def read_stored_table(store, name, columns=None, corpora=None):
+    """
+    Read a table from the store, fetching only the parts of the corpora
+    asked for.
+
+    :param store: ObjectStore
+    :param name: name of the table
+    :param columns: columns to read (the index always is); default all. The
+    corpus column is only added if listed, or if columns is None.
+    :param corpora: corpora to read; default all
+    :return: DataFrame
+    """
+    listing = table_listing(store, name)
+    parts = [(part['corpus'], store.path(part['name']))
+             for part in listing['parts']
+             if corpora is None or part['corpus'] in corpora]
+    return _read_parts(parts, columns, [part['corpus'] for part in
+                                        listing['parts']
+                                        if part['corpus'] is not None])
+
+
+def stored_columns(store, name):
+    """
+    :return: the columns of a table in the store, other than the corpus
+    """
+    return table_listing(store, name)['columns']
@@ -0,0 +1,391 @@
+################################################################################
+# Run the pipeline's scripts in dependency order, skipping the ones whose
+# outputs are already up to date.
+#
+# Each stage below is one of the scripts, with what it reads and writes;
+# local paths (globs allowed) or objects in the store, written
+# 'store:<name>' (see object_store.py). Before a stage runs, its inputs and
+# its code (the script & the local modules it imports) are fingerprinted. A
+# stage is skipped when those fingerprints match its last successful run
+# and its outputs are still what the pipeline last wrote. Otherwise it
+# runs, and so does everything downstream whose inputs it changes. Stages
+# whose inputs are all ready run at the same time, e.g. network_metrics.py
+# and finalize_exclusive_metrics_by_user.py.
+#
+# Local files are fingerprinted by size & modification time (like the raw
+# tweets cache, see raw_tweets.py), store objects by content hash.
+#
+# The crawl (get_following_list_per_user.py) runs for weeks and is not a
+# stage; its following files are an input of user_following_graph.
+#
+# e.g.
+#   python pipeline.py                     # everything that is out of date
+#   python pipeline.py network_metrics     # that stage & what it needs
+#   python pipeline.py --dry-run           # list what would run
+#   python pipeline.py --force users_graph # rerun it even if up to date
+#
+# Input / Output:
+# the inputs & outputs of the stages below
+# repo/data/processed/pipeline_state.json, fingerprints of the last runs
+################################################################################
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from corpora import Corpora
+from object_store import open_store
+
+STATE_FILE = "../data/processed/pipeline_state.json"
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+    """
+    One script of the pipeline.
+    """
+
+    def __init__(self, name, script, inputs, outputs, args=()):
+        """
+        :param name: stage name
+        :param script: script in src/ to run
+        :param inputs: local paths / globs and 'store:<name>' objects read
+        :param outputs: local paths and 'store:<name>' objects written
+        :param args: command line arguments for the script
+        """
+        self.name = name
+        self.script = script
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.args = list(args)
+
+    def __repr__(self):
+        return "Stage({!r})".format(self.name)
+
+
+def stages(corpora=None):
+    """
+    :param corpora: corpora.Corpora, default from corpora.json
+    :return: list of the pipeline's stages
+    """
+    if corpora is None:
+        corpora = Corpora.load()
+    raw_tweets = list(corpora.tweets.values())
+    user_table = "../data/processed/user_table/**"
+    users = "../data/processed/combo_users_sept19/**"
+    graph = "store:raw/all_users_digraph.graph"
+    # a table's listing changes whenever any of its parts does (see
+    # parquet_table.py)
+    metrics = "store:processed/network_metrics_by_user/_parts.json"
+    todes_g = "store:processed/todes_g_exclusive.graph"
+    latinx_g = "store:processed/latinx_g_exclusive.graph"
+
+    return [
+        Stage('users', 'get_all_users_info.py',
+              ['corpora.json'] + raw_tweets, [user_table]),
+        Stage('corpora', 'process_users_corpora.py',
+              ['corpora.json', user_table] + raw_tweets, [users]),
+        Stage('users_graph', 'user_following_graph.py',
+              [users, '../data/processed/user_following/*.txt',
+               '../data/processed/user_following/*.bin'],
+              [graph, 'store:raw/all_users_digraph.ingest.json',
+               'store:raw/all_users_digraph.dirty.json']),
+        Stage('metrics_by_user', 'network_metrics_by_user.py', [graph],
+              [metrics, todes_g, latinx_g]),
+        Stage('network_metrics', 'network_metrics.py', [todes_g, latinx_g],
+              ['store:processed/network_metrics.txt']),
+        Stage('finalize', 'finalize_exclusive_metrics_by_user.py', [metrics],
+              ["../data/final/todes_exclusive_users_metrics/**",
+               "../data/final/latinx_exclusive_users_metrics/**"]),
+    ]
+
+
+# ---------------------------------------------------------------------------- #
+# fingerprints
+# ---------------------------------------------------------------------------- #
+def local_modules(script):
+    """
+    :return: sorted paths of script and every module in src/ it imports,
+    directly or not
+    """
+    seen = set()
+    todo = [os.path.join(SRC, script)]
+    while todo:
+        path = todo.pop()
+        if path in seen or not os.path.exists(path):
+            continue
+        seen.add(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                names = [node.module]
+            else:
+                continue
+            todo.extend(os.path.join(SRC, name.split('.')[0] + '.py')
+                        for name in names)
+    return sorted(seen)
+
+
+def code_fingerprint(stage):
+    """
+    :return: hash of the stage's script, its arguments and the local
+    modules it imports
+    """
+    md5 = hashlib.md5(json.dumps(stage.args).encode('utf-8'))
+    for path in local_modules(stage.script):
+        md5.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            md5.update(f.read())
+    return md5.hexdigest()
+
+
+def fingerprint(spec, store):
+    """
+    :param spec: local path / glob, or 'store:<name>'
+    :param store: ObjectStore
+    :return: string that changes when what spec refers to does; None if it
+    does not exist
+    """
+    if spec.startswith('store:'):
+        return store.fingerprint(spec[len('store:'):])
+    # relative to src/, where the scripts run
+    spec = os.path.join(SRC, spec)
+    paths = sorted(glob.glob(spec, recursive=True)) \
+        if glob.has_magic(spec) else [spec]
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            files.append([os.path.abspath(path), stat.st_size,
+                          stat.st_mtime_ns])
+    if not files and not glob.has_magic(spec):
+        return None
+    return hashlib.md5(json.dumps(files).encode('utf-8')).hexdigest()
+
+
+# ---------------------------------------------------------------------------- #
+# state of the last runs
+# ---------------------------------------------------------------------------- #
+def load_state(path=STATE_FILE):
+    """
+    :return: {'stages': {name: {'code', 'inputs', 'outputs'}},
+    'produced': {output: fingerprint the pipeline last wrote}}
+    """
+    if not os.path.exists(path):
+        return {'stages': {}, 'produced': {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_FILE):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def up_to_date(stage, state, store):
+    """
+    :return: (True if the stage can be skipped, reason if not)
+    """
+    last = state['stages'].get(stage.name)
+    if last is None:
+        return False, "never run"
+    if last['code'] != code_fingerprint(stage):
+        return False, "code changed"
+    for spec in stage.inputs:
+        if fingerprint(spec, store) != last['inputs'].get(spec):
+            return False, "input changed: " + spec
+    for spec in stage.outputs:
+        current = fingerprint(spec, store)
+        if current is None:
+            return False, "output missing: " + spec
+        if current != state['produced'].get(spec):
+            return False, "output changed: " + spec
+    return True, None
+
+
+def record(stage, state, store, inputs):
+    """
+    Note a successful run. Inputs the stage also writes (it updates them in
+    place) are recorded as it left them, so they don't count as changed next
+    time.
+    """
+    outputs = {spec: fingerprint(spec, store) for spec in stage.outputs}
+    inputs = dict(inputs)
+    inputs.update((spec, outputs[spec]) for spec in stage.inputs
+                  if spec in outputs)
+    state['stages'][stage.name] = {'code': code_fingerprint(stage),
+                                   'inputs': inputs, 'outputs': outputs}
+    state['produced'].update(outputs)
+
+
+# ---------------------------------------------------------------------------- #
+# running
+# ---------------------------------------------------------------------------- #
+def dependencies(all_stages):
+    """
+    :return: {stage name: set of names of the stages writing its inputs}
+    """
+    writers = {}
+    for stage in all_stages:
+        for spec in stage.outputs:
+            writers.setdefault(spec, []).append(stage.name)
+
+    deps = {}
+    for i, stage in enumerate(all_stages):
+        # a stage depends on earlier stages writing what it reads; a stage
+        # updating a file in place comes after the stage that made it
+        earlier = {s.name for s in all_stages[:i]}
+        deps[stage.name] = {w for spec in stage.inputs
+                            for w in writers.get(spec, []) if w in earlier}
+    return deps
+
+
+def _needed(targets, deps):
+    needed = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(deps[name])
+    return needed
+
+
+def _run_script(stage):
+    start = time.time()
+    logging.info("run {} ({})".format(stage.name, stage.script))
+    result = subprocess.run([sys.executable, stage.script] + stage.args,
+                            cwd=SRC)
+    return result.returncode, time.time() - start
+
+
+def run(all_stages, targets=None, force=(), jobs=2, dry_run=False,
+        store=None, state_path=STATE_FILE):
+    """
+    Run the out of date stages needed for targets, as many at once as jobs
+    and their dependencies allow.
+
+    :param all_stages: list of Stage, in an order that respects their
+    dependencies (as stages() is)
+    :param targets: names of the stages wanted; default all
+    :param force: names of stages to run even if up to date
+    :param jobs: most stages running at once
+    :param dry_run: only report what would run
+    :param store: ObjectStore, default open_store()
+    :param state_path: where fingerprints of the last runs are kept
+    :return: list of the names of the stages that ran (or would run)
+    """
+    if store is None:
+        store = open_store()
+    by_name = {stage.name: stage for stage in all_stages}
+    deps = dependencies(all_stages)
+    needed = _needed(targets or list(by_name), deps)
+    order = [stage.name for stage in all_stages if stage.name in needed]
+    state = load_state(state_path)
+
+    done, ran, running = set(), [], {}
+    # in a dry run nothing changes, so say downstream stages of those that
+    # would run would run too
+    dirty = set()
+    with ThreadPoolExecutor(max(jobs, 1)) as pool:
+        while len(done) < len(order):
+            for name in order:
+                if name in done or name in running or \
+                        not deps[name] <= done:
+                    continue
+                stage = by_name[name]
+                fresh, reason = up_to_date(stage, state, store)
+                if dry_run and deps[name] & dirty:
+                    fresh, reason = False, "upstream stage ran"
+                if name in force:
+                    fresh, reason = False, "forced"
+                if fresh:
+                    logging.info("skip {}, up to date".format(name))
+                    print("skip {} (up to date)".format(name))
+                    done.add(name)
+                    continue
+                print("run {} ({})".format(name, reason))
+                logging.info("{}: {}".format(name, reason))
+                ran.append(name)
+                dirty.add(name)
+                if dry_run:
+                    done.add(name)
+                    continue
+                inputs = {spec: fingerprint(spec, store)
+                          for spec in stage.inputs}
+                running[name] = (pool.submit(_run_script, stage), inputs)
+
+            if not running:
+                continue
+            finished, _ = wait([future for future, _ in running.values()],
+                               return_when=FIRST_COMPLETED)
+            for name in [n for n, (f, _) in running.items()
+                         if f in finished]:
+                future, inputs = running.pop(name)
+                code, seconds = future.result()
+                if code != 0:
+                    # let the stages already running finish, keeping the
+                    # work of those that succeed, then stop
+                    for other_name, (other, other_inputs) in running.items():
+                        other_code, other_seconds = other.result()
+                        if other_code == 0:
+                            record(by_name[other_name], state, store,
+                                   other_inputs)
+                            logging.info("{} done in {:.0f}s".format(
+                                other_name, other_seconds))
+                    save_state(state, state_path)
+                    raise RuntimeError("{} failed with exit code {}".format(
+                        by_name[name].script, code))
+                record(by_name[name], state, store, inputs)
+                save_state(state, state_path)
+                logging.info("{} done in {:.0f}s".format(name, seconds))
+                print("{} done in {:.0f}s".format(name, seconds))
+                done.add(name)
+    return ran
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='pipeline.log', level=logging.INFO,
+                        format='%(asctime)s %(message)s')
+    all_stages = stages()
+    parser = argparse.ArgumentParser(
+        description="Run the out of date stages of the pipeline.")
+    parser.add_argument('targets', nargs='*',
+                        help="stages to bring up to date, with the stages "
+                             "they need; default all")
+    parser.add_argument('--force', nargs='+', default=[],
+                        help="run these stages even if up to date")
+    parser.add_argument('--jobs', type=int, default=2,
+                        help="most stages running at once")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="list what would run, without running it")
+    parser.add_argument('--list', action='store_true',
+                        help="list the stages & whether they are up to date")
+    args = parser.parse_args()
+    names = [stage.name for stage in all_stages]
+    for name in args.targets + args.force:
+        if name not in names:
+            parser.error("unknown stage {}, choose from {}".format(
+                name, ', '.join(names)))
+
+    if args.list:
+        store = open_store()
+        state = load_state()
+        for stage in all_stages:
+            fresh, reason = up_to_date(stage, state, store)
+            print("{:<16} {:<40} {}".format(stage.name, stage.script,
+                                            'up to date' if fresh else
+                                            reason))
+    else:
+        run(all_stages, args.targets, args.force, args.jobs, args.dry_run)
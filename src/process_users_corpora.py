@@ -1,62 +1,70 @@
 ################################################################################
-# This script takes the raw user acct info in
-# data/processed/combo_user_df_sept19.pkl
+# This script takes the raw user acct info in the user table
+# data/processed/user_table/
 # generated by 'get_all_users_info.py' and calculates age of account and
 # double checks that corpus information is correct based on info from the raw
-# tweets.
+# tweets. The corpora & their raw tweet files are listed in corpora.json (see
+# corpora.py).
+#
+# The result is a Parquet table of one row per user, partitioned by the
+# corpus they were assigned (see parquet_table.py).
 #
 # Input:
-# data/processed/combo_user_df_sept19.pkl
+# data/processed/user_table/
+# the raw tweet csv of each corpus in corpora.json (or their cached
+# usernames, see raw_tweets.py)
 # Output:
-# repo/data/processed/combo_user_df_sept19.pkl
+# repo/data/processed/combo_users_sept19/
 ################################################################################
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from corpora import Corpora
+from parquet_table import write_table
+from raw_tweets import corpus_usernames, usernames_in
+from user_table import read_user_table
+
+corpora = Corpora.load()
 
-# Note raw data source
-df = pd.read_pickle("../data/processed/combo_user_df_sept19.pkl")
+# Note raw data source; one row per user, with a 0/1 flag per corpus they
+# were looked up for
+df = read_user_table("../data/processed/user_table", corpora=corpora.names)
 
 # ---------------------------------------------------------------------------- #
 # Add account age information to each user
 # ---------------------------------------------------------------------------- #
-created_time_format = "%a %b %d %H:%M:%S +%f %Y" # matches format from twitter
+created_time_format = "%a %b %d %H:%M:%S %z %Y"  # matches format from twitter
 
-df['days_old'] = df.created_at.apply(lambda x:
-    (datetime.today() - datetime.strptime(x, created_time_format)).days)
+created_at = pd.to_datetime(df.created_at, format=created_time_format,
+                            utc=True)
+df['days_old'] = (pd.Timestamp.now(tz='UTC') - created_at).dt.days
 
-df['years_old'] = df.days_old.apply(lambda x: x/365)
+df['years_old'] = df.days_old / 365
 
 
 # ---------------------------------------------------------------------------- #
 # Pull users list from RAW tweets, separate into one corpus or other
-# and assign each user in the global users list either todes, latinx, or both
+# and assign each user in the global users list one corpus, or the overlap
+# label (both) if they are in more than one
 # ---------------------------------------------------------------------------- #
-latinx = pd.read_csv("../data/raw/LX-Sept2019.csv")
-todes = pd.read_csv("../data/raw/TE-Sept2019.csv")
-
-unique_lx_users = latinx.username.unique()
-unique_te_users = todes.username.unique()
-intersection = set(unique_lx_users).intersection(set(unique_te_users))
-
-
-for idx, row in df.iterrows():
-    if row.screen_name in unique_lx_users:
-        df.loc[idx, 'latinx'] = 1
-    if row.screen_name in unique_te_users:
-        df.loc[idx, 'todes'] = 1
-
-# corpus = both if in both, otherwise todes or latinx
-df['corpus'] = pd.Series(dtype=str)
-for idx, row in df.iterrows():
-    if (row.todes == 1) & (row.latinx == 1):
-        df.loc[idx, 'corpus'] = 'both'
-    if (row.todes == 1) & (row.latinx == 0):
-        df.loc[idx, 'corpus'] = 'todes'
-    if (row.todes == 0) & (row.latinx == 1):
-        df.loc[idx, 'corpus'] = 'latinx'
+usernames = corpus_usernames(corpora)
+membership = np.zeros(len(df), dtype=np.int64)
+
+for name in corpora.names:
+    in_corpus = df.screen_name.isin(usernames_in(usernames, name)).values
+
+    # flags from get_all_users_info.py are kept, raw tweets can only add
+    flag = df[name].fillna(0).astype(int).values if name in df else 0
+    df[name] = np.maximum(flag, in_corpus.astype(int))
+    membership += df[name].values
+
+# corpus = both if in more than one, otherwise the one corpus they are in
+flags = df[corpora.names].values
+corpus = np.array(corpora.names, dtype=object)[flags.argmax(axis=1)]
+corpus[membership > 1] = corpora.overlap
+corpus[membership == 0] = None
+df['corpus'] = pd.Categorical(corpus, categories=corpora.labels)
 
 # ---------------------------------------------------------------------------- #
 # Save out
 # ---------------------------------------------------------------------------- #
-df.to_pickle("../data/processed/combo_user_df_sept19.pkl")
-df.to_json("../data/processed/combo_user_df_sept19.json")
\ No newline at end of file
+write_table(df.set_index('id_str'), "../data/processed/combo_users_sept19")
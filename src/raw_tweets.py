@@ -0,0 +1,107 @@
+################################################################################
+# Read what the pipeline needs from the raw tweet csv's without loading them
+# whole.
+#
+# The csv's are streamed in chunks of only the needed columns, and the
+# unique usernames of each corpus are built up a chunk at a time. The
+# username -> corpus table (one row per user per corpus they tweeted in, in
+# order of first tweet) is cached as Parquet, keyed on the path, size and
+# modification time of every csv it came from, so later runs skip the csv's
+# until one of them changes.
+################################################################################
+import json
+import logging
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CACHE_FILE = "../data/processed/corpus_usernames.parquet"
+CHUNK_ROWS = 500000
+
+# schema metadata key the source files are recorded under
+_KEY = b'raw_tweets_sources'
+
+
+def read_csv_chunks(path, usecols, chunksize=CHUNK_ROWS, **kwargs):
+    """
+    :param path: raw tweet csv
+    :param usecols: columns to read
+    :param chunksize: rows per chunk
+    :return: iterator of DataFrames of at most chunksize rows
+    """
+    return pd.read_csv(path, usecols=usecols, chunksize=chunksize, **kwargs)
+
+
+def read_usernames(path, chunksize=CHUNK_ROWS):
+    """
+    :param path: raw tweet csv
+    :param chunksize: rows per chunk
+    :return: list of the unique usernames in the csv, in order of first
+    appearance
+    """
+    seen = {}
+    for chunk in read_csv_chunks(path, ['username'], chunksize,
+                                 dtype={'username': str}):
+        seen.update(dict.fromkeys(chunk.username.dropna().unique()))
+    return list(seen)
+
+
+def _sources(corpora):
+    sources = []
+    for name, path in corpora.tweets.items():
+        stat = os.stat(path)
+        sources.append([name, os.path.abspath(path), stat.st_size,
+                        stat.st_mtime_ns])
+    return json.dumps(sources).encode('utf-8')
+
+
+def corpus_usernames(corpora, cache_path=CACHE_FILE, chunksize=CHUNK_ROWS):
+    """
+    The usernames in each corpus' raw tweets, from the cache if none of the
+    csv's have changed since it was written.
+
+    :param corpora: corpora.Corpora
+    :param cache_path: Parquet file to cache the table in. None skips the
+    cache.
+    :param chunksize: rows per chunk when the csv's have to be read
+    :return: DataFrame with columns corpus (categorical) and username, one
+    row per user per corpus
+    """
+    key = _sources(corpora)
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            table = pq.read_table(cache_path)
+            if (table.schema.metadata or {}).get(_KEY) == key:
+                logging.info("usernames read from " + cache_path)
+                df = table.to_pandas()
+                df['corpus'] = pd.Categorical(df.corpus,
+                                              categories=corpora.names)
+                return df
+        except (IOError, OSError, pa.ArrowException):
+            logging.exception("error reading " + cache_path)
+
+    frames = []
+    for name, path in corpora.tweets.items():
+        logging.info("reading usernames from " + path)
+        usernames = read_usernames(path, chunksize)
+        frames.append(pd.DataFrame({'corpus': name, 'username': usernames}))
+    df = pd.concat(frames, ignore_index=True)
+    df['corpus'] = pd.Categorical(df.corpus, categories=corpora.names)
+
+    if cache_path is not None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[_KEY] = key
+        table = table.replace_schema_metadata(metadata)
+        pq.write_table(table, cache_path)
+    return df
+
+
+def usernames_in(table, corpus):
+    """
+    :param table: DataFrame from corpus_usernames
+    :param corpus: corpus name
+    :return: array of the usernames in that corpus, in order of first tweet
+    """
+    return table.username.values[(table.corpus == corpus).values]
@@ -0,0 +1,194 @@
+################################################################################
+# Refresh the per-user network metrics after user_following_graph.py
+# --incremental has added newly crawled following data to the graph.
+#
+# Only users marked dirty (they gained edges, or are new to the graph) and
+# the users whose neighborhoods reach them are recomputed, for;
+# - number of predecessors & successors in other corpus
+# - in & out degree, and the degree centralities
+# - reciprocity
+# - in & out bound 2-hop neighborhood sizes
+#
+# Clustering, triad participation & betweenness centrality are left as they
+# are; rerun network_metrics_by_user.py for those.
+#
+# With --server (or $TWEETHIS_GRAPH_SERVER set), reciprocity & the 2-hop
+# neighborhoods are asked of a running graph_server.py instead of being
+# worked out here.
+#
+# The exclusive todes & latinx graphs are written again from the updated
+# graph, so network_metrics.py and the rest see the same graphs as the
+# refreshed metrics.
+#
+# Inputs
+# ------
+# tweethis/raw/all_users_digraph.graph
+# tweethis/raw/all_users_digraph.dirty.json
+# tweethis/processed/network_metrics_by_user/
+#
+# Outputs
+# -------
+# tweethis/processed/todes_g_exclusive.graph
+# tweethis/processed/latinx_g_exclusive.graph
+# tweethis/processed/network_metrics_by_user/ (see parquet_table.py)
+################################################################################
+import argparse
+import json
+import logging
+import os
+import sys
+import numpy as np
+import pandas as pd
+from object_store import open_store
+from corpus_partition import CorpusPartition
+from graph_store import read_graph, write_graph
+from parquet_table import read_stored_table, upload_table
+from nhop import nhop_reach
+from user_metrics import degrees
+import graph_server
+
+logging.basicConfig(filename='refresh_network_metrics_by_user.log',
+                    level=logging.INFO, format='%(asctime)s %(message)s')
+
+parser = argparse.ArgumentParser(
+    description="Refresh the network metrics of users whose neighborhoods "
+                "changed.")
+graph_server.add_server_argument(parser)
+args = parser.parse_args()
+
+nhop_cutoff = 2
+
+# ---------------------------------------------------------------------------- #
+# read in graph of all users, the dirty users, and the current users df
+# ---------------------------------------------------------------------------- #
+logging.info("read in graph of all users, dirty users, users df")
+
+# artifact store, tweethis bucket by default, with downloads cached locally
+# (see object_store.py)
+store = open_store()
+
+graph_name = 'raw/all_users_digraph.graph'
+all_users = read_graph(store.path(graph_name))
+
+with store.open('raw/all_users_digraph.dirty.json') as f:
+    dirty_users = json.load(f)
+
+if dirty_users is None:
+    logging.info("graph was rebuilt from scratch, run "
+                 "network_metrics_by_user.py instead. program terminated.")
+    sys.exit(0)
+
+users_table = 'processed/network_metrics_by_user'
+# every corpus' part, through the store's cache
+users_df = read_stored_table(store, users_table)
+
+# reciprocity & n-hop from the graph server if there is one, otherwise
+# worked out here (see graph_server.py)
+metrics_source = graph_server.MetricSource(
+    graph_server.server_address(args.server), store)
+
+
+def corpus_metric(metric, corpus_name, view, rows, **params):
+    """
+    :return: array of the metric for rows of a corpus' view, from the graph
+    server if there is one
+    """
+    return metrics_source.metric(metric, view, graph_name, corpus=corpus_name,
+                                 rows=rows, **params).values
+
+# ---------------------------------------------------------------------------- #
+# add rows for users new to the graph
+# ---------------------------------------------------------------------------- #
+partition = CorpusPartition(all_users)
+dirty = np.array([all_users.node_id(u) for u in dirty_users], dtype=np.int64)
+dirty = dirty[~partition.mask('both')[dirty]]
+
+corpus = pd.Series(all_users.node_attrs['corpus'], index=list(all_users),
+                   name='corpus')
+new_users = corpus.iloc[dirty].index.difference(users_df.index)
+users_df = pd.concat([users_df, corpus[new_users].to_frame()])
+users_df.index.name = 'id_str'
+
+logging.info("{} dirty users, {} of them new".format(len(dirty),
+                                                      len(new_users)))
+
+# ---------------------------------------------------------------------------- #
+# COUNT PREDECESSORS AND SUCCESSORS IN OTHER CORPUS
+# ---------------------------------------------------------------------------- #
+logging.info("refresh predecessors and successors in other corpus")
+counts = partition.cross_corpus_counts(exclude=['both'])
+dirty_ids = corpus.index[dirty]
+users_df.loc[dirty_ids, counts.columns] = counts.loc[dirty_ids].values
+
+# ---------------------------------------------------------------------------- #
+# Per corpus: degree, degree centrality, reciprocity, 2-hop neighborhoods
+# ---------------------------------------------------------------------------- #
+for prefix, name in (('t', 'todes'), ('l', 'latinx')):
+    view = partition.view(name)
+    n = view.number_of_nodes()
+    local = view.local[dirty]
+    local = local[local >= 0]
+    ids = view.id_str[local]
+
+    logging.info("refresh {} degree & reciprocity for {} users".format(
+        name, len(local)))
+    in_deg, out_deg = degrees(view, local)
+    users_df.loc[ids, prefix+'_in_deg'] = in_deg
+    users_df.loc[ids, prefix+'_out_deg'] = out_deg
+    users_df.loc[ids, prefix+'_reciprocity'] = corpus_metric(
+        'reciprocity', name, view, local)
+
+    # centralities are scaled by the size of the graph, which may have
+    # grown, so rescale every user in this corpus from their degrees
+    in_corpus = users_df.corpus == name
+    scale = 1.0 / (n - 1) if n > 1 else 1.0
+    users_df.loc[in_corpus, prefix+'_in_deg_central'] = \
+        users_df.loc[in_corpus, prefix+'_in_deg'] * scale
+    users_df.loc[in_corpus, prefix+'_out_deg_central'] = \
+        users_df.loc[in_corpus, prefix+'_out_deg'] * scale
+    users_df.loc[in_corpus, prefix+'_deg_central'] = \
+        (users_df.loc[in_corpus, prefix+'_in_deg'] +
+         users_df.loc[in_corpus, prefix+'_out_deg']) * scale
+
+    # a user's out-bound neighborhood changes if it can reach a dirty user
+    # in fewer than nhop_cutoff hops; likewise in-bound
+    out_rows = nhop_reach(view, local, nhop_cutoff - 1, direction='in')
+    in_rows = nhop_reach(view, local, nhop_cutoff - 1, direction='out')
+    logging.info("refresh {} 2-hop neighborhoods for {} out & {} in".format(
+        name, len(out_rows), len(in_rows)))
+
+    out_ids = view.id_str[out_rows]
+    users_df.loc[out_ids, prefix+'_out_2hop'] = corpus_metric(
+        'nhop_walks', name, view, out_rows, cutoff=nhop_cutoff,
+        direction='out')
+    users_df.loc[out_ids, prefix+'_out_2hop_unique'] = corpus_metric(
+        'nhop_sizes', name, view, out_rows, cutoff=nhop_cutoff,
+        direction='out')
+
+    in_ids = view.id_str[in_rows]
+    users_df.loc[in_ids, prefix+'_in_2hop'] = corpus_metric(
+        'nhop_walks', name, view, in_rows, cutoff=nhop_cutoff,
+        direction='in')
+    users_df.loc[in_ids, prefix+'_in_2hop_unique'] = corpus_metric(
+        'nhop_sizes', name, view, in_rows, cutoff=nhop_cutoff,
+        direction='in')
+
+# ---------------------------------------------------------------------------- #
+# WRITE OUTPUTS
+# ---------------------------------------------------------------------------- #
+logging.info("writing outputs")
+
+# exclusive graphs, as network_metrics_by_user.py writes them
+for name, title in (('todes', 'Todes (exclusive) Graph'),
+                    ('latinx', 'Latinx (exclusive) Graph')):
+    graph_file_out = name + '_g_exclusive.graph'
+    write_graph(partition.view(name, name=title).materialize(),
+                graph_file_out)
+    store.upload(graph_file_out, 'processed/'+graph_file_out)
+    os.remove(graph_file_out)
+
+upload_table(users_df, store, users_table)
+metrics_source.close()
+
+logging.info("graphs & df of network metrics by user refreshed. program "
+             "terminated.")
@@ -0,0 +1,317 @@
+################################################################################
+# Triadic census of a directed graph over its integer adjacency arrays,
+# instead of networkx's dict-of-sets triadic_census.
+#
+# This is the Batagelj & Mrvar algorithm networkx uses, vectorized. With N(v)
+# the neighbours of v ignoring direction, every linked pair v < u is taken
+# once, and
+# - each third node w in N(u) | N(v) that makes {v, u, w} first seen at this
+#   pair is classified by the 6-bit code of the links among the three;
+# - the other n - |N(u) | N(v)| - 2 nodes make a 012 or 102 triad with it.
+# 003 is what is left of the n choose 3 triads. Pairs are grouped by their
+# lower node v, so the work splits into ranges of v whose counts just add
+# up, and ranges are shared out across a process pool.
+#
+# The same pass can count, for every node, how many of each connected triad
+# type (those other than 003, 012 and 102) it is in. There is also an
+# estimate of the census from a random sample of the v's, with confidence
+# bounds, for when the exact census takes too long.
+################################################################################
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from networkx.algorithms.triads import TRIAD_NAMES, TRICODES
+from scipy.stats import norm
+from parallel import default_processes, pool_context
+
+# triad types in which all three nodes are linked, directly or not
+CONNECTED_TRIADS = TRIAD_NAMES[3:]
+
+# neighbour lists gathered per range of v, roughly
+BLOCK_WORK = 1 << 22
+
+# triad type (position in TRIAD_NAMES) of each 6-bit code
+_TYPE_OF_CODE = np.array(TRICODES, dtype=np.int64) - 1
+_T012 = TRIAD_NAMES.index('012')
+_T102 = TRIAD_NAMES.index('102')
+
+# arrays each worker counts ranges of, set by _init_worker
+_worker_arrays = None
+
+
+class TriadCensusEstimate:
+    """
+    Sampled triadic census. counts, low and high are OrderedDicts in
+    TRIAD_NAMES order, low / high being the bounds of a `confidence` interval
+    (normal approximation) on each count.
+    """
+
+    def __init__(self, counts, low, high, sampled, confidence):
+        self.counts = counts
+        self.low = low
+        self.high = high
+        self.sampled = sampled
+        self.confidence = confidence
+
+    def __repr__(self):
+        return "TriadCensusEstimate({} nodes sampled, {:.0%} CI)".format(
+            self.sampled, self.confidence)
+
+
+def _arrays(graph):
+    """
+    :return: (n, indptr & indices of the undirected adjacency with sorted
+    rows, sorted row * n + col keys of its entries, sorted keys of the
+    directed edges). Self-loops are dropped.
+    """
+    a = graph.adjacency(dtype=np.int8).tocoo()
+    n = a.shape[0]
+    keep = a.row != a.col
+    src = a.row[keep].astype(np.int64)
+    dst = a.col[keep].astype(np.int64)
+    keys = np.unique(src * n + dst)
+
+    both = np.unique(np.concatenate([keys, dst * n + src]))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(both // n, minlength=n), out=indptr[1:])
+    return n, indptr, both % n, both, keys
+
+
+def _member(keys, query):
+    if len(keys) == 0:
+        return np.zeros(len(query), dtype=bool)
+    pos = np.searchsorted(keys, query)
+    pos[pos == len(keys)] = 0
+    return keys[pos] == query
+
+
+def _gather(indptr, indices, nodes):
+    """
+    :return: (position in nodes, neighbour) of every neighbour of nodes
+    """
+    counts = indptr[nodes + 1] - indptr[nodes]
+    owner = np.repeat(np.arange(len(nodes)), counts)
+    starts = np.repeat(indptr[nodes] - (np.cumsum(counts) - counts), counts)
+    return owner, indices[np.arange(len(owner)) + starts]
+
+
+def _count_rows(arrays, rows, per_row=False, participation=False):
+    """
+    Census of the triads found at pairs v < u with v in rows.
+
+    :param arrays: from _arrays
+    :param rows: node ids v
+    :param per_row: also split the counts by v
+    :param participation: also count the connected triads of every node
+    :return: (int64 counts over TRIAD_NAMES, 003 left at 0; per-row counts
+    of shape (len(rows), 16) or None; (node * 16 + type, count) arrays of
+    the participation or None)
+    """
+    n, indptr, indices, sym_keys, keys = arrays
+    rows = np.asarray(rows, dtype=np.int64)
+
+    def link(x, y):
+        return _member(keys, x * n + y).astype(np.int64)
+
+    # linked pairs v < u
+    owner, u = _gather(indptr, indices, rows)
+    v = rows[owner]
+    lower = v < u
+    row_of_pair, v, u = owner[lower], v[lower], u[lower]
+
+    # third nodes from N(v): {v, u, w} is first seen here if w > u
+    pair_v, w_v = _gather(indptr, indices, v)
+    keep = w_v > u[pair_v]
+    pair_v, w_v = pair_v[keep], w_v[keep]
+
+    # third nodes from N(u) only: first seen here if w > v
+    pair_u, w_u = _gather(indptr, indices, u)
+    in_v = _member(sym_keys, v[pair_u] * n + w_u)
+    shared = np.bincount(pair_u[in_v], minlength=len(v))
+    keep = (w_u > v[pair_u]) & ~in_v
+    pair_u, w_u = pair_u[keep], w_u[keep]
+
+    pair = np.concatenate([pair_v, pair_u])
+    w = np.concatenate([w_v, w_u])
+    tv, tu = v[pair], u[pair]
+    kind = _TYPE_OF_CODE[link(tv, tu) + 2 * link(tu, tv) + 4 * link(tv, w) +
+                         8 * link(w, tv) + 16 * link(tu, w) +
+                         32 * link(w, tu)]
+
+    # the nodes linked to neither v nor u; N(u) | N(v) includes u & v
+    degree = indptr[u + 1] - indptr[u] + indptr[v + 1] - indptr[v]
+    dyadic = n - (degree - shared)
+    dyadic_kind = np.where(link(u, v) & link(v, u), _T102, _T012)
+
+    counts = np.bincount(kind, minlength=16)
+    counts[_T012] += dyadic[dyadic_kind == _T012].sum()
+    counts[_T102] += dyadic[dyadic_kind == _T102].sum()
+
+    by_row = None
+    if per_row:
+        by_row = np.bincount(row_of_pair[pair] * 16 + kind,
+                             minlength=len(rows) * 16)
+        np.add.at(by_row, row_of_pair * 16 + dyadic_kind, dyadic)
+        by_row = by_row.reshape(len(rows), 16)
+
+    nodes = None
+    if participation:
+        nodes = np.unique(np.concatenate([tv * 16 + kind, tu * 16 + kind,
+                                          w * 16 + kind]),
+                          return_counts=True)
+    return counts, by_row, nodes
+
+
+def _blocks(indptr, rows, block_work):
+    """
+    Split rows into consecutive ranges of about block_work gathered
+    neighbours each.
+    """
+    degree = indptr[rows + 1] - indptr[rows]
+    work = np.cumsum(degree * (degree + 1))
+    cuts = np.searchsorted(work, np.arange(block_work, work[-1] if len(work)
+                                           else 0, block_work))
+    return [block for block in np.split(rows, np.unique(cuts + 1))
+            if len(block)]
+
+
+def _init_worker(arrays):
+    global _worker_arrays
+    _worker_arrays = arrays
+
+
+def _worker_count(job):
+    rows, per_row, participation = job
+    return (rows,) + _count_rows(_worker_arrays, rows, per_row,
+                                 participation)
+
+
+def _run(arrays, rows, processes, per_row, participation,
+         block_work=BLOCK_WORK):
+    """
+    Count over all of rows, a block at a time, across processes.
+
+    :return: (counts, per-row counts in the order of rows or None,
+    participation array of shape (n, 16) or None)
+    """
+    n, indptr = arrays[0], arrays[1]
+    blocks = _blocks(indptr, rows, block_work)
+    jobs = [(block, per_row, participation) for block in blocks]
+
+    counts = np.zeros(16, dtype=np.int64)
+    by_row = {} if per_row else None
+    nodes = np.zeros(n * 16, dtype=np.int64) if participation else None
+
+    def merge(result):
+        block, partial, block_by_row, block_nodes = result
+        counts[:] += partial
+        if per_row:
+            by_row.update(zip(block.tolist(), block_by_row))
+        if participation:
+            nodes[block_nodes[0]] += block_nodes[1]
+
+    processes = default_processes(processes)
+    if processes > 1 and len(jobs) > 1:
+        with pool_context().Pool(min(processes, len(jobs)),
+                                 initializer=_init_worker,
+                                 initargs=(arrays,)) as pool:
+            for result in pool.imap_unordered(_worker_count, jobs):
+                merge(result)
+    else:
+        for job in jobs:
+            merge((job[0],) + _count_rows(arrays, *job))
+
+    if per_row:
+        by_row = np.array([by_row[row] for row in rows.tolist()],
+                          dtype=np.int64).reshape(len(rows), 16)
+    if participation:
+        nodes = nodes.reshape(n, 16)
+    return counts, by_row, nodes
+
+
+def _with_003(counts, n):
+    # python ints: n choose 3 overflows int64 past ~3.8M nodes
+    census = OrderedDict((name, int(c)) for name, c in zip(TRIAD_NAMES,
+                                                          counts))
+    census['003'] = n * (n - 1) * (n - 2) // 6 - sum(census.values())
+    return census
+
+
+def triadic_census(graph, processes=None):
+    """
+    Triadic census, like nx.triadic_census.
+
+    :param graph: CSRGraph or SubgraphView
+    :param processes: number of worker processes. Default is one per core;
+    1 runs in this process.
+    :return: OrderedDict of triad type name -> count, in TRIAD_NAMES order
+    """
+    arrays = _arrays(graph)
+    n = arrays[0]
+    counts, _, _ = _run(arrays, np.arange(n, dtype=np.int64), processes,
+                        per_row=False, participation=False)
+    return _with_003(counts, n)
+
+
+def triad_participation(graph, processes=None):
+    """
+    For every node, the number of triads of each connected type it is in.
+
+    :param graph: CSRGraph or SubgraphView
+    :param processes: number of worker processes
+    :return: (census as from triadic_census, DataFrame indexed by the
+    graph's id_str with one int64 column per CONNECTED_TRIADS type)
+    """
+    arrays = _arrays(graph)
+    n = arrays[0]
+    counts, _, nodes = _run(arrays, np.arange(n, dtype=np.int64), processes,
+                            per_row=False, participation=True)
+    participation = pd.DataFrame(nodes[:, 3:], columns=CONNECTED_TRIADS,
+                                 index=graph.id_str)
+    return _with_003(counts, n), participation
+
+
+def estimate_triadic_census(graph, sample_size, confidence=0.95, seed=None,
+                            processes=None):
+    """
+    Estimate the triadic census from the triads found at a random sample of
+    nodes (the v's of the exact census): each count is n times the mean
+    over the sample, with a normal confidence interval from the spread of
+    the sample, corrected for sampling without replacement.
+
+    :param graph: CSRGraph or SubgraphView
+    :param sample_size: number of nodes to sample; all of them gives the
+    exact census with zero width intervals
+    :param confidence: confidence level of the intervals
+    :param seed: random seed
+    :param processes: number of worker processes
+    :return: TriadCensusEstimate
+    """
+    arrays = _arrays(graph)
+    n = arrays[0]
+    k = min(sample_size, n)
+    if k == 0:
+        zero = _with_003(np.zeros(16, dtype=np.int64), n)
+        return TriadCensusEstimate(zero, zero.copy(), zero.copy(), 0,
+                                   confidence)
+    rows = np.sort(np.random.RandomState(seed).choice(n, k, replace=False))
+    _, by_row, _ = _run(arrays, rows, processes, per_row=True,
+                        participation=False)
+
+    # 003 per node is minus the others, offset by n choose 3 / n
+    by_row = by_row.astype(np.float64)
+    by_row[:, 0] = -by_row[:, 1:].sum(axis=1)
+    offset = np.zeros(16)
+    offset[0] = n * (n - 1.0) * (n - 2.0) / 6
+
+    value = n * by_row.mean(axis=0) + offset
+    spread = by_row.std(axis=0, ddof=1) if k > 1 else np.zeros(16)
+    half = norm.ppf(0.5 + confidence / 2.0) * n * spread * \
+        np.sqrt((1.0 - k / n) / k)
+
+    def named(values):
+        return OrderedDict(zip(TRIAD_NAMES, values.tolist()))
+
+    return TriadCensusEstimate(named(value), named(np.maximum(value - half,
+                                                              0.0)),
+                               named(value + half), k, confidence)
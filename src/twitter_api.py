@@ -0,0 +1,130 @@
+################################################################################
+# Shared pieces for talking to the twitter API: credentials, and a token
+# bucket per credential that follows the rate-limit headers twitter sends
+# back instead of sleeping for a fixed time after every request.
+#
+# The twitter config (loaded with cnfg) may hold one set of OAuth1 keys at
+# the top level, as before, or several under "credentials";
+#
+#   {"credentials": [{"consumer_key": ..., "consumer_secret": ...,
+#                     "access_token": ..., "access_token_secret": ...},
+#                    ...],
+#    "api_base": "https://api.twitter.com/1.1"}
+#
+# "api_base" is optional and lets the scripts run against fake_twitter.py.
+################################################################################
+import asyncio
+import time
+from requests_oauthlib import OAuth1
+
+API_BASE = "https://api.twitter.com/1.1"
+
+# rate limits per 15 minute window with user auth
+RATE_LIMIT_WINDOW = 15 * 60
+FRIENDS_IDS_LIMIT = 15
+USERS_LOOKUP_LIMIT = 900
+
+
+def load_credentials(config):
+    """
+    :param config: dict loaded from the twitter config file
+    :return: list of OAuth1 objects, one per credential set
+    """
+    sets = config.get("credentials") or [config]
+    return [OAuth1(c["consumer_key"], c["consumer_secret"], c["access_token"],
+                   c["access_token_secret"]) for c in sets]
+
+
+def api_base(config):
+    """
+    :param config: dict loaded from the twitter config file
+    :return: base url of the API, without a trailing /
+    """
+    return config.get("api_base", API_BASE).rstrip("/")
+
+
+class TokenBucket:
+    """
+    Requests left in the current rate-limit window of one credential for
+    one endpoint. Twitter refills the whole window at once when it resets,
+    so the bucket does too. The x-rate-limit-* headers of every response
+    correct the count, so budget is neither wasted nor overdrawn.
+    """
+
+    def __init__(self, capacity, period=RATE_LIMIT_WINDOW):
+        """
+        :param capacity: requests allowed per window
+        :param period: length of the window in seconds
+        """
+        self.capacity = capacity
+        self.period = period
+        self.tokens = capacity
+        self.reset_at = time.time() + period
+
+    def _refill(self):
+        now = time.time()
+        if now >= self.reset_at:
+            self.tokens = self.capacity
+            self.reset_at = now + self.period
+
+    def wait_time(self):
+        """
+        :return: seconds until a request may be made, 0 if one may be made now
+        """
+        self._refill()
+        if self.tokens > 0:
+            return 0.0
+        return max(self.reset_at - time.time(), 0.0)
+
+    def try_acquire(self):
+        """
+        Take a token if there is one.
+
+        :return: True if a token was taken
+        """
+        self._refill()
+        if self.tokens > 0:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """
+        Wait until a request may be made and take a token for it.
+        """
+        while not self.try_acquire():
+            # a second of slack for clock differences with twitter
+            await asyncio.sleep(self.wait_time() + 1)
+
+    def update(self, headers):
+        """
+        Sync with the rate-limit headers of a response.
+
+        :param headers: response headers
+        """
+        try:
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset = float(headers["x-rate-limit-reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+        if "x-rate-limit-limit" in headers:
+            self.capacity = int(headers["x-rate-limit-limit"])
+        if reset != self.reset_at:
+            # first response of a window: trust twitter's count
+            self.tokens = remaining
+        else:
+            # requests may still be in flight, so only ever count down
+            self.tokens = min(self.tokens, remaining)
+        self.reset_at = reset
+
+    def exhaust(self, headers=None):
+        """
+        Empty the bucket after a 429, until the window resets.
+
+        :param headers: response headers, for the reset time
+        """
+        self.tokens = 0
+        try:
+            self.reset_at = float(headers["x-rate-limit-reset"])
+        except (KeyError, TypeError, ValueError):
+            self.reset_at = time.time() + self.period
@@ -1,56 +1,63 @@
 ################################################################################
 # This script was used to update the list of users when
-# get_following_list_per_user.py was interrupted. It removes the users that
-# could not be pinged as well as the users already pinged from the unqueried
-# users.
+# get_following_list_per_user.py was interrupted. The crawler now keeps a
+# checkpoint journal (see crawl_journal.py) and resumes on its own, so this
+# is only needed once, to carry over a crawl started before the journal
+# existed. It marks the users in the saved following lists as done and the
+# users in the failure logs as failed, so the crawler skips both.
+# Run it before the first run of the crawler with the journal; users
+# already in the journal are left as they are.
 #
 # Input:
-# repo/data/processed/user_following/user_list.pkl
+# repo/data/processed/user_following/saved_users*.txt
+# repo/data/processed/user_following/following_list_log*.txt
 # Output:
-# repo/data/processed/user_following/user_list.pkl
+# repo/data/processed/user_following/crawl_journal.sqlite
 ################################################################################
-import pickle
+import glob
 import re
+from crawl_journal import CrawlJournal, DONE, FAILED
 
-
-################################################################################
-################################################################################
-# ----- Update this each run ----- #
-this_addition = "../data/processed/user_following/saved_users4.txt"
-this_subtraction = "../data/processed/user_following/following_list_log4.txt"
-################################################################################
-################################################################################
+folder = "../data/processed/user_following/"
+journal_file = folder + "crawl_journal.sqlite"
 
 
 # ----- completed user ids ----- #
-completed_source_users = []
+completed_source_users = set()
 
-with open(this_addition, "r") as f:
-    for line in f:
-        process = line.split(" ", 1)
-        source = process.pop(0)
-        completed_source_users.append(source)
+for filename in sorted(glob.glob(folder + "saved_users*.txt")):
+    with open(filename, "r") as f:
+        for line in f:
+            source = line.split(" ", 1)[0].strip()
+            if source:
+                completed_source_users.add(source)
 
 # ----- rejected user ids ----- #
-rejected_users = []
-pattern = re.compile("user (\d+) and")
-
-with open(this_subtraction, "r") as log:
-    for line in log.readlines():
-        result = pattern.search(line)
-        if result:
-            rejected_users.append(line[result.start()+5:result.end()-4])
-
+rejected_users = {}
+# the pre-journal crawler wrote "@ user 123and cursor", with no space
+pattern = re.compile(r"user (\d+) ?and(?:.*response code (\d+))?")
+
+for filename in sorted(glob.glob(folder + "following_list_log*.txt")):
+    with open(filename, "r") as log:
+        for line in log:
+            result = pattern.search(line)
+            if result:
+                status = result.group(2)
+                rejected_users[result.group(1)] = \
+                    int(status) if status else None
+
+# a user that failed once but was crawled later is done
+for user in completed_source_users:
+    rejected_users.pop(user, None)
 
 print("completed users "+str(len(completed_source_users)))
 print("rejected users "+str(len(rejected_users)))
 
 
-# now remove completed & rejected user id's from query list
-with open("../data/processed/user_following/user_list.pkl", 'rb') as picklefile:
-     prev_user_list = pickle.load(picklefile)
-user_list = [item for item in prev_user_list if item not in
-          completed_source_users]
-user_list = [item for item in user_list if item not in rejected_users]
-with open('../data/processed/user_following/user_list.pkl', 'wb') as picklefile:
-    pickle.dump(user_list, picklefile)
+# ----- record them in the journal ----- #
+with CrawlJournal(journal_file) as journal:
+    journal.add_users(sorted(completed_source_users), state=DONE)
+    for status in set(rejected_users.values()):
+        journal.add_users(sorted(u for u, s in rejected_users.items()
+                                 if s == status), state=FAILED, status=status)
+    print(journal.counts())
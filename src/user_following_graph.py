@@ -3,59 +3,39 @@
 # For each user in g.nodes assign corpus, # followers, account age in years,
 # # of statuses, screen name of user @ time of scrape, and verified status
 #
-# Output is a serialized networkx digraph object, stored in GCP
+# Output is a memory-mappable .graph file (see graph_store.py), stored in GCP
 # Cloud Storage
 #
+# Run with --incremental to only read what the crawler has appended to the
+# following files since the last run and add it to the stored graph. The
+# users that gained edges are written out as dirty for
+# refresh_network_metrics_by_user.py.
+#
 # Input:
+# repo/data/processed/combo_users_sept19/
 # repo/data/processed/user_following/*
+# tweethis/raw/all_users_digraph.graph (--incremental)
+# tweethis/raw/all_users_digraph.ingest.json (--incremental)
 #
 # Output:
-# tweethis/raw/all_users_digraph.gpickle
+# tweethis/raw/all_users_digraph.graph
+# tweethis/raw/all_users_digraph.ingest.json
+# tweethis/raw/all_users_digraph.dirty.json
 ################################################################################
+import numpy as np
 import pandas as pd
-import networkx as nx
-import os
-import glob
 import logging
-from google.cloud import storage
+import json
+import sys
+from object_store import open_store
+from parquet_table import read_table
+from following_io import following_files, build_following_graph, \
+    update_following_graph, IngestState
+from graph_store import read_graph, write_graph
 
 logging.basicConfig(filename='user_following_graph.log',level=logging.DEBUG,
                     format='%(asctime)s %(message)s')
 
-# ---------------------------------------------------------------------------- #
-# Graph
-# ---------------------------------------------------------------------------- #
-logging.info("begin building digraph of user following relationships")
-
-folder_path = '../data/processed/user_following'
-g = nx.DiGraph()
-
-for filename in glob.glob(os.path.join(folder_path, '*.txt')):
-    try:
-        with open(filename, 'r') as f:
-            for line in f:
-                try:
-                    users = line.split(" ")
-                    users.pop(1)
-                    u = users[0].strip()
-
-                    for following in users[1:]:
-                            g.add_edge(u, following.strip())
-
-                except Exception:
-                    logging.debug("error reading line @ user {} in file "
-                                  "{}\n".format(u, filename))
-                    logging.error(exc_info=True)
-                    continue
-
-    except Exception:
-        logging.debug("error opening file {}\n".format(filename))
-        logging.error(exc_info=True)
-        continue
-
-logging.info("finish building digraph of user following relationships")
-
-
 # ---------------------------------------------------------------------------- #
 # In order to assign attributes (corpora, followers, no of tweets), import
 # a dataframe of users. Assign the string id as the index of the df.
@@ -66,89 +46,106 @@ logging.info("finish building digraph of user following relationships")
 # ---------------------------------------------------------------------------- #
 logging.info("import user attributes")
 
-all_users = pd.read_json("../data/processed/combo_user_df_sept19.json", dtype={
-    'id_str' : str})
-all_users.set_index('id_str', inplace=True)
+# only the columns that become node attributes below, indexed by id_str
+all_users = read_table("../data/processed/combo_users_sept19", columns=[
+    'corpus', 'followers_count', 'statuses_count', 'screen_name',
+    'years_old', 'verified'])
 
 
 # ---------------------------------------------------------------------------- #
-# Pare down to just our users
+# Graph
+#
+# Only edges between users in all_users.index are kept while reading the
+# following files, so the supergraph of every followed account is never
+# built. The result is an int32 CSR adjacency (see csr_graph.py).
 # ---------------------------------------------------------------------------- #
-logging.info("begin to pare down graph")
-
-# define the nodes that we want based on all_users.index
-nbunch = [n for n in g.nodes() if n in all_users.index]
-
-# h graph is a a sub-selection of g
-h = nx.DiGraph(g.subgraph(nbunch))
-
-# delete original graph
-del g
-
-logging.info("finished subgraph, deleted supergraph")
+logging.info("begin building digraph of user following relationships")
 
+folder_path = '../data/processed/user_following'
+file_name = 'all_users_digraph.graph'
+state_file_name = 'all_users_digraph.ingest.json'
+dirty_file_name = 'all_users_digraph.dirty.json'
+
+# artifact store, tweethis bucket by default, with downloads cached locally
+# (see object_store.py)
+store = open_store()
+
+if '--incremental' in sys.argv and store.exists('raw/'+file_name) and \
+        store.exists('raw/'+state_file_name):
+    logging.info("incremental: adding new following data to stored graph")
+    store.download('raw/'+state_file_name, state_file_name)
+    state = IngestState.load(state_file_name)
+
+    graph, dirty = update_following_graph(
+        read_graph(store.path('raw/'+file_name)),
+        following_files(folder_path), all_users.index, state,
+        processes=None)
+    dirty = list(graph.id_str[dirty])
+    logging.info("{} users gained edges or are new".format(len(dirty)))
+else:
+    state = IngestState()
+    graph = build_following_graph(following_files(folder_path),
+                                  all_users.index, state=state,
+                                  processes=None)
+    # null means every user is dirty: run network_metrics_by_user.py
+    dirty = None
+
+logging.info("finish building digraph of user following relationships: {} "
+             "nodes, {} edges".format(graph.number_of_nodes(),
+                                      graph.number_of_edges()))
 
 # ---------------------------------------------------------------------------- #
-# Assign attributes to nodes. All attributes are assigned as python strings
-# in order to export the graph in GML format later for analysis in gephi.
+# Assign attributes to nodes. Each attribute is kept as a typed column
+# aligned to the graph's node ids, filled from the user table with a single
+# reindex. Users missing from the table, or missing a value, get the default
+# below. Attributes are only turned into strings when the graph is exported.
 # ---------------------------------------------------------------------------- #
 logging.info("begin assigning attributes to nodes")
 
-for user in h.nodes:
-    # try to assign corpus, otherwise: neither
-    try:
-        h.nodes[user]['corpus'] = all_users.loc[user, 'corpus']
-    except:
-        h.nodes[user]['corpus'] = 'neither'
-    # try to assign following attribute; otherwise, neither
-    try:
-        h.nodes[user]['followers'] = str(all_users.loc[user, 'followers_count'])
-    except:
-        h.nodes[user]['followers'] = '0'
-    # try to assign no of statuses; otherwise, neither
-    try:
-        h.nodes[user]['StatusCount'] = str(all_users.loc[user, 'status_count'])
-    except:
-        h.nodes[user]['StatusCount'] = '0'
-    # try to assign scree_name, else 'None, Error'
-    try:
-        h.nodes[user]['ScreenName'] = str(all_users.loc[user, 'screen_name'])
-    except:
-        h.nodes[user]['ScreenName'] = 'None, Error'
-    # try to assign age of account, else 0
-    try:
-        h.nodes[user]['AcctYrs'] = str(all_users.loc[user, 'years_old'])
-    except:
-        h.nodes[user]['AcctYrs'] = '0'
-    # try to assign verified status: 1 true, 0 false, if error, assign 0
-    try:
-        h.nodes[user]['verified'] = str(all_users.loc[user, 'verified'])
-    except:
-        h.nodes[user]['verified'] = '0'
-
+# node attribute -> (column of all_users, dtype, default)
+node_attributes = {
+    'corpus': ('corpus', 'category', 'neither'),
+    'followers': ('followers_count', np.int64, 0),
+    'StatusCount': ('statuses_count', np.int64, 0),
+    'ScreenName': ('screen_name', object, 'None, Error'),
+    'AcctYrs': ('years_old', np.float64, 0.0),
+    'verified': ('verified', bool, False)}
+
+users = all_users.reindex(list(graph.id_str))
+
+for name, (column, dtype, default) in node_attributes.items():
+    if column in users:
+        values = users[column].astype(object).fillna(default)
+    else:
+        logging.warning("no {} column in user table, {} set to {!r}".format(
+            column, name, default))
+        values = pd.Series(default, index=users.index, dtype=object)
+    if dtype == 'category':
+        graph.set_node_attr(name, pd.Categorical(values))
+    else:
+        graph.set_node_attr(name, values.values.astype(dtype))
 
 logging.info("finish assigning attributes to nodes")
 
 # ---------------------------------------------------------------------------- #
-# Save graph to GCP cloud storage as a gpickle
+# Save graph to GCP cloud storage in our memory-mappable graph format (see
+# graph_store.py), along with how much of each following file it holds and
+# which users are dirty
 #
-# local file: all_users_digraph.gpickle
+# local file: all_users_digraph.graph
 # bucket name: tweethis
-# blob name:  raw/all_users_digraph.gpickle
+# blob name:  raw/all_users_digraph.graph
 # ---------------------------------------------------------------------------- #
-logging.info("begin save graph of our users to gpickle, protocol 4")
+logging.info("begin save graph of our users to .graph file")
 
-file_name = 'all_users_digraph.gpickle'
-
-nx.write_gpickle(h, file_name, protocol=4)
+write_graph(graph, file_name)
+state.save(state_file_name)
+with open(dirty_file_name, 'w') as f:
+    json.dump(dirty, f)
 
 logging.info("begin to write to GCP cloud storage bucket tweethis")
 
-client = storage.Client()
-bucket = client.get_bucket('tweethis')
-
-blob = bucket.blob('raw/'+file_name)
-
-blob.upload_from_filename(file_name)
+for local_file in (file_name, state_file_name, dirty_file_name):
+    store.upload(local_file, 'raw/'+local_file)
 
-logging.info("gpickle stored. program terminated")
+logging.info("graph stored. program terminated")
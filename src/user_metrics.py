@@ -0,0 +1,143 @@
+################################################################################
+# Node-level metrics computed straight from a graph's edge arrays.
+#
+# Every function takes a CSRGraph or SubgraphView and returns arrays aligned
+# to its node ids. Passing `rows` restricts the work to those nodes, which is
+# what the incremental refresh uses after new following edges land.
+#
+# corpus_metrics works out the whole degree family & reciprocity of every
+# corpus in one sweep over the edges of the full graph, straight into one
+# preallocated table, for network_metrics_by_user.py.
+################################################################################
+import numpy as np
+import pandas as pd
+
+
+def _rows(graph, rows):
+    if rows is None:
+        return np.arange(graph.number_of_nodes())
+    return np.asarray(rows, dtype=np.int64)
+
+
+def degrees(graph, rows=None):
+    """
+    :param graph: CSRGraph or SubgraphView
+    :param rows: optional array of node ids; default is all nodes
+    :return: (in degree, out degree) int arrays for rows
+    """
+    rows = _rows(graph, rows)
+    return graph.in_degree_array()[rows], graph.out_degree_array()[rows]
+
+
+def node_reciprocity(graph, rows=None):
+    """
+    Reciprocity of each node as networkx defines it: twice the number of
+    neighbours that are both followed and following, over in + out degree.
+
+    :param graph: CSRGraph or SubgraphView
+    :param rows: optional array of node ids; default is all nodes
+    :return: float array for rows, NaN for nodes with no edges
+    """
+    n = graph.number_of_nodes()
+    rows = _rows(graph, rows)
+    src, dst = graph.edge_arrays()
+    src = src.astype(np.int64)
+    dst = dst.astype(np.int64)
+
+    mutual = np.bincount(src[_reciprocated(src, dst, n)], minlength=n)[rows]
+    in_deg, out_deg = degrees(graph, rows)
+    total = (in_deg + out_deg).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, 2.0 * mutual / total, np.nan)
+
+
+def _reciprocated(src, dst, n):
+    """
+    :return: boolean array over the edges, True for u -> v if v -> u is an
+    edge too
+    """
+    keys = np.sort(src * n + dst)
+    reverse = dst * n + src
+    if len(keys) == 0:
+        return np.zeros(0, dtype=bool)
+    pos = np.minimum(np.searchsorted(keys, reverse), len(keys) - 1)
+    return keys[pos] == reverse
+
+
+def overall_reciprocity(graph):
+    """
+    Share of edges that are returned, like nx.overall_reciprocity.
+
+    :param graph: CSRGraph or SubgraphView
+    :return: float
+    """
+    src, dst = graph.edge_arrays()
+    src = src.astype(np.int64)
+    dst = dst.astype(np.int64)
+    if len(src) == 0:
+        raise ValueError("Not defined for empty graphs")
+    # networkx counts a self-loop as a single, unreturned edge
+    returned = _reciprocated(src, dst, graph.number_of_nodes()) & (src != dst)
+    return float(returned.sum()) / len(src)
+
+
+def corpus_metrics(partition, prefixes, rows=None):
+    """
+    In & out degree, degree / in degree / out degree centrality and
+    reciprocity of every node within its own corpus' subgraph, for several
+    corpora at once, from one pass over the edges of the whole graph.
+    Values match networkx on each corpus' subgraph, e.g. nx.degree_centrality
+    (degree / (n - 1), or 1 for a graph of one node) and nx.reciprocity.
+
+    :param partition: corpus_partition.CorpusPartition of the whole graph
+    :param prefixes: (prefix, corpus) pairs, e.g. (('t', 'todes'),); each
+    corpus gives columns prefix_in_deg, prefix_out_deg, prefix_deg_central,
+    prefix_in_deg_central, prefix_out_deg_central and prefix_reciprocity
+    :param rows: node ids of the whole graph to make rows for; default is
+    all nodes
+    :return: float64 DataFrame indexed by id_str, NaN where a node is not in
+    that column's corpus
+    """
+    graph = partition.graph
+    n = graph.number_of_nodes()
+    rows = _rows(graph, rows)
+    codes = partition.codes.astype(np.int64)
+    corpus_codes = [partition.code(corpus) for _, corpus in prefixes]
+
+    # edges inside one of the corpora; the corpora share no nodes, so one
+    # bincount gives every node its degrees within its own corpus
+    src, dst = graph.edge_arrays()
+    src = src.astype(np.int64)
+    dst = dst.astype(np.int64)
+    inside = (codes[src] == codes[dst]) & \
+        np.isin(codes[src], [c for c in corpus_codes if c >= 0])
+    src, dst = src[inside], dst[inside]
+    out_deg = np.bincount(src, minlength=n)[rows].astype(np.float64)
+    in_deg = np.bincount(dst, minlength=n)[rows].astype(np.float64)
+    mutual = np.bincount(src[_reciprocated(src, dst, n)],
+                         minlength=n)[rows]
+
+    # each node's scale is 1 / (n - 1) of its own corpus' subgraph
+    size = np.bincount(codes[codes >= 0],
+                       minlength=len(partition.labels)).astype(np.float64)
+    own = codes[rows]
+    scale = np.where(size[own] > 1, 1.0 / np.maximum(size[own] - 1, 1), 1.0)
+    total = in_deg + out_deg
+    with np.errstate(invalid='ignore', divide='ignore'):
+        reciprocity = np.where(total > 0, 2.0 * mutual / total, np.nan)
+    values = {'in_deg': in_deg, 'out_deg': out_deg,
+              'deg_central': total * scale,
+              'in_deg_central': in_deg * scale,
+              'out_deg_central': out_deg * scale,
+              'reciprocity': reciprocity}
+
+    # one float block for every column, filled in place
+    table = np.full((len(rows), len(prefixes) * len(values)), np.nan)
+    columns = []
+    for i, ((prefix, _), code) in enumerate(zip(prefixes, corpus_codes)):
+        here = (own == code) & (code >= 0)
+        for j, (name, value) in enumerate(values.items()):
+            table[here, i * len(values) + j] = value[here]
+            columns.append(prefix + '_' + name)
+    return pd.DataFrame(table, columns=columns,
+                        index=np.asarray(graph.id_str[rows], dtype=object))
@@ -0,0 +1,170 @@
+################################################################################
+# An on-disk table of the user objects returned by the twitter users/lookup
+# endpoint, written while the lookups are still coming in.
+#
+# UserTableWriter keeps one list per column and appends every user of a
+# response to them, so nothing is copied per row. Once batch_rows users have
+# piled up for a corpus they are turned into an Arrow table with a fixed
+# schema and written out as one Parquet file, and the buffers start again.
+# This keeps memory flat however many users are looked up. Files are
+# partitioned by the corpus the user was looked up for;
+#
+#   <path>/corpus=latinx/part-00000.parquet
+#   <path>/corpus=todes/part-00000.parquet
+#   ...
+#
+# A user in more than one corpus is looked up (and stored) once per corpus.
+# read_user_table folds them into one row per user with a 0/1 flag column
+# per corpus.
+#
+# Each response can be added with a key naming its batch of the lookup. Once
+# a part is on disk the keys of the batches in it are appended to
+# <path>/_manifest.jsonl, so an interrupted lookup can skip the batches it
+# has already stored (see done_batches). A crash between the two means a
+# batch is stored twice; read_user_table drops the duplicates.
+################################################################################
+import glob
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# fields kept from each user object. The types are fixed so a part in which
+# e.g. every url is null still matches the others.
+USER_SCHEMA = pa.schema([
+    ('id_str', pa.string()), ('name', pa.string()),
+    ('screen_name', pa.string()), ('location', pa.string()),
+    ('description', pa.string()), ('url', pa.string()),
+    ('entities', pa.string()), ('protected', pa.bool_()),
+    ('followers_count', pa.int64()), ('friends_count', pa.int64()),
+    ('listed_count', pa.int64()), ('created_at', pa.string()),
+    ('verified', pa.bool_()), ('statuses_count', pa.int64()),
+    ('lang', pa.string())])
+USER_COLUMNS = USER_SCHEMA.names
+
+# nested fields, stored as JSON strings
+JSON_COLUMNS = ['entities']
+
+# a leading _ keeps it out of the Parquet dataset
+MANIFEST = '_manifest.jsonl'
+
+
+class UserTableWriter:
+    """
+    Appends user objects to a corpus-partitioned Parquet table.
+    """
+
+    def __init__(self, path, batch_rows=10000):
+        """
+        :param path: directory of the table. Parts already in it are kept,
+        and new parts are numbered after them.
+        :param batch_rows: number of users to buffer per corpus before
+        writing them out
+        """
+        self.path = path
+        self.batch_rows = batch_rows
+        self.buffers = {}
+        self.keys = {}
+        self.rows = 0
+
+    def _empty(self):
+        return {c: [] for c in USER_COLUMNS}
+
+    def done_batches(self):
+        """
+        :return: set of (corpus, key) of the batches already stored
+        """
+        done = set()
+        try:
+            with open(os.path.join(self.path, MANIFEST), 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        done.add((entry['corpus'], entry['batch']))
+        except (IOError, OSError):
+            pass
+        return done
+
+    def add(self, users, corpus, key=None):
+        """
+        Buffer the user objects of one users/lookup response.
+
+        :param users: list of user dicts
+        :param corpus: name of the corpus they were looked up for
+        :param key: optional key of the batch, recorded in the manifest once
+        the users are on disk
+        """
+        if key is not None:
+            self.keys.setdefault(corpus, []).append(key)
+        buffer = self.buffers.setdefault(corpus, self._empty())
+        for user in users:
+            for c in USER_COLUMNS:
+                value = user.get(c)
+                if c in JSON_COLUMNS:
+                    value = json.dumps(value)
+                buffer[c].append(value)
+        self.rows += len(users)
+        if len(buffer['id_str']) >= self.batch_rows:
+            self.flush(corpus)
+
+    def flush(self, corpus=None):
+        """
+        Write out the buffered users of one corpus, or of every corpus.
+        """
+        corpora = list(self.buffers) if corpus is None else [corpus]
+        for corpus in corpora:
+            buffer = self.buffers.pop(corpus, None)
+            if buffer and buffer['id_str']:
+                folder = os.path.join(self.path, 'corpus=' + corpus)
+                os.makedirs(folder, exist_ok=True)
+                part = len(glob.glob(os.path.join(folder, 'part-*.parquet')))
+                pq.write_table(
+                    pa.Table.from_pydict(buffer, schema=USER_SCHEMA),
+                    os.path.join(folder, 'part-{:05d}.parquet'.format(part)))
+            self._record(corpus, self.keys.pop(corpus, []))
+
+    def _record(self, corpus, keys):
+        if not keys:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, MANIFEST), 'a') as f:
+            for key in keys:
+                f.write(json.dumps({'corpus': corpus, 'batch': key}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_user_table(path, corpora=('latinx', 'todes'), columns=None):
+    """
+    Read a user table into one row per user, with a 0/1 column per corpus
+    saying which corpora the user was looked up for.
+
+    :param path: directory of the table
+    :param corpora: names of the corpus flag columns, in order. Corpora in
+    the table but not listed are dropped from the flags.
+    :param columns: user columns to read; default is all of USER_COLUMNS
+    :return: DataFrame with the user columns followed by the corpus flags
+    """
+    columns = list(columns or USER_COLUMNS)
+    if 'id_str' not in columns:
+        columns = ['id_str'] + columns
+    df = pd.read_parquet(path, columns=columns + ['corpus'])
+    df['corpus'] = df['corpus'].astype(str)
+
+    # a single vectorized pass marks every corpus each user turned up in
+    flags = pd.crosstab(df['id_str'], df['corpus'])
+    flags = (flags.reindex(columns=list(corpora), fill_value=0) > 0) \
+        .astype(int)
+
+    users = df.drop(columns='corpus').drop_duplicates('id_str')
+    return users.join(flags, on='id_str').reset_index(drop=True)
@@ -0,0 +1,142 @@
+################################################################################
+# A concurrent client for the twitter users/lookup endpoint.
+#
+# Batches of up to 100 screen names are sent as POST requests (no url length
+# limit) over one pooled requests.Session per credential. Each credential
+# has several requests in flight at once, paced by a token bucket that
+# follows twitter's rate-limit headers (see twitter_api.py). Transient
+# failures are retried;
+# - 429: the credential's bucket is emptied until the reported reset
+# - 5xx or no response: exponential backoff with jitter
+# A batch that still fails after `retries` attempts is logged and skipped,
+# rather than ending the run; rerunning picks it up again.
+################################################################################
+import asyncio
+import functools
+import hashlib
+import logging
+import random
+import requests
+from requests.adapters import HTTPAdapter
+from twitter_api import TokenBucket, USERS_LOOKUP_LIMIT
+
+# screen names per users/lookup request
+BATCH_SIZE = 100
+
+
+def batch_key(names):
+    """
+    :param names: string of comma separated screen names
+    :return: a short key that identifies the batch across runs
+    """
+    return hashlib.sha1(names.encode('utf-8')).hexdigest()[:16]
+
+
+class LookupClient:
+    """
+    Looks up batches of screen names across several credentials.
+    """
+
+    def __init__(self, credentials, base_url, in_flight=4, retries=5,
+                 backoff=2.0):
+        """
+        :param credentials: list of OAuth1, one per credential set
+        :param base_url: base url of the API
+        :param in_flight: number of requests each credential may have in
+        flight at once
+        :param retries: attempts per batch before giving up on it
+        :param backoff: base of the exponential backoff, in seconds
+        """
+        self.base_url = base_url
+        self.in_flight = in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.credentials = []
+        for oauth in credentials:
+            session = requests.Session()
+            session.auth = oauth
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=in_flight)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.credentials.append((session, TokenBucket(USERS_LOOKUP_LIMIT)))
+        self.failed = []
+
+    async def _post(self, session, names):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(
+            session.post, self.base_url + "/users/lookup.json",
+            data={'screen_name': names}, timeout=60))
+
+    async def lookup(self, session, bucket, names):
+        """
+        Look up one batch of screen names, retrying transient failures.
+
+        :param names: string of comma separated screen names
+        :return: list of user dicts, or None if the batch failed
+        """
+        for attempt in range(self.retries):
+            await bucket.acquire()
+            try:
+                response = await self._post(session, names)
+            except requests.RequestException:
+                logging.warning("users/lookup request failed", exc_info=True)
+                status = None
+            else:
+                bucket.update(response.headers)
+                status = response.status_code
+                if status == 200:
+                    return response.json()
+                if status == 404:  # none of the names exist anymore
+                    return []
+                if status == 429:
+                    bucket.exhaust(response.headers)
+                    continue
+                if status < 500:
+                    logging.error("users/lookup returned {}: {}".format(
+                        status, response.text[:200]))
+                    return None
+            await asyncio.sleep(self.backoff * 2 ** attempt *
+                                random.uniform(0.5, 1.5))
+            logging.info("retrying users/lookup batch after {}".format(status))
+        return None
+
+    async def _worker(self, session, bucket, queue, on_result):
+        while True:
+            key, names = await queue.get()
+            try:
+                users = await self.lookup(session, bucket, names)
+                if users is None:
+                    self.failed.append(key)
+                    logging.error("giving up on users/lookup batch " + key)
+                else:
+                    on_result(key, users)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception:
+                self.failed.append(key)
+                logging.exception("error in users/lookup batch " + key)
+            finally:
+                queue.task_done()
+
+    async def run(self, batches, on_result):
+        """
+        Look up every batch.
+
+        :param batches: iterable of (key, comma separated screen names)
+        :param on_result: called with (key, list of user dicts) as each
+        batch completes, in the event loop's thread
+        """
+        queue = asyncio.Queue()
+        for batch in batches:
+            queue.put_nowait(batch)
+
+        workers = [asyncio.ensure_future(
+            self._worker(session, bucket, queue, on_result))
+            for session, bucket in self.credentials
+            for _ in range(self.in_flight)]
+        try:
+            await queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)